@@ -1,13 +1,26 @@
-import logging
-from logging.handlers import TimedRotatingFileHandler
 from os import getenv
 
+from .logs import make_logger
+
 def run_app():
-    from view import create_app
     from . import config
 
     environment = getenv('ENV', 'Debug')
     settings = config.Config if environment == 'Production' else config.DevConfig
+
+    if environment == 'Production' and settings.WORKERS > 0:
+        # the app is created by each of the workers, see `app.server`
+        from .server import serve
+        serve(
+            settings.__name__,
+            settings.HOST,
+            settings.PORT,
+            settings.WORKERS,
+            settings.THREADS,
+            settings.GRACEFUL_TIMEOUT)
+        return
+
+    from view import create_app
     app = create_app(settings=settings)
 
     app.run(
@@ -21,22 +34,3 @@ def load_json_config(path: str) -> dict:
     with open(path, 'r') as confile:
         settings = load(confile)
     return settings
-
-def make_logger(
-    name: str,
-    logfile: str) -> logging.Logger:
-
-    log = logging.getLogger(name)
-
-    if not log.hasHandlers(): 
-        DEBUGLEVEL = getenv('DEBUG_LEVEL','DEBUG')
-        log.disabled = getenv('LOG_ON', "True") == "False"
-
-        log.setLevel(getattr(logging, DEBUGLEVEL))
-
-        formatter = logging.Formatter('[%(asctime)s]::[%(levelname)s]::[%(name)s]::%(message)s', '%D # %H:%M:%S')
-        handler = TimedRotatingFileHandler(filename=f'{logfile}', encoding='utf-8', when='h', interval=5, backupCount=0)
-        handler.setFormatter(formatter)
-        log.addHandler(handler)
-
-    return log
\ No newline at end of file
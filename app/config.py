@@ -1,4 +1,4 @@
-from os import getenv
+from os import getenv, cpu_count
 from abc import ABC
 
 from . import load_json_config
@@ -10,9 +10,49 @@ class Config(ABC):
     DEBUG = bool(getenv('DEBUG', "True") == "True")
     ENCODING = getenv('ENCODING', 'utf-8')
     SECRET_KEY = getenv('APP_SECRET_KEY', 'cringe')
-    POLICIES = load_json_config('config/policies.json')
+    POLICIES_FILE = getenv('POLICIES_CONFIG', 'config/policies.json')
+    POLICIES = load_json_config(POLICIES_FILE)
+    POLICY_RELOAD_INTERVAL = float(getenv('POLICY_RELOAD_INTERVAL', 5))
     DB = load_json_config(getenv('DB_CONFIG','config/db.json'))
     QUERIES  = getenv('SQL_QUERY_DIR', 'sql/')
+    PAGE_SIZE = int(getenv('PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(getenv('MAX_PAGE_SIZE', 500))
+    IMPORT_BATCH_SIZE = int(getenv('IMPORT_BATCH_SIZE', 500))
+    IMPORT_MAX_ERRORS = int(getenv('IMPORT_MAX_ERRORS', 1000))
+    MAX_BATCH_ASSIGNMENT = int(getenv('MAX_BATCH_ASSIGNMENT', 1000))
+    OCCUPANCY_REFRESH_INTERVAL = float(getenv('OCCUPANCY_REFRESH_INTERVAL', 5))
+    OCCUPANCY_RECONCILE_INTERVAL = float(getenv('OCCUPANCY_RECONCILE_INTERVAL', 600))
+    # production server, `WORKERS=0` falls back to the development one
+    WORKERS = int(getenv('WORKERS', cpu_count() or 1))
+    THREADS = int(getenv('THREADS', 8))
+    GRACEFUL_TIMEOUT = float(getenv('GRACEFUL_TIMEOUT', 30))
+    # percent of requests to profile, `PROFILE_HEADER=True` also profiles requests with `X-Profile` header
+    PROFILE_SAMPLE = float(getenv('PROFILE_SAMPLE', 0))
+    PROFILE_HEADER = bool(getenv('PROFILE_HEADER', "False") == "True")
+    PROFILE_DIR = getenv('PROFILE_DIR', 'logs/profiles')
+    PROFILE_TOP = int(getenv('PROFILE_TOP', 20))
+    PROFILE_FLUSH_INTERVAL = float(getenv('PROFILE_FLUSH_INTERVAL', 5))
+    # named queries slower than this (seconds) are logged, a share of them with `EXPLAIN`
+    # at most once per interval for each query, see `database.slowlog`
+    SLOW_QUERY_THRESHOLD = float(getenv('SLOW_QUERY_THRESHOLD', 0.5))
+    SLOW_QUERY_EXPLAIN_SAMPLE = float(getenv('SLOW_QUERY_EXPLAIN_SAMPLE', 0.1))
+    SLOW_QUERY_EXPLAIN_INTERVAL = float(getenv('SLOW_QUERY_EXPLAIN_INTERVAL', 60))
+    # compiled templates shared by the workers, empty string disables the cache
+    TEMPLATE_CACHE_DIR = getenv('TEMPLATE_CACHE_DIR', 'cache/templates')
+    WARM_UP = bool(getenv('WARM_UP', "True") == "True")
+    # ETags of the pages change at least this often, to pick up writes made outside of the app
+    ETAG_MAX_AGE = int(getenv('ETAG_MAX_AGE', 300))
+    # static files are served under names with the hash of the content, see `view.assets`
+    ASSETS_FINGERPRINT = bool(getenv('ASSETS_FINGERPRINT', "True") == "True")
+    # HTML responses of at least this size are gzipped, 0 disables compression
+    COMPRESS_MIN_SIZE = int(getenv('COMPRESS_MIN_SIZE', 1024))
+    # read replica which failed to connect is skipped for this many seconds, see `database.routing`
+    DB_REPLICA_RETRY = float(getenv('DB_REPLICA_RETRY', 30))
+    # `/metrics` is open to anyone who can reach the app, keep it off unless scraped
+    METRICS_ENABLED = bool(getenv('METRICS_ENABLED', "False") == "True")
+    # snapshots of the workers summed up by `/metrics`, see `database.exposition`
+    METRICS_DIR = getenv('METRICS_DIR', 'logs/metrics')
+    METRICS_FLUSH_INTERVAL = float(getenv('METRICS_FLUSH_INTERVAL', 5))
 
 
 class DevConfig(Config):
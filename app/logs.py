@@ -0,0 +1,192 @@
+'''
+Non-blocking logging pipeline.
+
+Records from all the loggers of the process go to a single queue and are written
+to their files by one background thread. The thread drains the queue in batches and
+flushes each file once per batch, so request threads never wait for disk I/O.
+Records are not formatted on the calling thread either: messages passed as `%`-style
+args are only formatted by the writer (and not at all if the level is disabled)
+
+The workers of `app.server` share the log files: each batch is appended to a file
+with a single write, so lines of different workers never interleave. Files are not rotated
+by the app, rotate them externally (e.g. `logrotate`), the handlers reopen moved files
+'''
+import atexit
+import logging
+from logging.handlers import WatchedFileHandler
+from os import getenv, register_at_fork, write
+from queue import SimpleQueue, Empty
+from threading import Lock, Thread
+
+FORMAT = '[%(asctime)s]::[%(levelname)s]::[%(name)s]::%(message)s'
+DATEFMT = '%D # %H:%M:%S'
+
+BATCH_SIZE = int(getenv('LOG_BATCH_SIZE', 256))
+
+
+class BatchedFileHandler(WatchedFileHandler):
+    '''
+    File handler collecting the formatted records, the writer appends them
+    to the file once per batch with a single write (the file is opened with `O_APPEND`)
+    '''
+
+    def __init__(self, filename: str, encoding: str = 'utf-8') -> None:
+        super().__init__(filename, encoding=encoding)
+        self.pending = []
+
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.pending.append(self.format(record) + self.terminator)
+
+
+    def flush(self) -> None:
+        pass
+
+
+    def flush_batch(self) -> None:
+        if not self.pending: return
+        data = ''.join(self.pending).encode(self.encoding or 'utf-8')
+        self.pending = []
+        # moved away by the rotation
+        self.reopenIfNeeded()
+        if self.stream is None: self.stream = self._open()
+        descriptor = self.stream.fileno()
+        while data:
+            data = data[write(descriptor, data):]
+
+
+class QueueHandler(logging.Handler):
+    '''
+    Puts records into the queue of the writer, tagged with the target file
+    '''
+
+    def __init__(self, writer, logfile: str) -> None:
+        super().__init__()
+        self.writer = writer
+        self.logfile = logfile
+
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.writer.put(self.logfile, record)
+
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # filters are applied by the logger, the queue is thread-safe by itself
+        self.emit(record)
+        return True
+
+
+class LogWriter:
+    '''
+    Background writer owning the file handlers of the process
+    '''
+    STOP = object()
+
+    def __init__(self) -> None:
+        self.queue = SimpleQueue()
+        self.handlers = {}
+        self.lock = Lock()
+        self.thread = None
+
+
+    def handler_for(self, logfile: str) -> BatchedFileHandler:
+        with self.lock:
+            if logfile not in self.handlers:
+                handler = BatchedFileHandler(filename=logfile, encoding='utf-8')
+                handler.setFormatter(logging.Formatter(FORMAT, DATEFMT))
+                self.handlers[logfile] = handler
+            return self.handlers[logfile]
+
+
+    def put(self, logfile: str, record: logging.LogRecord) -> None:
+        if self.thread is None: self.start()
+        self.queue.put((logfile, record))
+
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is not None: return
+            self.thread = Thread(target=self.run, name='log-writer', daemon=True)
+            self.thread.start()
+
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+
+            touched = set()
+            for item in batch:
+                if item is self.STOP:
+                    self.flush(touched)
+                    return
+                logfile, record = item
+                handler = self.handler_for(logfile)
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+                touched.add(handler)
+
+            self.flush(touched)
+
+
+    def flush(self, handlers) -> None:
+        for handler in handlers:
+            try:
+                handler.flush_batch()
+            except OSError:
+                pass
+
+
+    def stop(self, timeout: float = 5) -> None:
+        thread = self.thread
+        if thread is None: return
+        self.queue.put(self.STOP)
+        thread.join(timeout)
+        self.thread = None
+
+
+    def after_fork(self) -> None:
+        # the thread is not inherited by the child, queued records belong to the parent
+        self.queue = SimpleQueue()
+        self.lock = Lock()
+        self.thread = None
+        for handler in self.handlers.values():
+            handler.createLock()
+            handler.pending = []
+
+
+WRITER = LogWriter()
+QUEUE_HANDLERS = {}
+
+atexit.register(WRITER.stop)
+register_at_fork(after_in_child=WRITER.after_fork)
+
+
+def queue_handler(logfile: str) -> QueueHandler:
+    handler = QUEUE_HANDLERS.get(logfile)
+    if handler is None:
+        handler = QUEUE_HANDLERS.setdefault(logfile, QueueHandler(WRITER, logfile))
+    return handler
+
+
+def make_logger(name: str, logfile: str) -> logging.Logger:
+    '''
+    Logger writing to the given file through the shared queue.
+    Level is taken from `DEBUG_LEVEL`, `LOG_ON=False` disables logging completely
+    '''
+    log = logging.getLogger(name)
+
+    if not log.handlers:
+        log.disabled = getenv('LOG_ON', "True") == "False"
+        log.setLevel(getattr(logging, getenv('DEBUG_LEVEL','DEBUG')))
+        log.addHandler(queue_handler(logfile))
+        # each logger writes to its own file only
+        log.propagate = False
+
+    return log
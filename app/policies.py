@@ -1,4 +1,7 @@
-from functools import wraps
+from os.path import getmtime
+from threading import Lock
+from time import monotonic
+from types import MappingProxyType
 
 from flask import (
     session,
@@ -7,33 +10,106 @@ from flask import (
     redirect,
     url_for)
 
+from . import load_json_config, make_logger
+
+policy_log = make_logger(__name__, 'logs/auth.log')
+
+
+class PolicyIndex:
+    '''
+    Immutable index of policies: group name -> frozenset of allowed blueprints
+    (empty string stands for the routes of the base app)
+    '''
+
+    def __init__(self, policies: dict) -> None:
+        self.groups = MappingProxyType({
+            group: frozenset(blueprints) for group, blueprints in policies.items() })
+
+
+    def allows(self, group: str, blueprint: str) -> bool:
+        return blueprint in self.groups.get(group, ())
+
+
+class PolicyStore:
+    '''
+    Holds compiled policy index and reloads it once the policies file changes.
+    The file is checked at most once per `interval` seconds, the new index replaces
+    the old one in a single assignment, so requests never see half-updated policies
+    '''
+
+    def __init__(self, path: str, policies: dict = None, interval: float = 5) -> None:
+        self.path = path
+        self.interval = interval
+        self._lock = Lock()
+        self._checked_at = monotonic()
+        self._mtime = getmtime(path)
+        self.index = PolicyIndex(policies if policies is not None else load_json_config(path))
+
+
+    def current(self) -> PolicyIndex:
+        if monotonic() - self._checked_at >= self.interval:
+            self._check()
+        return self.index
+
+
+    def _check(self) -> None:
+        if not self._lock.acquire(blocking=False): return
+        try:
+            self._checked_at = monotonic()
+            if getmtime(self.path) != self._mtime: self.reload()
+        except OSError as err:
+            policy_log.error(msg=f'Failed to check policies file: {err}')
+        finally:
+            self._lock.release()
+
+
+    def reload(self) -> None:
+        try:
+            mtime = getmtime(self.path)
+            index = PolicyIndex(load_json_config(self.path))
+        except (OSError, ValueError, AttributeError, TypeError) as err:
+            # keep the previous policies if the new ones are broken
+            policy_log.error(msg=f'Failed to reload policies, keeping the old ones: {err}')
+            return
+
+        self._mtime = mtime
+        self.index = index
+        policy_log.info(msg=f'Reloaded policies for groups: {sorted(index.groups)}')
+
+
 def authenticated() -> bool:
     group = session.get('group', '')
     return True if group else False
 
 
 def requires_login(func):
-
-    @wraps(func)
-    def has_group(*args, **kwargs):
-        return func(*args, **kwargs) if authenticated() else redirect(url_for('auth_bp.login'))
-    
-    return has_group
+    '''Mark the view as available for logged in users only, see `authorize()`'''
+    func.requires_login = True
+    return func
 
 
 def authorized() -> bool:
-    policies = current_app.config['POLICIES']
+    index = current_app.extensions['policies'].current()
     group = session.get('group', 'unauthorized')
+    return index.allows(group, request.blueprint or '')
 
-    target_service = "" if len(request.endpoint.split('.')) == 1 else request.endpoint.split('.')[0]
 
-    return True if group in policies and target_service in policies[group] else False
+def requires_permission(func):
+    '''Mark the view as available for groups allowed to use its blueprint, see `authorize()`'''
+    func.requires_permission = True
+    return func
 
 
-def requires_permission(func):
+def authorize():
+    '''
+    Single authorization pass for each request, registered with `before_request`.
+    Checks the marks set by `requires_login` and `requires_permission` on the target view
+    '''
+    view = current_app.view_functions.get(request.endpoint)
+    if view is None: return
+
+    if getattr(view, 'requires_login', False) and not authenticated():
+        return redirect(url_for('auth_bp.login'))
 
-    @wraps(func)
-    def has_permission(*args, **kwargs):
-        return func(*args, **kwargs) if authorized() else redirect(url_for('auth_bp.permission'))
-    
-    return has_permission
+    if getattr(view, 'requires_permission', False) and not authorized():
+        return redirect(url_for('auth_bp.permission'))
@@ -0,0 +1,258 @@
+'''
+Opt-in profiling of sampled requests.
+
+`PROFILE_SAMPLE` percent of requests (and, with `PROFILE_HEADER=True`, requests sent with
+`X-Profile` header) are run under `cProfile`, while a background thread samples their stacks.
+For each endpoint the merged profile is written to `PROFILE_DIR` as `<endpoint>.<pid>.pstats`
+(open with `python -m pstats`) and `<endpoint>.<pid>.collapsed` (input for flamegraph tools).
+The slowest profiled requests with the time split by layer are kept in `slowest.<pid>.json`.
+Profiles are merged in memory and the files are written by a background thread
+every `PROFILE_FLUSH_INTERVAL` seconds, not by the profiled requests.
+
+Only the request thread is profiled, queries run by `fan_out()` show up as waiting.
+With both settings off the hooks are not registered at all
+'''
+import atexit
+import cProfile
+import heapq
+import json
+import marshal
+import pstats
+import sys
+from collections import Counter
+from datetime import datetime
+from itertools import count
+from os import getpid, makedirs, register_at_fork
+from os.path import join
+from random import random
+from threading import Event, Lock, Thread, get_ident
+from time import perf_counter, sleep
+
+from flask import Flask, g, request
+
+from .logs import make_logger
+
+profile_log = make_logger(__name__, 'logs/app.log')
+
+HEADER = 'X-Profile'
+# seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# layers the own time of functions is attributed to, checked in order
+LAYERS = (
+    ('rendering', ('jinja2', 'markupsafe', '.j2')),
+    ('validation', ('schema.py', 'controller/__init__.py')),
+    ('database', ('pymysql', 'database/', 'socket', 'ssl')),
+    ('waiting', ('acquire', 'threading.py', 'concurrent/futures')),
+    ('controller', ('controller/',)),
+    ('view', ('view/',)),
+)
+
+
+def layer(filename: str, function: str) -> str:
+    # builtins have `~` as filename and describe themselves in the function name
+    where = function if filename == '~' else filename
+    for name, markers in LAYERS:
+        if any(marker in where for marker in markers): return name
+    return 'other'
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_filename.rsplit("/", 1)[-1]}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+class StackSampler:
+    '''
+    Background thread collecting folded stacks of the watched threads
+    '''
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.lock = Lock()
+        self.watched = {}
+        self.wakeup = Event()
+        self.thread = None
+
+
+    def watch(self) -> None:
+        with self.lock:
+            self.watched[get_ident()] = Counter()
+            self.wakeup.set()
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name='stack-sampler', daemon=True)
+                self.thread.start()
+
+
+    def unwatch(self) -> Counter:
+        with self.lock:
+            stacks = self.watched.pop(get_ident(), Counter())
+            if not self.watched: self.wakeup.clear()
+            return stacks
+
+
+    def run(self) -> None:
+        while True:
+            self.wakeup.wait()
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.watched.items():
+                    frame = frames.get(ident)
+                    names = []
+                    while frame is not None:
+                        names.append(frame_name(frame))
+                        frame = frame.f_back
+                    if names: stacks[';'.join(reversed(names))] += 1
+            del frames
+            sleep(self.interval)
+
+
+    def after_fork(self) -> None:
+        self.lock = Lock()
+        self.watched = {}
+        self.wakeup = Event()
+        self.thread = None
+
+
+SAMPLER = StackSampler(SAMPLE_INTERVAL)
+register_at_fork(after_in_child=SAMPLER.after_fork)
+
+
+class RequestProfiler:
+    '''
+    Profiles sampled requests between `before_request` and `teardown_request`,
+    so rendering of streamed responses is included
+    '''
+
+    def __init__(self, sample: float, allow_header: bool, directory: str, top: int, flush_interval: float = 5) -> None:
+        self.sample = sample / 100
+        self.allow_header = allow_header
+        self.directory = directory
+        self.top = top
+        self.flush_interval = flush_interval
+        self.seq = count()
+        self.after_fork()
+        register_at_fork(after_in_child=self.after_fork)
+
+
+    def after_fork(self) -> None:
+        # profiles of the parent are not the worker's ones
+        self.lock = Lock()
+        # endpoint -> (merged pstats.Stats, Counter of folded stacks)
+        self.endpoints = {}
+        # min-heap of (elapsed, seq, summary)
+        self.slowest = []
+        # endpoints and slowest requests changed since the last flush
+        self.dirty = set()
+        self.slowest_dirty = False
+        self.flusher = None
+
+
+    def init_app(self, app: Flask) -> None:
+        makedirs(self.directory, exist_ok=True)
+        # ahead of the other hooks, so that authorization is profiled as well
+        app.before_request_funcs.setdefault(None, []).insert(0, self.start)
+        app.teardown_request(self.stop)
+        # profiles collected since the last flush
+        atexit.register(self.flush)
+        profile_log.info(msg=f'Profiling {self.sample:.0%} of requests, header allowed: {self.allow_header}')
+
+
+    def sampled(self) -> bool:
+        if self.allow_header and HEADER in request.headers: return True
+        return random() < self.sample
+
+
+    def start(self) -> None:
+        if not self.sampled(): return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active in this process
+            return
+        SAMPLER.watch()
+        g.profile = (profile, perf_counter())
+
+
+    def stop(self, exc=None) -> None:
+        started = g.pop('profile', None)
+        if started is None: return
+        profile, started_at = started
+        profile.disable()
+        elapsed = perf_counter() - started_at
+        stacks = SAMPLER.unwatch()
+
+        try:
+            self.record(request.endpoint or 'unrouted', profile, stacks, elapsed)
+        except (OSError, TypeError) as err:
+            profile_log.error(msg=f'Failed to save profile of {request.path}: {err}')
+
+
+    def record(self, endpoint: str, profile: cProfile.Profile, stacks: Counter, elapsed: float) -> None:
+        stats = pstats.Stats(profile)
+        breakdown = Counter()
+        for (filename, _, function), (_, _, own_time, _, _) in stats.stats.items():
+            breakdown[layer(filename, function)] += own_time
+
+        summary = {
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'elapsed_ms': round(elapsed * 1e3, 2),
+            'breakdown_ms': { name: round(spent * 1e3, 2) for name, spent in breakdown.most_common() },
+        }
+        profile_log.info('Profiled %s %s in %.2f ms', request.method, summary['path'], summary['elapsed_ms'])
+
+        with self.lock:
+            merged = self.endpoints.get(endpoint)
+            if merged is None:
+                merged = self.endpoints[endpoint] = (stats, Counter())
+            else:
+                merged[0].add(stats)
+            merged[1].update(stacks)
+            self.dirty.add(endpoint)
+
+            if self.top > 0:
+                entry = (elapsed, next(self.seq), summary)
+                if len(self.slowest) < self.top:
+                    heapq.heappush(self.slowest, entry)
+                    self.slowest_dirty = True
+                elif elapsed > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, entry)
+                    self.slowest_dirty = True
+
+            if self.flusher is None:
+                self.flusher = Thread(target=self.run, name='profile-flusher', daemon=True)
+                self.flusher.start()
+
+
+    def run(self) -> None:
+        while True:
+            sleep(self.flush_interval)
+            self.flush()
+
+
+    def flush(self) -> None:
+        '''Write the profiles changed since the last flush'''
+        with self.lock:
+            # serialized under the lock, written without it
+            endpoints = { endpoint: (marshal.dumps(self.endpoints[endpoint][0].stats), list(self.endpoints[endpoint][1].items()))
+                for endpoint in self.dirty }
+            slowest = [ entry[2] for entry in sorted(self.slowest, reverse=True) ] if self.slowest_dirty else None
+            self.dirty, self.slowest_dirty = set(), False
+
+        try:
+            for endpoint, (stats, stacks) in endpoints.items():
+                name = join(self.directory, f'{endpoint}.{getpid()}')
+                with open(f'{name}.pstats', 'wb') as file:
+                    file.write(stats)
+                with open(f'{name}.collapsed', 'w') as file:
+                    file.writelines(f'{stack} {samples}\n' for stack, samples in stacks)
+
+            if slowest is not None:
+                with open(join(self.directory, f'slowest.{getpid()}.json'), 'w') as file:
+                    json.dump(slowest, file, indent=4, ensure_ascii=False)
+        except (OSError, TypeError) as err:
+            profile_log.error(msg=f'Failed to save profiles: {err}')
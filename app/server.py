@@ -0,0 +1,260 @@
+'''
+Pre-fork WSGI server for production runs.
+
+The master process binds the listening socket and forks `WORKERS` processes. Each worker
+creates its own app after fork, so connection pools, caches and the log writer are never
+shared between processes, and serves requests on a pool of `THREADS` threads.
+A worker with all the threads busy stops accepting, leaving connections to the others.
+
+Signals of the master:
+* `SIGHUP`: graceful reload, new workers (with configs read again) replace the old ones,
+  which finish the requests in progress first
+* `SIGTERM`, `SIGINT`: graceful shutdown
+
+Workers are given `GRACEFUL_TIMEOUT` seconds to finish, then they are killed
+'''
+import importlib
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from os import fork, getpid, kill, waitpid, WNOHANG, _exit
+from socketserver import ThreadingMixIn
+from threading import BoundedSemaphore, Thread
+from time import monotonic, sleep
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from .logs import make_logger, WRITER
+
+server_log = make_logger(__name__, 'logs/app.log')
+access_log = make_logger('access', 'logs/access.log')
+
+
+class RequestHandler(WSGIRequestHandler):
+    # idle keep-alive connections should not hold the threads
+    timeout = 5
+
+    def log(self, type: str, message: str, *args) -> None:
+        # through the log queue rather than to stderr of the worker
+        access_log.info('%s %s', self.address_string(), message % args)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    '''
+    WSGI server handling requests on a bounded pool of threads
+    '''
+    multithread = True
+    daemon_threads = True
+    process_request_thread = ThreadingMixIn.process_request_thread
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int = None) -> None:
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+        # taken before accepting, so the connection stays in the backlog while all threads are busy
+        self.slots = BoundedSemaphore(threads)
+        self.submitted = False
+        # the socket is shared by the workers, losers of the race for a connection should not block in `accept()`
+        self.socket.setblocking(False)
+
+
+    def _handle_request_noblock(self) -> None:
+        self.slots.acquire()
+        self.submitted = False
+        try:
+            super()._handle_request_noblock()
+        finally:
+            # nothing was accepted (other worker was faster) or the request was rejected
+            if not self.submitted: self.slots.release()
+
+
+    def process_request(self, request, client_address) -> None:
+        self.executor.submit(self.process_request_slot, request, client_address)
+        self.submitted = True
+
+
+    def process_request_slot(self, request, client_address) -> None:
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+
+    def handle_error(self, request, client_address) -> None:
+        server_log.exception('Error while handling request from %s', client_address)
+
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            # let the requests in progress finish
+            self.executor.shutdown(wait=True)
+
+
+class Master:
+    '''
+    Owner of the listening socket and the worker processes
+    '''
+
+    def __init__(self, settings: str, host: str, port: int, workers: int, threads: int, timeout: float) -> None:
+        self.settings = settings
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.timeout = timeout
+
+        self.socket = None
+        self.versions = None
+        # directory of the metrics snapshots of the workers, see `database.exposition`
+        self.metrics = None
+        self.running = {}
+        # pid -> deadline for workers asked to stop
+        self.stopping = {}
+        self.reload_requested = False
+        self.stop_requested = False
+        # workers failing on start are not restarted in a busy loop
+        self.respawn_after = 0
+
+
+    def run(self) -> None:
+        # data version counters are shared memory, it has to be mapped before the workers fork
+        from database.versions import VERSIONS
+        self.versions = VERSIONS
+
+        from . import config
+        settings = getattr(config, self.settings)
+        if settings.METRICS_ENABLED:
+            from database.exposition import clear
+            self.metrics = settings.METRICS_DIR
+            clear(self.metrics)
+
+        self.socket = socket.create_server((self.host, self.port), backlog=2048)
+        server_log.info(msg=f'Listening on {self.host}:{self.port}, {self.workers} workers x {self.threads} threads')
+
+        signal.signal(signal.SIGHUP, self._request_reload)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for _ in range(self.workers): self.spawn()
+
+        while not self.stop_requested:
+            if self.reload_requested: self.reload()
+            self.reap()
+            if monotonic() >= self.respawn_after:
+                for _ in range(self.workers - len(self.running)): self.spawn()
+            sleep(0.2)
+
+        self.shutdown()
+
+
+    def _request_reload(self, signum, frame) -> None:
+        self.reload_requested = True
+
+
+    def _request_stop(self, signum, frame) -> None:
+        self.stop_requested = True
+
+
+    def spawn(self) -> None:
+        pid = fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.socket, self.settings, self.threads)
+            except BaseException:
+                server_log.exception('Worker %s failed', getpid())
+                code = 1
+            finally:
+                # `_exit()` skips atexit hooks, flush the logs explicitly
+                WRITER.stop()
+                _exit(code)
+
+        self.running[pid] = monotonic()
+        server_log.info('Started worker %s', pid)
+
+
+    def terminate(self, pid: int) -> None:
+        self.running.pop(pid, None)
+        self.stopping[pid] = monotonic() + self.timeout
+        try:
+            kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.stopping.pop(pid)
+
+
+    def reload(self) -> None:
+        self.reload_requested = False
+        server_log.info(msg=f'Reloading workers')
+        # pages rendered by the old workers are not valid for the new code
+        self.versions.bump_reloads()
+        old = list(self.running)
+        for _ in range(self.workers): self.spawn()
+        for pid in old: self.terminate(pid)
+
+
+    def reap(self) -> None:
+        while self.running or self.stopping:
+            try:
+                pid, status = waitpid(-1, WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0: break
+
+            if self.running.pop(pid, None) is not None:
+                server_log.error('Worker %s exited unexpectedly with status %s', pid, status)
+                self.respawn_after = monotonic() + 1
+            self.stopping.pop(pid, None)
+
+            if self.metrics is not None:
+                from database.exposition import retire
+                retire(self.metrics, pid)
+
+        now = monotonic()
+        for pid, deadline in list(self.stopping.items()):
+            if deadline > now: continue
+            server_log.warning('Worker %s did not stop in time, killing', pid)
+            try:
+                kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                self.stopping.pop(pid)
+
+
+    def shutdown(self) -> None:
+        server_log.info(msg=f'Shutting down')
+        for pid in list(self.running): self.terminate(pid)
+        while self.stopping:
+            self.reap()
+            sleep(0.1)
+        self.socket.close()
+
+
+def run_worker(listener: socket.socket, settings: str, threads: int) -> None:
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    # ^C in the terminal reaches the whole group, the master decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from view import create_app
+    from . import config
+
+    # configs are read again, so that reload picks up their changes
+    config = importlib.reload(config)
+    app = create_app(settings=getattr(config, settings))
+
+    server = PooledWSGIServer(*listener.getsockname()[:2], app, threads, fd=listener.fileno())
+    stop = lambda signum, frame: Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+
+    server_log.info('Worker %s is serving', getpid())
+    # closes the server once stopped
+    server.serve_forever()
+    # counted up to the last request, the master keeps them once the worker exits
+    if 'metrics' in app.extensions: app.extensions['metrics'].flush()
+    server_log.info('Worker %s stopped', getpid())
+
+
+def serve(settings: str, host: str, port: int, workers: int, threads: int, timeout: float) -> None:
+    '''
+    Serve the app created with `settings` (name of the class from `app.config`)
+    '''
+    Master(settings, host, int(port), workers, threads, timeout).run()
@@ -0,0 +1,5 @@
+'''
+Benchmarks for the hot paths of the app.
+
+Run them from the root of the project, e.g. `python -m bench.validation`
+'''
@@ -0,0 +1,114 @@
+'''
+Benchmark of automatic assignment of newcome patients to a department.
+
+Compares the per-patient loop (`assign_patient` for each unassigned patient, two lookups
+and four writes per patient) with the batch engine (`assign_all`, one transaction).
+
+`plan` mode only measures the in-memory matching and needs no database.
+`db` mode WRITES to the database from the `hospital` config entry: it creates `--patients`
+new patients twice and assigns them to `--department`. Point it to a scratch schema
+'''
+import random
+from argparse import ArgumentParser
+from time import perf_counter
+from timeit import repeat
+
+from app import config
+from view import create_app
+
+
+def make_department(doctors: int, chambers: int) -> tuple:
+    doctor_rows = [ (i, f'Doctor{i}', 'Benchmark', random.randint(0, 20)) for i in range(doctors) ]
+    chamber_rows = []
+    for i in range(chambers):
+        totalspace = random.randint(2, 8)
+        chamber_rows.append((i, totalspace, random.randint(0, totalspace)))
+    return doctor_rows, chamber_rows
+
+
+def naive_plan(patients: list, doctors: list, chambers: list) -> list:
+    # what the per-patient loop does, without the round trips: scan for the best doctor and chamber each time
+    loads = { row[0]: row[3] for row in doctors }
+    free = { row[0]: row[1] - row[2] for row in chambers }
+    space = { row[0]: row[1] for row in chambers }
+    rows = { row[0]: row for row in doctors }
+
+    planned = []
+    for patient_id in patients:
+        available = [ chamber for chamber, places in free.items() if places > 0 ]
+        if not loads or not available: break
+        doctor = min(loads, key=lambda id: (loads[id], id))
+        chamber = min(available, key=lambda id: (-space[id], id))
+        loads[doctor] += 1
+        free[chamber] -= 1
+        planned.append((patient_id, rows[doctor], chamber))
+    return planned
+
+
+def bench_plan(args) -> None:
+    from controller.patients import plan_assignments
+
+    doctors, chambers = make_department(args.doctors, args.chambers)
+    patients = list(range(args.patients))
+    assert naive_plan(patients, doctors, chambers) == plan_assignments(patients, doctors, chambers), 'Plans differ'
+
+    results = {}
+    for name, plan in (('loop', naive_plan), ('heap', plan_assignments)):
+        best = min(repeat(lambda: plan(patients, doctors, chambers), number=args.number, repeat=args.repeat))
+        results[name] = best / args.number * 1e3
+        print(f'{name:>10}: {results[name]:8.3f} ms per {args.patients} patients')
+
+    print(f'   speedup: {results["loop"] / results["heap"]:8.1f}x')
+
+
+def seed_patients(controller, count: int, tag: str) -> None:
+    for i in range(count):
+        controller.create_patient_record({
+            'first_name': 'Benchmark',
+            'second_name': f'Patient{tag}{i}',
+            'passport': None,
+            'city': 'Moscow',
+            'date_birth': '1990-01-01',
+            'initial_diagnosis': 'Benchmark'
+        })
+
+
+def bench_db(args) -> None:
+    from controller.patients import PatientController
+
+    controller = PatientController()
+
+    seed_patients(controller, args.patients, 'loop')
+    patients = [ row[0] for row in controller.SOURCE.fetch_results('fetch-newcome-patients') or () ]
+    started = perf_counter()
+    assigned = sum(1 for patient_id in patients if controller.assign_patient(patient_id, args.department) is not None)
+    loop = perf_counter() - started
+    print(f'      loop: {loop * 1e3:10.1f} ms, {assigned} patients assigned')
+
+    seed_patients(controller, args.patients, 'batch')
+    started = perf_counter()
+    summary = controller.assign_all(args.department) or {}
+    batch = perf_counter() - started
+    print(f'     batch: {batch * 1e3:10.1f} ms, {summary.get("assigned", 0)} patients assigned')
+
+    if batch: print(f'   speedup: {loop / batch:10.1f}x')
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('mode', choices=('plan', 'db'), help='what to measure')
+    parser.add_argument('-p', '--patients', type=int, default=500, help='number of patients to assign')
+    parser.add_argument('-d', '--doctors', type=int, default=20, help='doctors in the department (plan mode)')
+    parser.add_argument('-c', '--chambers', type=int, default=150, help='chambers in the department (plan mode)')
+    parser.add_argument('--department', type=int, default=1, help='department to assign to (db mode)')
+    parser.add_argument('-n', '--number', type=int, default=20, help='runs per measurement (plan mode)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of measurements (plan mode)')
+    args = parser.parse_args()
+
+    with create_app(config.DevConfig).app_context():
+        if args.mode == 'plan': bench_plan(args)
+        else: bench_db(args)
+
+
+if __name__ == '__main__':
+    main()
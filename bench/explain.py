@@ -0,0 +1,91 @@
+'''
+Query plan check for the named queries.
+
+Runs `EXPLAIN` for every query of the sql directory against the seeded stand-in (see `bench.seed`,
+which applies `migrations/`) and exits with code 1 if any query reads a hot table with a full scan,
+i.e. a plan step of type `ALL` (table scan) or `index` (scan of the whole index).
+
+Placeholders are filled with `1` unless the query has sample args in `SAMPLE_ARGS`,
+plain `INSERT ... VALUES` statements read nothing and are skipped:
+
+    python -m bench.seed --yes
+    python -m bench.explain
+'''
+import sys
+from argparse import ArgumentParser
+from os.path import basename, dirname
+from re import compile, DOTALL, IGNORECASE
+
+from pymysql.err import Error
+
+from app import load_json_config
+from database import connect
+from database.registry import QueryRegistry
+
+# tables which grow with the hospital, scans of the rest are fine
+HOT_TABLES = frozenset(('patient', 'appointment', 'users'))
+# listings of the whole table, they read all of it anyway
+EXPECTED_SCANS = frozenset(('fetch-patients',))
+# subdirectories of the sql directory which belong to other entries of the db config
+ENTRIES = { 'policies': 'auth' }
+SAMPLE_ARGS = {
+    'fetch-patient-names': ((1, 2, 3),),
+    'validate-user-credentials': ('bench-admin', 'bench'),
+}
+FULL_SCANS = ('ALL', 'index')
+INSERT_VALUES = compile(r'^\s*INSERT\b(?!.*\bSELECT\b)', IGNORECASE | DOTALL)
+
+
+def explain(config: dict, sql: str, args: tuple) -> list:
+    with connect.Connection(config) as conn:
+        if not conn.CONNECTED: raise ConnectionError('Failed to connect, is the stand-in running?')
+        conn.CURSOR.execute(f'EXPLAIN {sql}', args)
+        columns = [ column[0] for column in conn.CURSOR.description ]
+        return [ dict(zip(columns, row)) for row in conn.CURSOR.fetchall() ]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db-config', default='config/db.json')
+    parser.add_argument('--sql-dir', default='sql/')
+    parser.add_argument('--query', nargs='*', help='check only these queries')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print plans of all the queries')
+    args = parser.parse_args()
+
+    config = load_json_config(args.db_config)
+    queries = QueryRegistry(args.sql_dir, hot_reload=False)
+
+    regressions, failures = [], []
+    for name in sorted(args.query or queries):
+        query = queries.get(name)
+        if query is None:
+            failures.append(f'{name}: unknown query')
+            continue
+        if INSERT_VALUES.match(query.text): continue
+
+        entry = ENTRIES.get(basename(dirname(query.path)), 'hospital')
+        sample = SAMPLE_ARGS.get(name, (1,) * query.arity)
+        try:
+            plan = explain(config[entry], query.text.strip().rstrip(';'), sample)
+        except (Error, ConnectionError) as err:
+            failures.append(f'{name}: {err}')
+            continue
+
+        scans = [ step for step in plan
+            if step.get('type') in FULL_SCANS and step.get('table') in HOT_TABLES ]
+        regressed = bool(scans) and name not in EXPECTED_SCANS
+        if regressed: regressions.append(name)
+
+        if args.verbose or regressed:
+            print(f'{name}{"  <-- full scan" if regressed else ""}')
+            for step in plan:
+                print(f'    {step.get("table")}: type={step.get("type")} key={step.get("key")} '
+                    f'rows={step.get("rows")} extra={step.get("Extra")}')
+
+    for failure in failures: print(failure, file=sys.stderr)
+    print(f'{len(regressions)} queries with full scans of hot tables, {len(failures)} failed to explain')
+    if regressions or failures: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+'''
+End-to-end load test of the running app.
+
+Logs in as each group of the policies config (users created by `bench.seed`, anonymous
+sessions for `unauthorized`) and drives a weighted mix of the routes the group may access,
+with `--users` concurrent sessions per group. Reports req/s and p50/p95/p99 latency per route.
+
+`--save` writes the results as a baseline, `--compare` checks them against a saved baseline
+and exits with code 1 if any route got slower (p95) or lost throughput beyond `--tolerance`.
+
+Typical run against the seeded stand-in:
+
+    python -m bench.seed --yes
+    ENV=Production python main.py &
+    python -m bench.load --url http://127.0.0.1:5000 --save bench/baseline.json
+'''
+import json
+import random
+import sys
+from argparse import ArgumentParser
+from collections import namedtuple
+from http.cookiejar import CookieJar
+from threading import Thread
+from time import monotonic, perf_counter
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import HTTPCookieProcessor, build_opener
+from zlib import crc32
+
+from app import load_json_config
+
+from .seed import PASSWORD
+
+Route = namedtuple('Route', ('name', 'blueprint', 'method', 'path', 'form', 'weight', 'writes'))
+
+def no_form(rng, args): return None
+
+ROUTES = (
+    Route('main-menu', '', 'GET', '/menu', no_form, 1, False),
+    Route('login-page', 'auth_bp', 'GET', '/auth/login', no_form, 1, False),
+
+    Route('hospital-menu', 'hospital_bp', 'GET', '/hospital/menu', no_form, 1, False),
+    Route('assigned-patients', 'hospital_bp', 'GET', '/hospital/assigned-patients', no_form, 4, False),
+    Route('appointments', 'hospital_bp', 'GET', '/hospital/appointments', no_form, 4, False),
+
+    Route('patients-menu', 'patients_bp', 'GET', '/patients/menu', no_form, 1, False),
+    Route('patient-list', 'patients_bp', 'GET', '/patients/list', no_form, 4, False),
+    Route('patient-list-page', 'patients_bp', 'GET',
+        lambda rng, args: f'/patients/list?after={rng.randint(1, args.max_patient)}', no_form, 2, False),
+    Route('patient-details', 'patients_bp', 'POST', '/patients/list',
+        lambda rng, args: { 'patient_id': rng.randint(1, args.max_patient) }, 2, False),
+    Route('discharge-list', 'patients_bp', 'GET', '/patients/discharge', no_form, 3, False),
+    Route('department-page', 'patients_bp', 'GET', '/patients/department', no_form, 1, False),
+    Route('department-report', 'patients_bp', 'POST', '/patients/department',
+        lambda rng, args: { 'selected_department': json.dumps({
+            'id': rng.randint(1, args.departments), 'title': 'Bench' }) }, 3, False),
+
+    Route('add-patient', 'patients_bp', 'POST', '/patients/add',
+        lambda rng, args: {
+            'first_name': 'Bench', 'second_name': 'Patient', 'passport': str(rng.randint(10 ** 9, 10 ** 10 - 1)),
+            'date_birth': '1990-01-01', 'city': 'Moscow', 'initial_diagnosis': 'Headache' }, 1, True),
+)
+
+# the app redirects here instead of answering with an error status
+DENIED = ('/auth/permission', '/auth/login', '/404')
+
+
+def routes_for(group: str, policies: dict, writes: bool) -> list:
+    allowed = set(policies.get(group, ()))
+    return [ route for route in ROUTES if route.blueprint in allowed and (writes or not route.writes) ]
+
+
+class VirtualUser(Thread):
+    '''
+    One session sending requests back to back until the deadline
+    '''
+
+    def __init__(self, base: str, group: str, routes: list, args, started: float, seed: int) -> None:
+        super().__init__(daemon=True)
+        self.base = base.rstrip('/')
+        self.group = group
+        self.routes = routes
+        self.args = args
+        self.measure_from = started + args.warmup
+        self.deadline = self.measure_from + args.duration
+        self.rng = random.Random(seed)
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        # route name -> (latencies, errors)
+        self.results = {}
+        self.failed = None
+
+
+    def open(self, path: str, form: dict = None) -> str or None:
+        '''Path the request landed on after redirects, `None` on failure'''
+        data = urlencode(form).encode() if form is not None else None
+        try:
+            with self.opener.open(self.base + path, data=data, timeout=self.args.timeout) as response:
+                response.read()
+                return urlsplit(response.url).path
+        except (HTTPError, URLError, OSError):
+            return
+
+
+    def request(self, path: str, form: dict = None) -> bool:
+        landed = self.open(path, form)
+        if landed is None: return False
+        return landed == urlsplit(path).path or landed not in DENIED
+
+
+    def login(self) -> bool:
+        if self.group == 'unauthorized': return True
+        # logged in users are redirected to the menu, invalid credentials render the form again
+        landed = self.open('/auth/login', { 'login': f'bench-{self.group}', 'password': PASSWORD })
+        return landed is not None and landed != '/auth/login'
+
+
+    def run(self) -> None:
+        if not self.login():
+            self.failed = f'Failed to log in as {self.group}'
+            return
+
+        weights = [ route.weight for route in self.routes ]
+        while True:
+            route = self.rng.choices(self.routes, weights)[0]
+            path = route.path(self.rng, self.args) if callable(route.path) else route.path
+
+            started = perf_counter()
+            ok = self.request(path, route.form(self.rng, self.args))
+            elapsed = perf_counter() - started
+
+            now = monotonic()
+            if now >= self.deadline: return
+            if now < self.measure_from: continue
+
+            latencies, errors = self.results.setdefault(route.name, ([], [0]))
+            latencies.append(elapsed)
+            if not ok: errors[0] += 1
+
+
+def percentile(ordered: list, share: float) -> float:
+    if not ordered: return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+def summarize(users: list, duration: float) -> dict:
+    merged = {}
+    for user in users:
+        for name, (latencies, errors) in user.results.items():
+            total = merged.setdefault(name, ([], [0]))
+            total[0].extend(latencies)
+            total[1][0] += errors[0]
+    merged['total'] = ([ latency for latencies, _ in merged.values() for latency in latencies ],
+        [sum(errors[0] for _, errors in merged.values())])
+
+    summary = {}
+    for name, (latencies, errors) in merged.items():
+        latencies.sort()
+        summary[name] = {
+            'requests': len(latencies),
+            'errors': errors[0],
+            'rps': round(len(latencies) / duration, 2),
+            'p50': round(percentile(latencies, 0.50) * 1e3, 2),
+            'p95': round(percentile(latencies, 0.95) * 1e3, 2),
+            'p99': round(percentile(latencies, 0.99) * 1e3, 2),
+        }
+    return summary
+
+
+def report(summary: dict) -> None:
+    print(f'{"route":<20}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for name, stats in sorted(summary.items(), key=lambda item: (item[0] == 'total', item[0])):
+        print(f'{name:<20}{stats["requests"]:>10}{stats["errors"]:>8}{stats["rps"]:>10}'
+            f'{stats["p50"]:>10}{stats["p95"]:>10}{stats["p99"]:>10}')
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    print(f'\n{"route":<20}{"p95 ms":>18}{"req/s":>18}')
+    for name, stats in sorted(summary.items()):
+        base = baseline.get(name)
+        if base is None: continue
+        slower = base['p95'] and stats['p95'] > base['p95'] * (1 + tolerance)
+        fewer = base['rps'] and stats['rps'] < base['rps'] * (1 - tolerance)
+        mark = ' <-- regression' if slower or fewer else ''
+        print(f'{name:<20}{base["p95"]:>8} -> {stats["p95"]:<7}{base["rps"]:>8} -> {stats["rps"]:<7}{mark}')
+        if mark: regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='address of the running app')
+    parser.add_argument('--policies', default='config/policies.json')
+    parser.add_argument('--groups', nargs='*', help='groups to log in as (all from policies by default)')
+    parser.add_argument('-u', '--users', type=int, default=4, help='concurrent sessions per group')
+    parser.add_argument('-d', '--duration', type=float, default=30, help='seconds to measure')
+    parser.add_argument('-w', '--warmup', type=float, default=3, help='seconds before measuring')
+    parser.add_argument('--timeout', type=float, default=10, help='request timeout')
+    parser.add_argument('--writes', action='store_true', help='include routes modifying the database')
+    parser.add_argument('--max-patient', type=int, default=20000, help='patient ids are picked up to this one')
+    parser.add_argument('--departments', type=int, default=10, help='department ids are picked up to this one')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--save', help='write the results to this baseline file')
+    parser.add_argument('--compare', help='compare the results with this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression')
+    args = parser.parse_args()
+
+    policies = load_json_config(args.policies)
+    groups = args.groups or list(policies)
+
+    started = monotonic()
+    users = []
+    for group in groups:
+        routes = routes_for(group, policies, args.writes)
+        if not routes: continue
+        for i in range(args.users):
+            users.append(VirtualUser(args.url, group, routes, args, started, crc32(f'{args.seed}/{group}/{i}'.encode())))
+
+    print(f'{len(users)} sessions of {groups}, {args.warmup}s warmup, {args.duration}s measured')
+    for user in users: user.start()
+    for user in users: user.join()
+
+    failures = { user.failed for user in users if user.failed }
+    for failure in failures: print(failure, file=sys.stderr)
+
+    summary = summarize(users, args.duration)
+    report(summary)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({ 'args': { key: value for key, value in vars(args).items() if key not in ('save', 'compare') },
+                'routes': summary }, file, indent=4)
+
+    if args.compare:
+        baseline = load_json_config(args.compare)['routes']
+        if compare(summary, baseline, args.tolerance): sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+CREATE TABLE roles (
+    role_id INT NOT NULL PRIMARY KEY AUTO_INCREMENT COMMENT 'Primary Key',
+    role_name VARCHAR(64) NOT NULL COMMENT 'Human readable name of the group',
+    role_alias VARCHAR(32) NOT NULL COMMENT 'Group name from policies config'
+) default charset utf8 COMMENT '';
+
+CREATE TABLE users (
+    user_id INT NOT NULL PRIMARY KEY AUTO_INCREMENT COMMENT 'Primary Key, id of the doctor for doctors',
+    user_name VARCHAR(128) NOT NULL COMMENT 'Name shown in the menu',
+    user_login VARCHAR(64) NOT NULL UNIQUE COMMENT 'Login',
+    user_password VARCHAR(128) NOT NULL COMMENT 'Password',
+    user_role INT NOT NULL COMMENT 'Role id',
+    FOREIGN KEY (user_role)
+        REFERENCES roles(role_id)
+) default charset utf8 COMMENT '';
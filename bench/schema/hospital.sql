@@ -0,0 +1,59 @@
+CREATE TABLE department (
+    id_department INT NOT NULL PRIMARY KEY AUTO_INCREMENT COMMENT 'Primary Key',
+    department_name VARCHAR(128) NOT NULL COMMENT 'Title',
+    department_head INT COMMENT 'Doctor id'
+) default charset utf8 COMMENT '';
+
+CREATE TABLE doctor (
+    id_doctor INT NOT NULL PRIMARY KEY AUTO_INCREMENT COMMENT 'Primary Key',
+    first_name VARCHAR(64) NOT NULL COMMENT 'First name',
+    second_name VARCHAR(64) NOT NULL COMMENT 'Second name',
+    workplace INT NOT NULL COMMENT 'Department id',
+    assigned_patients INT NOT NULL DEFAULT 0 COMMENT 'Number of attended patients',
+    date_hire DATE COMMENT 'Date of employment',
+    date_discharge DATE COMMENT 'Date of dismissal',
+    FOREIGN KEY (workplace)
+        REFERENCES department(id_department)
+) default charset utf8 COMMENT '';
+
+CREATE TABLE chamber (
+    id_chamber INT NOT NULL PRIMARY KEY AUTO_INCREMENT COMMENT 'Primary Key',
+    department INT NOT NULL COMMENT 'Department id',
+    class VARCHAR(64) NOT NULL COMMENT 'Chamber class',
+    totalspace INT NOT NULL COMMENT 'Number of places',
+    occupied INT NOT NULL DEFAULT 0 COMMENT 'Occupied places',
+    FOREIGN KEY (department)
+        REFERENCES department(id_department)
+) default charset utf8 COMMENT '';
+
+CREATE TABLE patient (
+    id_patient INT NOT NULL PRIMARY KEY AUTO_INCREMENT COMMENT 'Primary Key',
+    passport VARCHAR(16) COMMENT 'Passport number',
+    date_income DATE NOT NULL COMMENT 'Date of admission',
+    date_outcome DATE COMMENT 'Date of discharge',
+    date_birth DATE NOT NULL COMMENT 'Date of birth',
+    firstname VARCHAR(64) NOT NULL COMMENT 'First name',
+    secondname VARCHAR(64) NOT NULL COMMENT 'Second name',
+    city VARCHAR(64) COMMENT 'City',
+    initial_diagnosis TEXT COMMENT 'Diagnosis on admission',
+    outcome_diagnosis TEXT COMMENT 'Final diagnosis',
+    attending_doctor INT COMMENT 'Doctor id',
+    chamber_number INT COMMENT 'Chamber id',
+    FOREIGN KEY (attending_doctor)
+        REFERENCES doctor(id_doctor),
+    FOREIGN KEY (chamber_number)
+        REFERENCES chamber(id_chamber)
+) default charset utf8 COMMENT '';
+
+CREATE TABLE appointment (
+    id int NOT NULL primary key AUTO_INCREMENT COMMENT 'Primary Key',
+    assignee_id INT NOT NULL COMMENT 'Doctor id',
+    patient_id INT NOT NULL COMMENT 'Patient id',
+    scheduled DATETIME COMMENT 'Datetime of request',
+    about TEXT COMMENT 'Brief description',
+    progress INT UNSIGNED DEFAULT 0 COMMENT 'Mask',
+    FOREIGN KEY (assignee_id)
+        REFERENCES doctor(id_doctor),
+    FOREIGN KEY (patient_id)
+        REFERENCES patient(id_patient)
+) default charset utf8 COMMENT '';
@@ -0,0 +1,193 @@
+'''
+Seed a local MySQL stand-in for benchmarks.
+
+DROPS and re-creates the schemas named in the `hospital` and `auth` entries of the db config
+(base tables are taken from `bench/schema/`, then `migrations/` are applied), then fills them
+with generated departments, doctors, chambers, patients and appointments. For every group
+of the policies config except `unauthorized` a user `bench-<group>` with password `bench`
+is created, its id is an existing doctor id.
+
+Never point it to a database with data you need, `--yes` is required to run
+'''
+import datetime
+import random
+from argparse import ArgumentParser
+from os.path import dirname, join
+
+from pymysql import connect
+
+from app import load_json_config
+from database.migrate import MIGRATIONS_DIR, migrate, statements
+
+SCHEMA_DIR = join(dirname(__file__), 'schema')
+PASSWORD = 'bench'
+BATCH = 1000
+
+CLASSES = ('Эконом', 'Стандарт', 'Люкс')
+CITIES = ('Moscow', 'Tver', 'Kazan', 'Omsk', 'Perm')
+DIAGNOSES = ('Headache', 'Fracture', 'Flu', 'Bronchitis', 'Concussion')
+FIRST_NAMES = ('Ivan', 'Petr', 'Anna', 'Maria', 'Oleg', 'Olga', 'Nikita', 'Elena')
+SECOND_NAMES = ('Ivanov', 'Petrov', 'Sidorov', 'Smirnov', 'Volkov', 'Orlov', 'Popov')
+
+
+def reset_schema(entry: dict, ddl: str, migrations: str):
+    conn = connect(
+        host=entry['HOST'], port=int(entry['PORT']),
+        user=entry['USER'], password=entry['PASSWORD'],
+        charset='utf8', autocommit=True)
+
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS `{entry["SCHEMA"]}`')
+        cursor.execute(f'CREATE DATABASE `{entry["SCHEMA"]}` DEFAULT CHARACTER SET utf8')
+        cursor.execute(f'USE `{entry["SCHEMA"]}`')
+        for statement in statements(join(SCHEMA_DIR, ddl)):
+            cursor.execute(statement)
+
+    if migrate(entry, migrations) is None:
+        raise RuntimeError(f'Failed to apply {migrations}, see the db log')
+
+    conn.autocommit(False)
+    return conn
+
+
+def insert(conn, sql: str, rows: list) -> None:
+    with conn.cursor() as cursor:
+        for start in range(0, len(rows), BATCH):
+            cursor.executemany(sql, rows[start:start + BATCH])
+    conn.commit()
+
+
+def name() -> tuple:
+    return random.choice(FIRST_NAMES), random.choice(SECOND_NAMES)
+
+
+def seed_hospital(conn, args) -> dict:
+    today = datetime.date.today()
+
+    departments = [ (i, f'Отделение {i}') for i in range(1, args.departments + 1) ]
+    insert(conn, 'INSERT INTO department (id_department, department_name) VALUES (%s, %s)', departments)
+
+    doctors = {}
+    for i in range(1, args.doctors + 1):
+        department = (i - 1) % args.departments + 1
+        doctors[i] = [i, *name(), department, 0, today - datetime.timedelta(days=random.randint(30, 3000)), None]
+
+    chambers = {}
+    for i in range(1, args.chambers + 1):
+        department = (i - 1) % args.departments + 1
+        chambers[i] = [i, department, random.choice(CLASSES), random.randint(2, 6), 0]
+
+    by_department = {}
+    for chamber in chambers.values():
+        by_department.setdefault(chamber[1], []).append(chamber)
+    staff = {}
+    for doctor in doctors.values():
+        staff.setdefault(doctor[3], []).append(doctor)
+
+    patients, current = [], []
+    for i in range(1, args.patients + 1):
+        income = today - datetime.timedelta(days=random.randint(0, 365))
+        birth = today - datetime.timedelta(days=random.randint(18 * 365, 90 * 365))
+        row = [i, str(random.randint(10 ** 9, 10 ** 10 - 1)), income, None, birth, *name(),
+            random.choice(CITIES), random.choice(DIAGNOSES), None, None, None]
+
+        department = random.randint(1, args.departments)
+        free = [ chamber for chamber in by_department.get(department, []) if chamber[3] > chamber[4] ]
+        if random.random() < args.newcome or department not in staff:
+            pass
+        elif random.random() < args.discharged or not free:
+            row[3] = income + datetime.timedelta(days=random.randint(0, 30))
+            row[9] = random.choice(DIAGNOSES)
+            row[10] = random.choice(staff[department])[0]
+            row[11] = random.choice(by_department[department])[0]
+        else:
+            doctor, chamber = random.choice(staff[department]), random.choice(free)
+            doctor[4] += 1
+            chamber[4] += 1
+            row[10], row[11] = doctor[0], chamber[0]
+            if random.random() < args.dischargable: row[9] = random.choice(DIAGNOSES)
+            current.append(row)
+        patients.append(row)
+
+    insert(conn,
+        'INSERT INTO doctor (id_doctor, first_name, second_name, workplace, assigned_patients, date_hire, date_discharge)'
+        ' VALUES (%s, %s, %s, %s, %s, %s, %s)', list(doctors.values()))
+    insert(conn, 'UPDATE department SET department_head = %s WHERE id_department = %s',
+        [ (members[0][0], department) for department, members in staff.items() ])
+    insert(conn,
+        'INSERT INTO chamber (id_chamber, department, class, totalspace, occupied) VALUES (%s, %s, %s, %s, %s)',
+        list(chambers.values()))
+    insert(conn,
+        'INSERT INTO patient (id_patient, passport, date_income, date_outcome, date_birth, firstname, secondname,'
+        ' city, initial_diagnosis, outcome_diagnosis, attending_doctor, chamber_number)'
+        ' VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)', patients)
+
+    appointments = []
+    for i in range(1, (args.appointments if current else 0) + 1):
+        patient = random.choice(current)
+        scheduled = datetime.datetime.combine(today, datetime.time(random.randint(8, 18))) \
+            + datetime.timedelta(days=random.randint(-30, 30))
+        appointments.append((i, patient[10], patient[0], scheduled, 'Осмотр', random.randint(0, 3)))
+    insert(conn,
+        'INSERT INTO appointment (id, assignee_id, patient_id, scheduled, about, progress) VALUES (%s, %s, %s, %s, %s, %s)',
+        appointments)
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO department_occupancy (department, class, totalspace, occupied)'
+            ' SELECT department, class, SUM(totalspace), SUM(occupied) FROM chamber GROUP BY department, class')
+    conn.commit()
+
+    return {
+        'departments': len(departments),
+        'doctors': len(doctors),
+        'chambers': len(chambers),
+        'patients': len(patients),
+        'newcome': sum(1 for row in patients if row[10] is None),
+        'appointments': len(appointments),
+    }
+
+
+def seed_users(conn, policies: dict) -> list:
+    groups = [ group for group in policies if group != 'unauthorized' ]
+    insert(conn, 'INSERT INTO roles (role_id, role_name, role_alias) VALUES (%s, %s, %s)',
+        [ (i, group.capitalize(), group) for i, group in enumerate(groups, start=1) ])
+    insert(conn, 'INSERT INTO users (user_id, user_name, user_login, user_password, user_role) VALUES (%s, %s, %s, %s, %s)',
+        [ (i, f'Bench {group}', f'bench-{group}', PASSWORD, i) for i, group in enumerate(groups, start=1) ])
+    return [ f'bench-{group}' for group in groups ]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--yes', action='store_true', help='confirm that the schemas may be dropped')
+    parser.add_argument('--db-config', default='config/db.json')
+    parser.add_argument('--policies', default='config/policies.json')
+    parser.add_argument('--departments', type=int, default=10)
+    parser.add_argument('--doctors', type=int, default=100)
+    parser.add_argument('--chambers', type=int, default=500)
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--appointments', type=int, default=50000)
+    parser.add_argument('--newcome', type=float, default=0.1, help='share of unassigned patients')
+    parser.add_argument('--discharged', type=float, default=0.5, help='share of discharged among assigned')
+    parser.add_argument('--dischargable', type=float, default=0.2, help='share of current patients with final diagnosis')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    if not args.yes: parser.error('the schemas are dropped and re-created, pass --yes to confirm')
+    random.seed(args.seed)
+
+    config = load_json_config(args.db_config)
+    policies = load_json_config(args.policies)
+    if len(policies) > args.doctors: parser.error('need at least one doctor per policy group')
+
+    conn = reset_schema(config['hospital'], 'hospital.sql', join(MIGRATIONS_DIR, 'hospital'))
+    print('hospital:', seed_hospital(conn, args))
+    conn.close()
+
+    conn = reset_schema(config['auth'], 'auth.sql', join(MIGRATIONS_DIR, 'auth'))
+    print('users:', seed_users(conn, policies), f'password: {PASSWORD}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
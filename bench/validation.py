@@ -0,0 +1,105 @@
+'''
+Microbenchmark of per-request validation cost.
+
+Compares the former validation path (new `Schema` and logger lookup on each call,
+template for query params rebuilt per request) with compiled validators from `controller`
+'''
+import datetime
+from argparse import ArgumentParser
+from timeit import repeat
+
+from schema import Schema, SchemaError
+
+from app import make_logger
+from controller import Validator
+
+PATIENT = {
+    'first_name': 'Ivan',
+    'second_name': 'Petrov',
+    'passport': '4510123456',
+    'city': 'Moscow',
+    'date_birth': '1990-05-17',
+    'initial_diagnosis': 'Headache'
+}
+
+APPOINTMENT = {
+    'assignee': '12',
+    'patient': '345',
+    'about': 'Первичный прием',
+    'scheduled': datetime.datetime.today() + datetime.timedelta(days=1)
+}
+
+SCHEDULE = {
+    'is_final': None,
+    'about': 'Follow-up',
+    'schedule_to': '',
+    'appointment_id': '10',
+    'patient_id': '345'
+}
+
+QUERY_PARAMS = {'action': 'accept', 'appointment_id': '10', 'patient_id': '345'}
+
+INVALID_PATIENT = dict(PATIENT, first_name='Ivan1')
+
+
+def legacy_validate_object(given, expected) -> bool:
+    controller = make_logger('controller', 'logs/app.log')
+    try:
+        Schema(expected).validate(data=given)
+        return True
+    except SchemaError as scherr:
+        controller.error(msg=f'Validation error occured: {scherr}')
+        return False
+
+
+def legacy_validate_query_params(params: dict, expected_params: tuple) -> bool:
+    template = { param: object for param in expected_params}
+    template.update({ str: object })
+    return legacy_validate_object(params, template)
+
+
+def legacy_request():
+    legacy_validate_object(PATIENT, Validator.PATIENT_INSERT_TEMPLATE)
+    legacy_validate_object(APPOINTMENT, Validator.APPOINTMENT_INSERT_TEMPLATE)
+    legacy_validate_object(SCHEDULE, Validator.APPOINTMENT_UPDATE_TEMPLATE)
+    legacy_validate_query_params(QUERY_PARAMS, ('action', 'appointment_id'))
+
+
+def compiled_request():
+    Validator.validate_patient_data(PATIENT)
+    Validator.validate_appointment_data(APPOINTMENT)
+    Validator.validate_appointment_schedule(SCHEDULE)
+    Validator.validate_query_params(QUERY_PARAMS, ('action', 'appointment_id'))
+
+
+def check_verdicts() -> None:
+    # both paths should agree on valid and invalid data
+    samples = (
+        (PATIENT, Validator.PATIENT_INSERT_TEMPLATE, Validator.validate_patient_data),
+        (INVALID_PATIENT, Validator.PATIENT_INSERT_TEMPLATE, Validator.validate_patient_data),
+        (APPOINTMENT, Validator.APPOINTMENT_INSERT_TEMPLATE, Validator.validate_appointment_data),
+        (SCHEDULE, Validator.APPOINTMENT_UPDATE_TEMPLATE, Validator.validate_appointment_schedule),
+    )
+    for given, template, validate in samples:
+        assert legacy_validate_object(given, template) == validate(given), f'Verdicts differ for {given}'
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=2000, help='requests per measurement')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of measurements')
+    args = parser.parse_args()
+
+    check_verdicts()
+
+    results = {}
+    for name, request in (('legacy', legacy_request), ('compiled', compiled_request)):
+        best = min(repeat(request, number=args.number, repeat=args.repeat))
+        results[name] = best / args.number * 1e6
+        print(f'{name:>10}: {results[name]:8.1f} us per request')
+
+    print(f'   speedup: {results["legacy"] / results["compiled"]:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,174 @@
 from abc import ABC
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
 import datetime
 
 from schema import *
 
 from app import make_logger
 
+controller = make_logger(__name__, 'logs/app.log')
+
+
+def compile_check(expected):
+    '''
+    Compile schema into plain predicate for the fast path of validation.
+    The predicate never accepts data rejected by the schema, though it may reject
+    some valid data (then the full `Schema` decides). Raises `TypeError` for unsupported schemas
+    '''
+    if isinstance(expected, dict):
+        return compile_dict_check(expected)
+
+    if type(expected) in (list, tuple, set, frozenset):
+        raise TypeError(f'Iterable schemas are not supported: {expected}')
+
+    if isinstance(expected, type):
+        if expected is object: return lambda given: True
+        if expected is int: return lambda given: isinstance(given, int) and not isinstance(given, bool)
+        return lambda given: isinstance(given, expected)
+
+    # `Or` is a subclass of `And`, so it goes first
+    if isinstance(expected, Or):
+        if expected.only_one: raise TypeError(f'Unsupported validator: {expected}')
+        checks = tuple(compile_check(arg) for arg in expected.args)
+        return lambda given: any(check(given) for check in checks)
+
+    if isinstance(expected, And):
+        checks = tuple(compile_check(arg) for arg in expected.args)
+        return lambda given: all(check(given) for check in checks)
+
+    if hasattr(expected, 'validate'):
+        raise TypeError(f'Unsupported validator: {expected}')
+
+    if callable(expected):
+        def check(given) -> bool:
+            try:
+                return bool(expected(given))
+            except Exception:
+                return False
+        return check
+
+    return lambda given: given == expected
+
+
+def compile_dict_check(expected: dict):
+    required, literal, by_type = set(), {}, []
+
+    for key, value in expected.items():
+        is_optional = isinstance(key, Optional)
+        name = key.schema if is_optional else key
+
+        if isinstance(name, type):
+            by_type.append((name, compile_check(value), is_optional))
+            continue
+        if hasattr(name, 'validate') or callable(name):
+            raise TypeError(f'Unsupported key: {key}')
+
+        literal[name] = compile_check(value)
+        if not is_optional: required.add(name)
+
+    # required typed keys (e.g. `str: object`) have to match at least one of the extra keys
+    extra_required = any(not is_optional for _, _, is_optional in by_type)
+
+    def check(given) -> bool:
+        if not isinstance(given, dict): return False
+
+        has_extra = False
+        for key, value in given.items():
+            value_check = literal.get(key)
+            if value_check is not None:
+                if not value_check(value): return False
+                continue
+
+            for key_type, value_check, _ in by_type:
+                if isinstance(key, key_type): break
+            else:
+                return False
+            if not value_check(value): return False
+            has_extra = True
+
+        if extra_required and not has_extra: return False
+        return required.issubset(given.keys())
+
+    return check
+
+
+class CompiledValidator:
+    '''
+    Schema compiled once and reused for every validation
+
+    The fast path runs plain compiled predicate (see `compile_check()`), the full
+    `Schema` only runs if it fails, to report the validation error
+    '''
+
+    def __init__(self, expected) -> None:
+        self.schema = Schema(expected)
+        try:
+            self.fast_check = compile_check(expected)
+        except TypeError:
+            self.fast_check = None
+
+
+    def validate(self, given) -> bool:
+        if self.fast_check is not None and self.fast_check(given): return True
+        try:
+            self.schema.validate(data=given)
+            return True
+        except SchemaError as scherr:
+            controller.error(msg=f'Validation error occured: {scherr}')
+            return False
+        except Exception as e:
+            controller.fatal(msg=f'Something went wrong during validation, exception info: {e}')
+            return False
+
+
+# validators of the templates given to `validate_object()`, keyed by id of the template.
+# The template is kept along, so that its id is not reused while the entry lives;
+# the cache is bounded since templates built per call would never be looked up again
+COMPILED = OrderedDict()
+COMPILED_SIZE = 64
+COMPILED_LOCK = Lock()
+
+def compiled_validator(expected) -> CompiledValidator:
+    with COMPILED_LOCK:
+        entry = COMPILED.get(id(expected))
+        if entry is not None and entry[0] is expected:
+            COMPILED.move_to_end(id(expected))
+            return entry[1]
+
+    validator = CompiledValidator(expected)
+    with COMPILED_LOCK:
+        COMPILED[id(expected)] = (expected, validator)
+        COMPILED.move_to_end(id(expected))
+        while len(COMPILED) > COMPILED_SIZE:
+            COMPILED.popitem(last=False)
+    return validator
+
+
+@lru_cache(maxsize=64)
+def compiled_from_string(expected: str) -> CompiledValidator:
+    return CompiledValidator(eval(expected))
+
+
 def validate_string(given, expected: str) -> bool:
-    controller = make_logger(__name__, 'logs/app.log')
     try:
-        validator = Schema(eval(expected))
-        validator.validate(data=given)
-        return True
-    except SchemaError as scherr:
-        controller.error(msg=f'Validation error occured: {scherr}')
-        return False
+        validator = compiled_from_string(expected)
     except Exception as e:
         controller.fatal(msg=f'Something went wrong during validation, exception info: {e}')
         return False
+    return validator.validate(given)
 
 
 def validate_object(given, expected) -> bool:
-    controller = make_logger(__name__, 'logs/app.log')
-    try:
-        validator = Schema(expected)
-        validator.validate(data=given)
-        return True
-    except SchemaError as scherr:
-        controller.error(msg=f'Validation error occured: {scherr}')
-        return False
-    except Exception as e:
-        controller.fatal(msg=f'Something went wrong during validation, exception info: {e}')
-        return False
+    return compiled_validator(expected).validate(given)
+
+
+@lru_cache(maxsize=64)
+def query_params_validator(expected_params: tuple) -> CompiledValidator:
+    template = { param: object for param in expected_params}
+    template.update({ str: object })
+    return CompiledValidator(template)
 
 
 class Validator(ABC):
@@ -66,26 +204,73 @@ class Validator(ABC):
 
     @staticmethod
     def validate_patient_data(patient_data) -> bool:
-        return validate_object(patient_data, Validator.PATIENT_INSERT_TEMPLATE)
+        return PATIENT_INSERT_VALIDATOR.validate(patient_data)
 
 
     @staticmethod
     def validate_appointment_data(appointment_data) -> bool:
-        return validate_object(appointment_data, Validator.APPOINTMENT_INSERT_TEMPLATE)
+        return APPOINTMENT_INSERT_VALIDATOR.validate(appointment_data)
 
 
     @staticmethod
     def validate_appointment_schedule(appointment_schedule) -> bool:
-        return validate_object(appointment_schedule, Validator.APPOINTMENT_UPDATE_TEMPLATE)
+        return APPOINTMENT_UPDATE_VALIDATOR.validate(appointment_schedule)
 
 
     @staticmethod
     def validate_query_params(params: dict, expected_params: tuple) -> bool:
-        template = { param: object for param in expected_params}
-        template.update({ str: object })
-        return validate_object(params, template)
+        return query_params_validator(tuple(expected_params)).validate(params)
 
     
     @staticmethod
     def validate_diagnosis_metadata(request_values) -> bool:
-        return validate_object(request_values, Validator.DIAGNOSIS_METADATA_TEMPLATE)
+        return DIAGNOSIS_METADATA_VALIDATOR.validate(request_values)
+
+
+# templates are compiled once, at import
+PATIENT_INSERT_VALIDATOR = CompiledValidator(Validator.PATIENT_INSERT_TEMPLATE)
+APPOINTMENT_INSERT_VALIDATOR = CompiledValidator(Validator.APPOINTMENT_INSERT_TEMPLATE)
+APPOINTMENT_UPDATE_VALIDATOR = CompiledValidator(Validator.APPOINTMENT_UPDATE_TEMPLATE)
+DIAGNOSIS_METADATA_VALIDATOR = CompiledValidator(Validator.DIAGNOSIS_METADATA_TEMPLATE)
+
+
+class Page:
+    '''
+    One page of keyset-paginated listing
+
+    Created from raw rows fetched with `limit + 1` rows requested (the extra row tells whether
+    there are more records). Rows are keyed by their first column (primary key);
+    `next` and `prev` are the keys to request neighbour pages with `after` and `before` respectively.
+    Iterating over the page yields `items`, i.e. processed rows set by the controller
+    '''
+
+    def __init__(self, rows: list, limit: int, after: int = None, before: int = None) -> None:
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        self.limit = limit
+        self.next = self.prev = None
+
+        if before is not None:
+            # rows were fetched in descending order
+            rows.reverse()
+            if rows: self.next = rows[-1][0]
+            if has_more: self.prev = rows[0][0]
+        else:
+            if has_more: self.next = rows[-1][0]
+            if after and rows: self.prev = rows[0][0]
+
+        self.rows = rows
+        self.items = iter(())
+
+
+    def fill(self, items):
+        self.items = items
+        return self
+
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
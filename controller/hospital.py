@@ -8,6 +8,7 @@ from flask import current_app
 from database.ORM import DataSource, DataModifier
 from app import make_logger
 from . import Validator
+from .occupancy import OCCUPANCY
 
 hospital_log = make_logger(__name__, 'logs/hospital.log')
 
@@ -16,6 +17,12 @@ SQL_DIR = current_app.config.get('QUERIES')
 
 class HospitalController:
 
+    APPOINTMENT_ACTIONS = {
+        'complete': 3,
+        'accept': 1,
+        'reject': 2
+        }
+
     def __init__(self, db_settings: dict = DB_CONFIG, sql_dir: str = SQL_DIR) -> None:
         if db_settings is None or sql_dir is None:
             hospital_log.fatal(msg=f'Recieved this: {db_settings} and {sql_dir}')
@@ -27,7 +34,7 @@ class HospitalController:
 
 
     def get_department_list(self) -> None or tuple:
-        # candidate for caching
+        # cached by the data layer, see `CACHE` section of db config
         hospital_log.debug(msg=f'Fetches department list')
         selected = self.SOURCE.fetch_results('department-list')
 
@@ -49,16 +56,23 @@ class HospitalController:
     def make_department_report(self, department_id: int, department_name: str = 'N/A') -> None or tuple:
         hospital_log.debug(msg=f'Produces report for selected department {department_id}')
 
-        chambers_info = self.SOURCE.fetch_results('department-report', department_id)
-        doctors_info = self.SOURCE.fetch_results('department-doctors', department_id)
+        rollup = OCCUPANCY.report(department_id)
+
+        if rollup is not None:
+            chambers_info, doctors_info = rollup
+            department_head = self.SOURCE.fetch_results('department-head', department_id)
+        else:
+            # independent queries, run concurrently
+            chambers_info, doctors_info, department_head = self.SOURCE.fetch_many(
+                ('department-report', department_id),
+                ('department-doctors', department_id),
+                ('department-head', department_id))
 
         if not chambers_info or not doctors_info:
             hospital_log.error(msg=f'Failed to create report:\
              is SQL server running? See db logs for more detailed info')
             return
 
-        department_head = self.SOURCE.fetch_results('department-head', department_id)
-
         try:
             department_head = list(department_head)[0]
         except (TypeError, IndexError):
@@ -104,7 +118,7 @@ class HospitalController:
 
 
     def get_doctors(self) -> None or tuple:
-        # also condidate for caching
+        # cached by the data layer as well
         hospital_log.debug(msg=f'Fetches list of doctors')
         selected = self.SOURCE.fetch_results('select-doctorlist')
 
@@ -189,6 +203,8 @@ class HospitalController:
             hospital_log.warning(msg=f'Failed to fetch appointments satisfying {by}={value}')
             return
 
+        filtered = list(filtered)
+
         handle_null = lambda s: s if s else 'N/A'
 
         def handle_status_code(s: int) -> str:
@@ -198,49 +214,52 @@ class HospitalController:
             if s == 3: return u'Завершен'
             return 'Неизвестный статус'
 
+        # the queries join patient initials to each appointment,
+        # rows without them are resolved with a single batched lookup
+        unresolved = { row[2] for row in filtered if len(row) < 8 }
+        names = self.get_patient_names(unresolved) if unresolved else {}
+
+        def patient_name(row) -> str:
+            if len(row) >= 8:
+                return ' '.join(row[6:8]) if row[6] is not None else 'N/A'
+            return names.get(row[2], 'N/A')
 
         def process_rows():
             for i, row in enumerate(filtered, start=1):
-                try:
-                    initials = self.SOURCE\
-                        .fetch_results('fetch-patient-byid', row[2])
-                    initials = list(initials)[0]
-                    yield {
-                        'num': i,
-                        'id': row[0],
-                        'assignee': row[1],
-                        'patient_id': row[2],
-                        'patient': ' '.join(initials[5:7]),
-                        'about': handle_null(row[4]),
-                        'scheduled': handle_null(row[3]),
-                        'status': handle_status_code(row[5]),
-                        'status_code': row[5]
-                    }
-                except (TypeError, IndexError):
-                    hospital_log.warning(msg=f'Exception occured while processing row: {row}')
-                    yield {
-                        'num': i,
-                        'id': row[0],
-                        'assignee': row[1],
-                        'patient_id': row[2],
-                        'patient': 'N/A',
-                        'about': handle_null(row[4]),
-                        'scheduled': handle_null(row[3]),
-                        'status': handle_status_code(row[5]),
-                        'status_code': row[5]
-                    }
+                yield {
+                    'num': i,
+                    'id': row[0],
+                    'assignee': row[1],
+                    'patient_id': row[2],
+                    'patient': patient_name(row),
+                    'about': handle_null(row[4]),
+                    'scheduled': handle_null(row[3]),
+                    'status': handle_status_code(row[5]),
+                    'status_code': row[5]
+                }
 
         hospital_log.info(msg=f'Successfully fetched appointments')
         return process_rows()
 
 
+    def get_patient_names(self, patient_ids) -> dict:
+        '''
+        Resolve names for several patients in one round trip, return mapping of patient id to name
+        '''
+        patient_ids = tuple(patient_ids)
+        if not patient_ids: return {}
+
+        selected = self.SOURCE.fetch_results('fetch-patient-names', patient_ids)
+        if selected is None:
+            hospital_log.warning(msg=f'Failed to resolve names of {len(patient_ids)} patients')
+            return {}
+
+        return { row[0]: ' '.join(row[1:3]) for row in selected }
+
+
     def update_appointment(self, action: str, appointment_id) -> None:
         hospital_log.debug(msg=f'Updates appointment status')
-        options = {
-            'complete': 3,
-            'accept': 1,
-            'reject': 2
-            }
+        options = self.APPOINTMENT_ACTIONS
 
         if action not in options.keys():
             hospital_log.error(msg=f'Invalid action: {action}')
@@ -263,8 +282,14 @@ class HospitalController:
 
 
         if is_final:
-            self.MODIFIER.update_table('set-diagnosis', comment, patient_id)
-            self.update_appointment('complete', appointment_id)
+            with self.MODIFIER.transaction() as tx:
+                tx.update_table('set-diagnosis', comment, patient_id)
+                tx.update_table('update-appointment', self.APPOINTMENT_ACTIONS['complete'], appointment_id)
+
+            if not tx.COMMITTED:
+                hospital_log.error(msg=f'Failed to set final diagnosis to {patient_id}, changes rolled back')
+                return
+
             hospital_log.info(msg=f'Have set final diagnosis to {patient_id}')
             return
 
@@ -0,0 +1,229 @@
+'''
+Occupancy of departments: places in chambers by chamber class and loads of doctors
+'''
+from threading import Lock
+from time import monotonic
+
+from flask import current_app
+
+from database.ORM import DataModifier
+from app import make_logger
+
+occupancy_log = make_logger(__name__, 'logs/hospital.log')
+
+DB_CONFIG = current_app.config['DB'].get('hospital')
+SQL_DIR = current_app.config.get('QUERIES')
+
+
+def as_id(value) -> int or None:
+    # ids often come straight from the request form
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return
+
+
+class OccupancyRollup:
+    '''Incrementally maintained summary of department occupancy.
+
+    Chamber totals are materialized in `department_occupancy` table
+    (see `migrations/hospital/0001_department_occupancy.sql`). The table is updated in the same transactions
+    as `chamber.occupied` (see `track()`) and rebuilt from `chamber` once per `reconcile_interval`
+    to fix the drift left by writes made outside of the app. The rebuild is an upsert locking
+    `chamber` before the rollup, like the assignments do, and is run by one worker at a time
+    (the others skip it while the named lock is taken).
+
+    The in-memory mirror is reloaded from the table once per `refresh_interval` and patched
+    right after the commits of this process (see `apply()`), so reports are served without queries.
+    Until the mirror is loaded the rollup is unavailable and the callers should use the base tables.
+    Writes are tracked as soon as the table exists, whether or not this process has loaded the mirror
+    '''
+
+    def __init__(self, modifier: DataModifier, refresh_interval: float = 5, reconcile_interval: float = 600) -> None:
+        self.modifier = modifier
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+        self.available = False
+        # `department_occupancy` is known to exist, it is not dropped once created
+        self.tracked = False
+
+        self._refresh_lock = Lock()
+        self._lock = Lock()
+        self._refreshed_at = None
+        self._reconciled_at = None
+        self._checked_at = None
+        # bumped by `apply()` so that a reload racing with a write is not trusted
+        self._version = 0
+
+        # department -> ({class: [totalspace, occupied]}, {doctor id: [first name, second name, assigned]})
+        self._departments = {}
+        # department -> (chamber rows, doctor rows) ready to be served
+        self._reports = {}
+        self._chambers = {}
+        self._doctors = {}
+
+
+    @staticmethod
+    def _due(at: float or None, interval: float) -> bool:
+        return at is None or monotonic() - at >= interval
+
+
+    def current(self) -> bool:
+        '''Refresh the mirror if it is due, return whether the rollup can be used'''
+        if self._due(self._refreshed_at, self.refresh_interval):
+            self._refresh()
+        return self.available
+
+
+    def _refresh(self) -> None:
+        if not self._refresh_lock.acquire(blocking=False): return
+        try:
+            if self._due(self._reconciled_at, self.reconcile_interval) and not self.reconcile():
+                self.available = False
+                self._refreshed_at = monotonic()
+                return
+            self.available = self._load()
+            if not self.available: self._refreshed_at = monotonic()
+        finally:
+            self._refresh_lock.release()
+
+
+    def reconcile(self) -> bool:
+        '''Rebuild `department_occupancy` from `chamber` and reload the chamber locations'''
+        with self.modifier.transaction() as tx:
+            locked = tx.fetch_results('occupancy-lock')[0][0] == 1
+            try:
+                # otherwise another worker is rebuilding right now
+                if locked: tx.update_table('occupancy-rebuild')
+                chambers = tx.fetch_results('occupancy-chamber-map')
+            finally:
+                # the lock belongs to the session, the connection goes back to the pool
+                if locked: tx.fetch_results('occupancy-unlock')
+
+        if not tx.COMMITTED:
+            occupancy_log.error(msg=f'Failed to reconcile department occupancy, is the rollup table created?')
+            return False
+
+        with self._lock:
+            self._chambers = { row[0]: (row[1], row[2]) for row in chambers }
+        self._reconciled_at = monotonic()
+        self.tracked = True
+        occupancy_log.info(msg=f'Reconciled department occupancy: {locked}, {len(chambers)} chambers')
+        return True
+
+
+    def _load(self) -> bool:
+        version = self._version
+        summary, doctors = self.modifier.fetch_many(('occupancy-summary',), ('occupancy-doctors',))
+        if summary is None or doctors is None:
+            occupancy_log.error(msg=f'Failed to load department occupancy')
+            return False
+
+        departments = {}
+        for department, chamber_class, totalspace, occupied in summary:
+            departments.setdefault(department, ({}, {}))[0][chamber_class] = [int(totalspace), int(occupied)]
+
+        located = {}
+        for doctor, department, first_name, second_name, assigned in doctors:
+            departments.setdefault(department, ({}, {}))[1][doctor] = [first_name, second_name, assigned]
+            located[doctor] = department
+
+        with self._lock:
+            self._departments, self._doctors, self._reports = departments, located, {}
+            # otherwise the rows may have been read before the last write of this process
+            self._refreshed_at = monotonic() if version == self._version else None
+
+        self.tracked = True
+        return True
+
+
+    def track(self, tx, chambers: dict) -> None:
+        '''Add the update of `department_occupancy` to the transaction changing `chamber.occupied`.
+
+        Args:
+
+        * `tx`: opened `Transaction`
+        * `chambers`: `dict` of chamber id -> change of occupied places
+        '''
+        if not self.tracked:
+            # checked on the connection of the transaction, at most once per `refresh_interval` while missing
+            if not self._due(self._checked_at, self.refresh_interval): return
+            self._checked_at = monotonic()
+            self.tracked = bool(tx.fetch_results('occupancy-table-exists')[0][0])
+            if not self.tracked: return
+        tx.update_many('rollup-chamber-occupied', [ (delta, chamber) for chamber, delta in chambers.items() ])
+
+
+    def apply(self, chambers: dict = None, doctors: dict = None) -> None:
+        '''Patch the mirror after the commit of a transaction, see `track()`.
+
+        Args:
+
+        * `chambers`: `dict` of chamber id -> change of occupied places
+        * `doctors`: `dict` of doctor id -> change of assigned patients
+        '''
+        unknown = [ as_id(chamber) for chamber in (chambers or {}) if as_id(chamber) not in self._chambers ]
+        if unknown: self._locate(unknown)
+
+        with self._lock:
+            self._version += 1
+
+            for chamber, delta in (chambers or {}).items():
+                department, chamber_class = self._chambers.get(as_id(chamber), (None, None))
+                totals = self._departments.get(department, ({}, {}))[0].get(chamber_class)
+                if totals is None:
+                    # class not in the mirror yet, the periodic reconciliation adds its places
+                    self._refreshed_at = None
+                    continue
+                totals[1] += delta
+                self._reports.pop(department, None)
+
+            for doctor, delta in (doctors or {}).items():
+                doctor = as_id(doctor)
+                department = self._doctors.get(doctor)
+                if department is None:
+                    self._refreshed_at = None
+                    continue
+                self._departments[department][1][doctor][2] += delta
+                self._reports.pop(department, None)
+
+
+    def _locate(self, chambers: list) -> None:
+        # chambers added after the last reconciliation, located one by one rather than rebuilding everything
+        for chamber in chambers:
+            rows = self.modifier.fetch_results('occupancy-chamber-location', chamber)
+            if rows is None: continue
+            with self._lock:
+                for chamber_id, department, chamber_class in rows:
+                    self._chambers[chamber_id] = (department, chamber_class)
+
+
+    def report(self, department_id: int) -> tuple or None:
+        '''Occupancy of the department in the form of `department-report` and `department-doctors` rows.
+
+        Returns: `None` if the rollup is unavailable, `(chambers, doctors)` otherwise:
+            * `chambers`: list of `(class, totalspace, occupied)`
+            * `doctors`: list of `(id_doctor, first_name, second_name, assigned_patients)`, most loaded first
+        '''
+        if not self.current(): return
+
+        with self._lock:
+            report = self._reports.get(department_id)
+            if report is not None: return report
+
+            department = self._departments.get(department_id)
+            if department is None: return
+
+            chambers, doctors = department
+            report = (
+                [ (chamber_class, *totals) for chamber_class, totals in chambers.items() ],
+                sorted(( (doctor, *row) for doctor, row in doctors.items() ), key=lambda row: row[3], reverse=True)
+            )
+            self._reports[department_id] = report
+            return report
+
+
+OCCUPANCY = OccupancyRollup(
+    DataModifier(DB_CONFIG, SQL_DIR),
+    current_app.config.get('OCCUPANCY_REFRESH_INTERVAL', 5),
+    current_app.config.get('OCCUPANCY_RECONCILE_INTERVAL', 600))
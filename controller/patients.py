@@ -1,18 +1,63 @@
 '''
 Business-process related to patients: add new patient, assign to doctor etc
 '''
+import csv
 import datetime
+import heapq
+import io
+import json
 from flask import current_app
 from schema import *
 
 from app import make_logger
-from database.ORM import DataSource, DataModifier
-from . import Validator
+from database.ORM import DataSource, DataModifier, TransactionAborted
+from . import Validator, Page
+from .occupancy import OCCUPANCY
 
 patients_log = make_logger(__name__, 'logs/patients.log')
 
 DB_CONFIG = current_app.config['DB'].get('hospital')
 SQL_DIR = current_app.config.get('QUERIES')
+MAX_PAGE_SIZE = current_app.config.get('MAX_PAGE_SIZE', 500)
+IMPORT_BATCH_SIZE = current_app.config.get('IMPORT_BATCH_SIZE', 500)
+MAX_BATCH_ASSIGNMENT = current_app.config.get('MAX_BATCH_ASSIGNMENT', 1000)
+# at most this many rejected rows are kept in the import report
+IMPORT_MAX_ERRORS = current_app.config.get('IMPORT_MAX_ERRORS', 1000)
+
+def plan_assignments(patients: list, doctors: list, chambers: list) -> list:
+    '''Match patients with doctors and chambers of a department in memory,
+    following the rules of `select-least-loaded` and `check-chambers`: each patient goes
+    to the doctor with least assigned patients and to the biggest chamber with free space.
+
+    Args:
+
+    * `patients`: list of patient ids, in the order of assignment
+    * `doctors`: rows of `(id_doctor, first_name, second_name, assigned_patients)`
+    * `chambers`: rows of `(id_chamber, totalspace, occupied)`
+
+    Returns: list of `(patient_id, doctor_row, chamber_id)`, shorter than `patients`
+    if the department runs out of free places
+    '''
+    doctor_heap = [ (row[3], row[0], row) for row in doctors ]
+    chamber_heap = [ (-row[1], row[0], row[1] - row[2]) for row in chambers if row[1] > row[2] ]
+    heapq.heapify(doctor_heap)
+    heapq.heapify(chamber_heap)
+
+    planned = []
+    for patient_id in patients:
+        if not doctor_heap or not chamber_heap: break
+
+        assigned, doctor_id, doctor = doctor_heap[0]
+        heapq.heapreplace(doctor_heap, (assigned + 1, doctor_id, doctor))
+
+        capacity, chamber_id, free = chamber_heap[0]
+        if free > 1: heapq.heapreplace(chamber_heap, (capacity, chamber_id, free - 1))
+        else: heapq.heappop(chamber_heap)
+
+        planned.append((patient_id, doctor, chamber_id))
+
+    return planned
+
 
 class PatientController:
     '''Controller for patient routines.
@@ -20,6 +65,8 @@ class PatientController:
     The system is also capable of appointment creation for attending doctors
     '''
 
+    PATIENT_ATTRIBUTES = ('first_name', 'second_name', 'passport', 'date_birth', 'city', 'initial_diagnosis')
+
     def __init__(self, db_settings: dict = DB_CONFIG, sql_dir: str = SQL_DIR) -> None:
         if db_settings is None or sql_dir is None:
             patients_log.fatal(msg=f'Recieved this: {db_settings} and {sql_dir}')
@@ -47,24 +94,136 @@ class PatientController:
             '''
 
         patients_log.debug(msg=f'Creates new patient record')
+
+        patient_data = self.make_patient_row(patient_data)
+        if patient_data is None: return False
+
+        self.MODIFIER.update_table('create-patient-record', *patient_data)
+        patients_log.info(msg=f'Created new patient record')
+        return True
+
+
+    def make_patient_row(self, patient_data: dict) -> tuple or None:
+        '''Validate patient data and convert it to the row for `create-patient-record`.
+        Return `None` if the data is missing or invalid
+
+        Args:
+
+        * `patient_data`: `dict`, see `create_patient_record()`
+
+        Returns: `None` or `tuple`
+        '''
         if patient_data is None:
             patients_log.error(f'Patient creation aborted, the data is missing')
-            return False
+            return
 
         if not Validator.validate_patient_data(patient_data): 
             patients_log.error(msg=f'Validation failed')
-            return False
+            return
 
-        patient_data = (
+        return (
             patient_data['passport'], datetime.date.today().isoformat(),
             patient_data['date_birth'], patient_data['first_name'],
             patient_data['second_name'], patient_data['city'],
             patient_data['initial_diagnosis']
         )
 
-        self.MODIFIER.update_table('create-patient-record', *patient_data)
-        patients_log.info(msg=f'Created new patient record')
-        return True
+
+    def import_patients(self, stream, file_format: str, encoding: str = 'utf-8') -> dict or None:
+        '''Bulk creation of `patient` records from uploaded file. The file is parsed
+        row by row, each row is validated like in `create_patient_record()` and valid rows are inserted
+        in batches of `IMPORT_BATCH_SIZE` with `executemany`, each batch in its own transaction.
+        Memory use does not depend on the size of the file.
+
+        Args:
+
+        * `stream`: binary file-like object
+        * `file_format`: `csv` (with header row) or `jsonl` (one JSON object per line),
+            both should provide the keys listed in `create_patient_record()`
+        * `encoding`: encoding of the file
+
+        Returns: `None` for unsupported format, report `dict` otherwise:
+            * `total`, `inserted`, `rejected`: row counts
+            * `errors`: list of `{'row': int, 'reason': str}`, at most `IMPORT_MAX_ERRORS` items
+        '''
+
+        if file_format not in ('csv', 'jsonl'):
+            patients_log.error(msg=f'Unsupported import format: {file_format}')
+            return
+
+        patients_log.debug(msg=f'Imports patients from {file_format} file')
+        report = { 'total': 0, 'inserted': 0, 'rejected': 0, 'errors': [] }
+
+        def reject(row_num: int, reason: str, count: int = 1) -> None:
+            report['rejected'] += count
+            if len(report['errors']) < IMPORT_MAX_ERRORS:
+                report['errors'].append({ 'row': row_num, 'reason': reason })
+
+        def flush(batch: list, first_row: int) -> None:
+            with self.MODIFIER.transaction() as tx:
+                tx.update_many('create-patient-record', batch)
+
+            if tx.COMMITTED:
+                report['inserted'] += len(batch)
+                return
+            reject(first_row, f'Database error, {len(batch)} rows starting with this one were not inserted', len(batch))
+
+        batch, batch_start = [], None
+        for row_num, patient_data in self.parse_import(stream, file_format, encoding):
+            report['total'] += 1
+            if patient_data is None:
+                reject(row_num, 'Malformed row')
+                continue
+
+            patient_row = self.make_patient_row(patient_data)
+            if patient_row is None:
+                reject(row_num, 'Invalid patient data')
+                continue
+
+            if not batch: batch_start = row_num
+            batch.append(patient_row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch, batch_start)
+                batch = []
+
+        if batch: flush(batch, batch_start)
+
+        patients_log.info(msg=f'Imported {report["inserted"]} of {report["total"]} patients')
+        return report
+
+
+    def parse_import(self, stream, file_format: str, encoding: str):
+        '''Lazily parse uploaded file, yield `(row number, patient data dict or None if malformed)`'''
+        text = io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline='')
+
+        def pick(row) -> dict or None:
+            if not isinstance(row, dict): return
+            return { attribute: row.get(attribute) for attribute in self.PATIENT_ATTRIBUTES }
+
+        if file_format == 'csv':
+            reader = csv.DictReader(text)
+            failed_at = None
+            while True:
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    # the reader moves on to the next line, only the broken row is rejected
+                    patients_log.error(msg=f'Failed to parse csv line {reader.line_num}: {e}')
+                    if reader.line_num == failed_at: return
+                    failed_at = reader.line_num
+                    yield reader.line_num, None
+                    continue
+                # header is the first line
+                yield reader.line_num, pick(row)
+
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip(): continue
+            try:
+                yield line_num, pick(json.loads(line))
+            except ValueError:
+                yield line_num, None
 
 
     def find_patient(self, patient_id: int) -> dict or None:
@@ -98,18 +257,25 @@ class PatientController:
             return
 
 
-    def fetch_all_patients(self) -> None or tuple:
+    def fetch_all_patients(self, stream: bool = False, after: int = None, before: int = None, limit: int = None) -> None or tuple:
         '''
         Fetch all records from `patient` table. Return `None` if error occurs,
         generator is returned otherwise. Each generator item is `dict` of
         patient properties to be parsed during template building.
 
-        Returns: `None` or `Iterable[dict[str, Any]]`
+        With `stream=True` the rows are read from the server lazily, while the
+        generator is consumed (e.g. by a streamed template)
+
+        With `limit` given, a single `Page` of at most `limit` records is returned instead,
+        it starts right after `after` or ends right before `before` patient id (see `fetch_listing()`).
+        Pages are not read lazily, `stream` is ignored for them
+
+        Returns: `None`, `Iterable[dict[str, Any]]` or `Page`
         '''
 
         patients_log.debug(msg=f'Fetches patient list')
 
-        patients = self.SOURCE.fetch_results('fetch-patients')
+        patients, page = self.fetch_listing('fetch-patients', stream, after, before, limit)
 
         if patients is None:
             patients_log.warning(msg=f'Failed to fetch patients. Is SQL Server running?')
@@ -136,13 +302,41 @@ class PatientController:
                     }
 
         patients_log.info(msg=f'Fetched patient list')
-        return process_rows()
+        return process_rows() if page is None else page.fill(process_rows())
 
     
-    def fetch_dischargable_patients(self) -> None or tuple:
+    def fetch_listing(self, query: str, stream: bool, after: int, before: int, limit: int) -> tuple:
+        '''Fetch rows of the patient listing `query`. Unless `limit` is set, all the rows are fetched.
+        Otherwise the page is selected with keyset on `id_patient` by `query-after` or `query-before`
+        companion query, so the cost does not depend on how far the page is.
+
+        `stream` only applies to the unpaginated listing: a page is read into memory to find
+        its neighbours, which is cheap since it holds at most `MAX_PAGE_SIZE` rows.
+        The template is still rendered streamed in both cases
+
+        Returns: `(rows, page)` where `rows` is `None` on failure and `page` is `None` for unpaginated listing
+        '''
+
+        if limit is None:
+            return self.SOURCE.fetch_results(query, stream=stream), None
+
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        if before is not None:
+            rows = self.SOURCE.fetch_results(f'{query}-before', int(before), limit + 1)
+        else:
+            rows = self.SOURCE.fetch_results(f'{query}-after', int(after or 0), limit + 1)
+
+        if rows is None: return None, None
+
+        page = Page(list(rows), limit, after, before)
+        return page.rows, page
+
+
+    def fetch_dischargable_patients(self, stream: bool = False, after: int = None, before: int = None, limit: int = None) -> None or tuple:
         patients_log.debug(msg=f'Fetches list of dischargable patients')
 
-        patients = self.SOURCE.fetch_results('fetch-dischargable')
+        patients, page = self.fetch_listing('fetch-dischargable', stream, after, before, limit)
 
         if patients is None:
             patients_log.warning(msg=f'Failed to fetch patients. Is SQL Server running?')
@@ -173,7 +367,7 @@ class PatientController:
                     }
 
         patients_log.info(msg=f'Fetched dischargable list')
-        return process_rows()
+        return process_rows() if page is None else page.fill(process_rows())
 
 
     def discharge_patient(self, patient_id: int, doctor_id: int, chamber_id: int) -> None:
@@ -188,15 +382,23 @@ class PatientController:
 
         today = datetime.date.today().isoformat()
 
-        self.MODIFIER.update_table('discharge-patient', today, patient_id)
-        self.MODIFIER.update_table('release-chamber', chamber_id)
-        self.MODIFIER.update_table('release-doctor', doctor_id)
+        with self.MODIFIER.transaction() as tx:
+            tx.update_table('discharge-patient', today, patient_id)
+            tx.update_table('release-chamber', chamber_id)
+            tx.update_table('release-doctor', doctor_id)
+            OCCUPANCY.track(tx, {chamber_id: -1})
+
+        if not tx.COMMITTED:
+            patients_log.error(msg=f'Failed to discharge patient with id {patient_id}, changes rolled back')
+            return
+
+        OCCUPANCY.apply(chambers={chamber_id: -1}, doctors={doctor_id: -1})
 
         patients_log.info(msg=f'Released reources: chamber with id {chamber_id} and doctor with id {doctor_id}')
         patients_log.info(msg=f'Discharged patient with id {patient_id}')
 
 
-    def fetch_unassigned(self) -> None or tuple:
+    def fetch_unassigned(self, stream: bool = False, after: int = None, before: int = None, limit: int = None) -> None or tuple:
         '''Fetch all patients who do not habe an attending doctor.
         Simular to `fetch_all_patients()`. Return `None` if there was an error during
         processing and generator expression otherwise.
@@ -206,7 +408,7 @@ class PatientController:
 
         patients_log.debug(msg=f'Fetches unassigned patients')
 
-        patients = self.SOURCE.fetch_results('fetch-newcome-patients')
+        patients, page = self.fetch_listing('fetch-newcome-patients', stream, after, before, limit)
 
         if patients is None:
             patients_log.warning(msg=f'Failed to fetch patients. Is SQL Server running?')
@@ -228,7 +430,7 @@ class PatientController:
                     }
 
         patients_log.info(msg=f'Fetched unassigned patients')
-        return process_rows()
+        return process_rows() if page is None else page.fill(process_rows())
 
 
     def assign_patient(self, patient_id: int, department_id: int) -> dict or None:
@@ -275,14 +477,6 @@ class PatientController:
             patients_log.error(msg=f'Error occured during best doctor/chamber lookup: {e}')
             return
 
-        # modify all tables
-        # should be uncommented to remove debug
-        self.MODIFIER.update_table('assign-to-doctor', optimal_doctor, optimal_chamber, patient_id)
-        self.MODIFIER.update_table('occupy-doctor', optimal_doctor)
-        self.MODIFIER.update_table('occupy-chamber', optimal_chamber)
-
-        patients_log.info(msg=f'Updated table: assigned {patient_id} to {optimal_doctor} ({doctor_initials}), chamber is {optimal_chamber}')
-        
         new_appointment_data = {
             'assignee': str(optimal_doctor),
             'patient': str(patient_id),
@@ -290,14 +484,104 @@ class PatientController:
             'scheduled': datetime.datetime.today() + datetime.timedelta(days=1)
         }
 
-        self.create_appointment_record(new_appointment_data)
-        
+        new_appointment = self.make_appointment_row(new_appointment_data)
+        if new_appointment is None: return
+
+        # modify all tables in a single transaction so that
+        # the assignment is never applied partially
+        with self.MODIFIER.transaction() as tx:
+            tx.update_table('assign-to-doctor', optimal_doctor, optimal_chamber, patient_id)
+            tx.update_table('occupy-doctor', optimal_doctor)
+            tx.update_table('occupy-chamber', optimal_chamber)
+            OCCUPANCY.track(tx, {optimal_chamber: 1})
+            tx.update_table('create-appointment-record', *new_appointment)
+
+        if not tx.COMMITTED:
+            patients_log.error(msg=f'Failed to assign {patient_id}, changes rolled back')
+            return
+
+        OCCUPANCY.apply(chambers={optimal_chamber: 1}, doctors={optimal_doctor: 1})
+
+        patients_log.info(msg=f'Updated table: assigned {patient_id} to {optimal_doctor} ({doctor_initials}), chamber is {optimal_chamber}')
+
         return {
                 'attending_doctor': ' '.join(doctor_initials),
                 'chamber': optimal_chamber
             }
 
 
+    def assign_all(self, department_id: int, limit: int = None) -> dict or None:
+        '''Assign unassigned patients to the provided `department_id` in one go.
+        Doctor loads and free places of the department are loaded once (and locked
+        until the end of transaction), then the patients are matched in memory
+        with `plan_assignments()`. Assignments, counters of doctors and chambers and initial
+        appointments are written in a single transaction with `executemany`.
+
+        Args:
+
+        * `department_id`: int, department to assign to
+        * `limit`: int, maximal number of patients to assign (all the unassigned by default)
+
+        Returns: `None` on failure, `dict` otherwise:
+            * `assigned`, `unassigned`: numbers of patients of this batch
+            * `capped`: whether more patients are waiting beyond `limit`
+            * `doctors`: list of `{'name': str, 'assigned': int}`
+            * `chambers`: list of `{'chamber': int, 'assigned': int}`
+        '''
+
+        patients_log.debug(msg=f'Starts batch assignment, department {department_id}')
+        limit = MAX_BATCH_ASSIGNMENT if limit is None else min(int(limit), MAX_BATCH_ASSIGNMENT)
+        scheduled = datetime.datetime.today() + datetime.timedelta(days=1)
+        summary = None
+
+        with self.MODIFIER.transaction() as tx:
+            # one more is locked to tell whether the batch was capped
+            patients = [ row[0] for row in tx.fetch_results('lock-newcome-patients', limit + 1) ]
+            capped = len(patients) > limit
+            patients = patients[:limit]
+            doctors = tx.fetch_results('lock-department-doctors', department_id)
+            chambers = tx.fetch_results('lock-department-chambers', department_id)
+
+            planned = plan_assignments(patients, doctors, chambers)
+
+            doctor_counts, chamber_counts, appointments = {}, {}, []
+            for patient_id, doctor, chamber_id in planned:
+                doctor_counts[doctor] = doctor_counts.get(doctor, 0) + 1
+                chamber_counts[chamber_id] = chamber_counts.get(chamber_id, 0) + 1
+                appointments.append(self.make_appointment_row({
+                    'assignee': str(doctor[0]),
+                    'patient': str(patient_id),
+                    'about': 'Первичный прием',
+                    'scheduled': scheduled
+                }))
+
+            if None in appointments:
+                raise TransactionAborted('Failed to create initial appointments')
+
+            tx.update_many('assign-to-doctor', [ (doctor[0], chamber_id, patient_id) for patient_id, doctor, chamber_id in planned ])
+            tx.update_many('occupy-doctor-many', [ (count, doctor[0]) for doctor, count in doctor_counts.items() ])
+            tx.update_many('occupy-chamber-many', [ (count, chamber_id) for chamber_id, count in chamber_counts.items() ])
+            OCCUPANCY.track(tx, chamber_counts)
+            tx.update_many('create-appointment-record', appointments)
+
+            summary = {
+                'assigned': len(planned),
+                'unassigned': len(patients) - len(planned),
+                'capped': capped,
+                'doctors': [ {'name': ' '.join(doctor[1:3]), 'assigned': count} for doctor, count in doctor_counts.items() ],
+                'chambers': [ {'chamber': chamber_id, 'assigned': count} for chamber_id, count in chamber_counts.items() ]
+            }
+
+        if not tx.COMMITTED:
+            patients_log.error(msg=f'Batch assignment to {department_id} failed, changes rolled back')
+            return
+
+        OCCUPANCY.apply(chambers=chamber_counts, doctors={ doctor[0]: count for doctor, count in doctor_counts.items() })
+
+        patients_log.info(msg=f'Assigned {summary["assigned"]} patients to department {department_id}, {summary["unassigned"]} left, capped: {summary["capped"]}')
+        return summary
+
+
     def create_appointment_record(self, appointment_data: dict) -> None:
         '''Create new record in `appointment` table. Validate the provided
         data before inserting
@@ -314,6 +598,23 @@ class PatientController:
         '''
         patients_log.debug(msg=f'Creates new doctor task record')
 
+        appointment_data = self.make_appointment_row(appointment_data)
+        if appointment_data is None: return
+
+        self.MODIFIER.update_table('create-appointment-record', *appointment_data)
+        patients_log.info(msg=f'Created new task record')
+
+
+    def make_appointment_row(self, appointment_data: dict) -> tuple or None:
+        '''Validate appointment data and convert it to the row for `create-appointment-record`.
+        Return `None` if the data is missing or invalid
+
+        Args:
+
+        * `appointment_data`: `dict`, see `create_appointment_record()`
+
+        Returns: `None` or `tuple`
+        '''
         if appointment_data is None:
             patients_log.error(f'Task creation aborted, the data is missing')
             return
@@ -322,10 +623,7 @@ class PatientController:
             patients_log.error(msg=f'Validation failed')
             return
 
-        appointment_data = (
+        return (
             appointment_data['assignee'], appointment_data['patient'],
             appointment_data.get('scheduled'), appointment_data.get('about')
         )
-
-        self.MODIFIER.update_table('create-appointment-record', *appointment_data)
-        patients_log.info(msg=f'Created new task record')
@@ -1,75 +1,252 @@
-import logging
-from logging.handlers import TimedRotatingFileHandler
-from os import getenv, walk
-from os.path import isdir
+from os import getenv
 from abc import ABC
-from functools import lru_cache
+from time import time
 
-from .query import Query
-
-log = logging.getLogger(__name__)
-# enable logging routines
-# write log to a file with specified filename (provided via environmental variable)
-# set needed level and optionally disable logging completely
+from pymysql.err import Error
 
-DEBUGLEVEL = getenv('DEBUG_LEVEL','DEBUG')
-LOGFILE = getenv('DB_LOGFILE_NAME', 'logs/db.log')
+from app import make_logger
 
-log.disabled = getenv('LOG_ON', "True") == "False"
+from . import connect
+from .cache import get_cache
+from .fanout import fan_out
+from .metrics import QUERY_METRICS
+from .query import Query
+from .registry import QueryRegistry, QueryCollision, get_registry
+from .routing import get_replicas
+from .slowlog import SLOW_QUERIES
+from .versions import VERSIONS
 
-log.setLevel(getattr(logging, DEBUGLEVEL))
-# handler = logging.FileHandler(filename=f'{LOGFILE}', encoding='utf-8')
-handler = TimedRotatingFileHandler(filename=f'{LOGFILE}', encoding='utf-8', when='h', interval=5, backupCount=0)
-formatter = logging.Formatter('[%(asctime)s]::[%(levelname)s]::[%(name)s]::%(message)s', '%D # %H:%M:%S')
-handler.setFormatter(formatter)
-log.addHandler(handler)
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
 
 class ORM(ABC):
     @staticmethod
-    @lru_cache(maxsize=1)
-    def collect_queries(querydir: str) -> dict:
+    def collect_queries(querydir: str) -> QueryRegistry:
         log.info(msg=f'Collects queries from the provided path')
-        if not isdir(querydir): raise NotADirectoryError
-        queries = {
-            file.replace('/','.').split('.')[-2] : open(f'{dir}/{file}', mode='r').read()
-            for dir, _, files in walk(querydir) for file in files }
-        log.info(msg=f'Queries collected and cached')
-        return queries
+        return get_registry(querydir)
 
 
 class DataSource(ORM):
+    # reads go to the replicas of the config entry if there are any, see `database.routing`
+    READ_REPLICAS = True
+
     def __init__(self, config: dict, sql_dir: str) -> None:
         if not isinstance(config, dict): raise ValueError(f'Config should be a dict instance, given {config}')
 
         try:
             queries = ORM.collect_queries(sql_dir)
-        except NotADirectoryError:
-            log.error(msg=f'Error occured while collecting queries')
+        except (NotADirectoryError, QueryCollision) as err:
+            log.error(msg=f'Error occured while collecting queries: {err}')
             raise RuntimeError(f'Failed to collect cached queries from {sql_dir}')
 
         self.config = config
         self.queries = queries
+        self.cache = get_cache(config)
+        self.replicas = get_replicas(config)
         log.debug(msg=f'Created DataSource')
 
 
-    def fetch_results(self, query: str, *args) -> tuple or None:
+    def _target(self) -> dict:
+        return self.replicas.choose() if self.READ_REPLICAS else self.config
+
+
+    def _read(self, query: str, args: tuple, stream: bool = False, target: dict = None):
+        def execute(config: dict):
+            runner = Query(config, query)
+            if stream: return runner.execute_streamed(self.queries[query], *args)
+            return runner.execute_with_args(self.queries[query], *args)
+
+        if target is None: target = self._target()
+        fetched = execute(target)
+        if fetched is not None or target is self.config: return fetched
+
+        # whatever failed on the replica, the primary answers instead
+        log.warning(msg=f'Replica failed, {query} is read from the primary')
+        return execute(self.config)
+
+
+    def fetch_results(self, query: str, *args, stream: bool = False) -> tuple or None:
+        '''
+        Execute named query and return iterable over the fetched rows or `None` on failure.
+        With `stream=True` the rows are read lazily from unbuffered cursor (and never cached)
+        '''
         if query not in self.queries:
             log.error(msg=f'Unknown query provided: {query}. Abort')
             return
+        if not self.queries.check_arity(query, args): return
         log.debug(msg=f'Query found, fetching results')
 
-        fetched = Query(self.config)\
-            .execute_with_args(self.queries[query], *args)
-        return fetched
+        if stream: return self._read(query, args, stream=True)
+        named = self.queries.get(query)
+        # a context pinned after its own write reads the primary, past the cache
+        if not self.cache.cacheable(named) or self.replicas.pinned(): return self._read(query, args)
+
+        key = (query, args)
+        cached = self.cache.get(key)
+        if cached is not None:
+            log.debug('Cache hit for %s', query)
+            return ( row for row in cached )
+
+        tables = named.tables
+        generation = self.cache.generation(tables)
+        started = time()
+
+        target = self._target()
+        fetched = self._read(query, args, target=target)
+        if fetched is None: return
+
+        fetched = tuple(fetched)
+        # a replica may not have the last writes yet, its rows are served but not kept
+        if target is self.config or self.replicas.settled(tables, started):
+            self.cache.put(key, fetched, tables, generation)
+        return ( row for row in fetched )
+
+
+    def fetch_many(self, *requests) -> list:
+        '''
+        Execute several independent named queries concurrently, each on its own connection.
+        Each request is a tuple `(query, *args)`, results (or `None` for failed ones)
+        are returned in the same order as with `fetch_results()`:
+
+        ```
+        chambers, doctors = source.fetch_many(
+            ('department-report', department_id),
+            ('department-doctors', department_id))
+        ```
+        '''
+        return fan_out(*( (self.fetch_results, query, *args) for query, *args in requests ))
 
 
 class DataModifier(DataSource):
+    # reads of the writer are part of read-modify-write, they see the primary
+    READ_REPLICAS = False
+
     def update_table(self, query: str, *args) -> None:
         if query not in self.queries:
             log.error(msg=f'Unknown query provided: {query}. Abort')
             return
+        if not self.queries.check_arity(query, args): return
         log.debug(msg=f'Query to update found, performing')
 
-        result_status = Query(self.config)\
+        result_status = Query(self.config, query)\
             .execute_with_args(self.queries[query], *args)
-        log.debug(msg=f'Query executed with status {result_status}')
+        log.debug('Query executed with status %s', result_status)
+
+        if result_status is not None:
+            tables = self.queries.get(query).tables
+            self.cache.invalidate(tables)
+            VERSIONS.bump(tables)
+            self.replicas.pin_primary()
+
+
+    def transaction(self):
+        '''
+        Create unit of work for several writes, see `Transaction`
+        '''
+        return Transaction(self.config, self.queries, self.cache, self.replicas)
+
+
+class TransactionAborted(Exception):
+    pass
+
+
+class Transaction:
+    '''
+    Unit of work for multi-statement writes
+
+    All the named queries executed inside `with` block share one connection
+    and are committed together on exit. If any of them fails, everything is rolled back,
+    the error is logged and `COMMITTED` stays `False`:
+
+    ```
+    with modifier.transaction() as tx:
+        tx.update_table('occupy-doctor', doctor_id)
+        tx.update_table('occupy-chamber', chamber_id)
+    if not tx.COMMITTED: ...
+    ```
+    '''
+    COMMITTED = False
+
+    def __init__(self, config: dict, queries: QueryRegistry, cache=None, replicas=None) -> None:
+        self.config = config
+        self.queries = queries
+        self.cache = cache
+        self.replicas = replicas
+        self.connection = connect.Connection(config)
+        self.modified = set()
+        # slow steps are checked once the connection and its locks are released
+        self.slow = []
+
+
+    def __enter__(self):
+        self.connection.__enter__()
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.connection.__exit__(exc_type, exc_val, exc_tb)
+        for sql, args, observed in self.slow:
+            SLOW_QUERIES.check(self.config, sql, args, observed)
+
+        if exc_val is None:
+            self.COMMITTED = self.connection.COMMITTED
+            log.debug('Transaction finished, committed: %s', self.COMMITTED)
+            if self.COMMITTED:
+                if self.cache is not None: self.cache.invalidate(frozenset(self.modified))
+                VERSIONS.bump(frozenset(self.modified))
+                if self.replicas is not None and self.modified: self.replicas.pin_primary()
+            return
+
+        log.error(msg=f'Transaction rolled back: {exc_val}')
+        # database errors are reported via `COMMITTED`, everything else is propagated
+        return isinstance(exc_val, (Error, TransactionAborted))
+
+
+    def _prepare(self, query: str, args: tuple) -> str:
+        if not self.connection.CONNECTED:
+            raise TransactionAborted('Connection is not opened')
+        if query not in self.queries:
+            raise TransactionAborted(f'Unknown query provided: {query}')
+        if not self.queries.check_arity(query, args):
+            raise TransactionAborted(f'Invalid number of args for {query}')
+        return self.queries[query]
+
+
+    def update_table(self, query: str, *args) -> int:
+        sql = self._prepare(query, args)
+        # the connection is borrowed once for all the steps, only execution is observed
+        with QUERY_METRICS.observe(query) as observed:
+            self.connection.CURSOR.execute(sql, args)
+            observed.executed()
+        observed.rows = self.connection.CURSOR.rowcount
+        if SLOW_QUERIES.slow(observed): self.slow.append((sql, args, observed))
+        self.modified.update(self.queries.get(query).tables)
+        log.debug('Transaction step %s affected %s rows', query, self.connection.CURSOR.rowcount)
+        return self.connection.CURSOR.rowcount
+
+
+    def update_many(self, query: str, rows: list) -> int:
+        '''
+        Execute the query for each of the `rows` with `executemany`,
+        simple `INSERT ... VALUES` queries are sent as a single multi-row insert
+        '''
+        if not rows: return 0
+        sql = self._prepare(query, tuple(rows[0]))
+        if any(len(args) != len(rows[0]) for args in rows):
+            raise TransactionAborted(f'Invalid number of args for {query}')
+        with QUERY_METRICS.observe(query) as observed:
+            self.connection.CURSOR.executemany(sql, rows)
+            observed.executed()
+        self.modified.update(self.queries.get(query).tables)
+        log.debug('Transaction step %s affected %s rows', query, self.connection.CURSOR.rowcount)
+        return self.connection.CURSOR.rowcount
+
+
+    def fetch_results(self, query: str, *args) -> list:
+        sql = self._prepare(query, args)
+        with QUERY_METRICS.observe(query) as observed:
+            self.connection.CURSOR.execute(sql, args)
+            observed.executed()
+            rows = list(self.connection.CURSOR.fetchall())
+            observed.fetched(len(rows))
+        if SLOW_QUERIES.slow(observed): self.slow.append((sql, args, observed))
+        return rows
@@ -0,0 +1,200 @@
+from os import getenv, register_at_fork
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from app import make_logger
+
+from .pool import config_key
+from .registry import SQLQuery
+from .versions import VERSIONS
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+
+# defaults used when config entry has no `CACHE` section
+CACHE_DEFAULTS = {
+    'TTL': 60,
+    'SIZE': 128,
+    # names of the queries to cache, `"*"` caches every plain read
+    'QUERIES': [],
+    'EXCLUDE': [],
+}
+
+
+class QueryCache:
+    '''
+    Thread-safe LRU cache for results of named read queries, keyed by (query name, args)
+
+    Entries expire after `TTL` seconds and are dropped as soon as
+    any table they were read from is modified (see `invalidate()`). Writes served
+    by other workers are noticed via data versions of the tables (see `database.versions`).
+    Only plain reads listed in `QUERIES` (or all of them with `"*"`) and not listed in `EXCLUDE` are cached
+    '''
+
+    def __init__(self, config: dict) -> None:
+        settings = dict(CACHE_DEFAULTS)
+        settings.update(config.get('CACHE', {}))
+
+        self.TTL = float(settings['TTL'])
+        self.SIZE = int(settings['SIZE'])
+        self.ALL = settings['QUERIES'] == '*'
+        self.QUERIES = frozenset(() if self.ALL else settings['QUERIES'])
+        self.EXCLUDE = frozenset(settings['EXCLUDE'])
+
+        # key is (query name, args), value is (rows, tables, expires_at, versions)
+        self._entries = OrderedDict()
+        # table -> keys of the entries read from it, so that writes drop exactly those
+        self._keys = {}
+        # bumped on each invalidation so that results fetched before a write are not stored
+        self._generations = {}
+        self._lock = Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evicted': 0,
+            'invalidated': 0,
+            'stale': 0,
+        }
+
+
+    def cacheable(self, query: SQLQuery) -> bool:
+        if self.SIZE <= 0 or not query.read or not query.tables: return False
+        if query.name in self.EXCLUDE: return False
+        return self.ALL or query.name in self.QUERIES
+
+
+    def generation(self, tables: frozenset) -> tuple:
+        '''Taken before the query runs and passed to `put()`'''
+        tables = sorted(tables)
+        with self._lock:
+            return tuple(self._generations.get(table, 0) for table in tables), VERSIONS.stamp(tables)
+
+
+    def _drop(self, key: tuple) -> None:
+        _, tables, _, _ = self._entries.pop(key)
+        for table in tables:
+            keys = self._keys.get(table)
+            if keys is None: continue
+            keys.discard(key)
+            if not keys: del self._keys[table]
+
+
+    def get(self, key: tuple) -> tuple or None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return
+
+            rows, tables, expires_at, versions = entry
+            if expires_at <= monotonic():
+                self._drop(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return
+            if VERSIONS.stamp(tables) != versions:
+                # written by another worker
+                self._drop(key)
+                self._stats['stale'] += 1
+                self._stats['misses'] += 1
+                return
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return rows
+
+
+    def put(self, key: tuple, rows: tuple, tables: frozenset, generation: tuple) -> None:
+        tables = tuple(sorted(tables))
+        generations, versions = generation
+        with self._lock:
+            current = tuple(self._generations.get(table, 0) for table in tables)
+            if current != generations:
+                # some of the tables were modified while the query was running
+                return
+
+            if key in self._entries: self._drop(key)
+            # versions of the time the query started, a write committed meanwhile makes the entry stale
+            self._entries[key] = (rows, tables, monotonic() + self.TTL, versions)
+            for table in tables:
+                self._keys.setdefault(table, set()).add(key)
+
+            while len(self._entries) > self.SIZE:
+                self._drop(next(iter(self._entries)))
+                self._stats['evicted'] += 1
+
+
+    def invalidate(self, tables: frozenset) -> None:
+        if not tables: return
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+
+            stale = set()
+            for table in tables: stale.update(self._keys.get(table, ()))
+            for key in stale:
+                self._drop(key)
+            self._stats['invalidated'] += len(stale)
+
+        if stale: log.debug('Invalidated %s cached results for %s', len(stale), sorted(tables))
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+
+CACHES = {}
+CACHES_LOCK = Lock()
+
+def get_cache(config: dict) -> QueryCache:
+    '''
+    Return the cache for the given config entry, create one on first use
+    '''
+    key = config_key(config)
+    cache = CACHES.get(key)
+    if cache is not None: return cache
+
+    with CACHES_LOCK:
+        if key not in CACHES:
+            CACHES[key] = QueryCache(config)
+        return CACHES[key]
+
+
+def cache_stats() -> dict:
+    return { '/'.join(str(part) for part in key): cache.stats() for key, cache in list(CACHES.items()) }
+
+
+def render_cache_stats(stats: dict) -> str:
+    '''Counters of `cache_stats()` (summed up across the workers) in Prometheus text exposition format'''
+    lines = [
+        '# HELP db_query_cache_events_total Lookups and removals of cached query results',
+        '# TYPE db_query_cache_events_total counter',
+    ]
+    for database, counters in sorted(stats.items()):
+        for event, count in sorted(counters.items()):
+            if event != 'size': lines.append(f'db_query_cache_events_total{{database="{database}",event="{event}"}} {count}')
+    lines.append('# HELP db_query_cache_entries Cached query results')
+    lines.append('# TYPE db_query_cache_entries gauge')
+    for database, counters in sorted(stats.items()):
+        lines.append(f'db_query_cache_entries{{database="{database}"}} {counters.get("size", 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _after_fork() -> None:
+    # invalidations of the parent would not reach the child, start empty
+    global CACHES_LOCK
+    CACHES.clear()
+    CACHES_LOCK = Lock()
+
+
+register_at_fork(after_in_child=_after_fork)
@@ -1,80 +1,100 @@
-import logging
-from logging.handlers import TimedRotatingFileHandler
 from os import getenv
 
-from pymysql import connect
 from pymysql.err import InterfaceError, OperationalError, Error
 
-log = logging.getLogger(__name__)
-# enable logging routines
-# write log to a file with specified filename (provided via environmental variable)
-# set needed level and optionally disable logging completely
+from app import make_logger
 
-DEBUGLEVEL = getenv('DEBUG_LEVEL','DEBUG')
-LOGFILE = getenv('DB_LOGFILE_NAME', 'logs/db.log')
+from .pool import get_pool
+from .routing import connection_failed
 
-log.disabled = getenv('LOG_ON', "True") == "False"
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
 
-log.setLevel(getattr(logging, DEBUGLEVEL))
-handler = TimedRotatingFileHandler(filename=f'{LOGFILE}', encoding='utf-8', when='h', interval=5, backupCount=0)
-formatter = logging.Formatter('[%(asctime)s]::[%(levelname)s]::[%(name)s]::%(message)s', '%D # %H:%M:%S')
-handler.setFormatter(formatter)
-log.addHandler(handler)
+# the server went away or the connection dropped in the middle of a query
+LOST_CONNECTION = (2006, 2013)
 
 class Connection:
     '''
     Wrapper for `pymysql` cursor and connection to ease database routines
 
     Has `__enter__` and `__exit__` methods to be used with `with`
+
+    The connection itself is borrowed from the pool for the given config
+    and given back on exit, so that handshakes are not repeated for each query
     '''
     CONNECTION = None
     CURSOR = None
     DB_CONFIG = None
     CONNECTED = False
+    COMMITTED = False
+    # exception which prevented borrowing the connection
+    ERROR = None
 
-    def __init__(self, config: dict) -> None:
+    def __init__(self, config: dict, cursor=None) -> None:
         self.DB_CONFIG = config
-        log.debug(msg=f'Initialized config with {config}')
+        self.POOL = get_pool(config)
+        # cursor class, e.g. `pymysql.cursors.SSCursor` for unbuffered results
+        self.CURSOR_CLASS = cursor
 
     def __enter__(self):
         try:
-            self.CONNECTION = connect(
-                host=self.DB_CONFIG['HOST'],
-                port=self.DB_CONFIG['PORT'],
-                user=self.DB_CONFIG['USER'],
-                password=self.DB_CONFIG['PASSWORD'],
-                database=self.DB_CONFIG['SCHEMA']
-            )
-            log.debug(msg=f'Created connection')
-            self.CURSOR = self.CONNECTION.cursor()
+            self.CONNECTION = self.POOL.acquire()
+            log.debug(msg=f'Borrowed connection')
+            self.CURSOR = self.CONNECTION.cursor(self.CURSOR_CLASS)
             self.CONNECTED = True
             return self
         except OperationalError as oerr:
+            self.ERROR = oerr
             parse_connection_exception(oerr)
+            connection_failed(self.DB_CONFIG)
         except InterfaceError as ierr:
+            self.ERROR = ierr
             log.error(msg=f'Uncatched exception occured: {ierr}')
+        except TimeoutError as terr:
+            self.ERROR = terr
+            log.error(msg=f'Failed to borrow connection: {terr}')
+            # a replica which holds every connection of the pool is too slow to be read from
+            connection_failed(self.DB_CONFIG)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.CONNECTED:
-            self.CONNECTION.commit()
-            self.CURSOR.close()
-            self.CONNECTION.close()
-            log.debug(msg=f'Connection closed successfully')
+            # connections which failed on the server side are not returned to the pool
+            broken = isinstance(exc_val, (OperationalError, InterfaceError))
+            try:
+                # cursor is closed first: unbuffered cursors have to drain pending rows
+                self.CURSOR.close()
+                if exc_val is None:
+                    self.CONNECTION.commit()
+                    self.COMMITTED = True
+                else: self.CONNECTION.rollback()
+            except Error as err:
+                log.warning(msg=f'Failed to finalize connection: {err}')
+                broken = True
+            self.POOL.release(self.CONNECTION, discard=broken)
+            self.CONNECTED = False
+            log.debug(msg=f'Connection returned to the pool')
         else:
             log.debug(msg=f'Connection was not opened, nothing to close')
         if exc_val is not None:
             log.warning(msg=f'Exception info: {exc_type}::{exc_val}')
-            parse_cursor_exception(exc_val)
+            if isinstance(exc_val, Error): parse_cursor_exception(exc_val)
+            if isinstance(exc_val, OperationalError) and exc_val.args and exc_val.args[0] in LOST_CONNECTION:
+                connection_failed(self.DB_CONFIG)
 
 def parse_connection_exception(err: Error):
     # add more useful analysis for errors raised during connection to log
     if err.args[0] == 1049: log.error(msg=f'Invalid DB name')
     if err.args[0] == 1045: log.error(msg=f'Invalid creditentials: {err.args[1]}')
     if err.args[0] == 2003: log.error(msg=f'Host refused to connect: {err.args[1]}')
+    if err.args[0] == 1040: log.error(msg=f'Too many connections: {err.args[1]}')
 
 def parse_cursor_exception(err: Error):
     # add more useful analysis for errors raised during cursor execution to log
     if err.args[0] == 1146: log.error(msg=f'Invalid table name: {err.args[1]}')
     if err.args[0] == 1054: log.error(msg=f'Invalid column name: {err.args[1]}')
     if err.args[0] == 1064: log.error(msg=f'Invalid SQL syntax: {err.args[1]}')
+    if err.args[0] == 1062: log.error(msg=f'Duplicate entry: {err.args[1]}')
+    if err.args[0] == 1452: log.error(msg=f'Foreign key constraint fails: {err.args[1]}')
+    if err.args[0] == 1205: log.error(msg=f'Lock wait timeout exceeded: {err.args[1]}')
+    if err.args[0] == 1213: log.error(msg=f'Deadlock found: {err.args[1]}')
+    if err.args[0] in (2006, 2013): log.error(msg=f'Lost connection to server: {err.args[1]}')
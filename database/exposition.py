@@ -0,0 +1,177 @@
+'''
+Metrics of all the workers in one scrape.
+
+Query metrics (`database.metrics`) and cache counters (`database.cache`) are kept in memory
+of each worker of `app.server`, while a scrape is served by whichever worker accepts it.
+So each worker writes a snapshot of its ones to `<directory>/<pid>.json` every `interval` seconds
+and `render()` sums up the snapshots of all the workers (the serving one uses its live counters),
+series are the same whichever worker serves the scrape.
+
+Once a worker exits the master folds its snapshot into `retired.json` (see `retire()`),
+so counters do not go backwards when workers are reloaded or restarted and the number
+of files stays bounded. The directory is emptied when the server starts (see `clear()`)
+'''
+import json
+from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_UN
+from os import getenv, getpid, listdir, makedirs, register_at_fork, remove, replace
+from os.path import join
+from threading import Lock, Thread
+from time import sleep
+
+from app import make_logger
+
+from .cache import cache_stats, render_cache_stats
+from .metrics import QUERY_METRICS, render as render_metrics
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+
+RETIRED = 'retired.json'
+# held shared while reading the snapshots, exclusively while one is retired
+LOCKFILE = '.lock'
+
+
+def snapshot() -> dict:
+    return { **QUERY_METRICS.snapshot(), 'cache': cache_stats() }
+
+
+def merge(snapshots) -> dict:
+    '''Sum of the snapshots of the workers'''
+    histograms, errors, cache = {}, {}, {}
+    for part in snapshots:
+        for name, query, counts, total, count in part.get('histograms', ()):
+            merged = histograms.get((name, query))
+            if merged is None:
+                histograms[(name, query)] = [list(counts), total, count]
+                continue
+            merged[0] = [ summed + observed for summed, observed in zip(merged[0], counts) ]
+            merged[1] += total
+            merged[2] += count
+
+        for query, code, count in part.get('errors', ()):
+            errors[(query, code)] = errors.get((query, code), 0) + count
+
+        for database, counters in part.get('cache', {}).items():
+            summed = cache.setdefault(database, {})
+            for event, count in counters.items(): summed[event] = summed.get(event, 0) + count
+
+    return {
+        'histograms': [ [name, query, *merged] for (name, query), merged in histograms.items() ],
+        'errors': [ [query, code, count] for (query, code), count in errors.items() ],
+        'cache': cache,
+    }
+
+
+def _read(path: str) -> dict or None:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as err:
+        log.error(msg=f'Failed to read metrics from {path}: {err}')
+
+
+def _write(path: str, snapshot: dict) -> None:
+    # readers never see a partly written file
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(snapshot, file)
+    replace(f'{path}.tmp', path)
+
+
+class _Locked:
+    def __init__(self, directory: str, mode: int) -> None:
+        self.path = join(directory, LOCKFILE)
+        self.mode = mode
+
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        flock(self.file, self.mode)
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        flock(self.file, LOCK_UN)
+        self.file.close()
+
+
+class MetricsExporter:
+    '''
+    Writes the snapshots of this worker from a background thread and renders the sum of all of them
+    '''
+
+    def __init__(self) -> None:
+        self.directory = None
+        self.interval = 5
+        self.after_fork()
+        register_at_fork(after_in_child=self.after_fork)
+
+
+    def after_fork(self) -> None:
+        # the thread of the parent is not inherited
+        self.lock = Lock()
+        self.flusher = None
+
+
+    def configure(self, directory: str, interval: float) -> None:
+        makedirs(directory, exist_ok=True)
+        self.directory, self.interval = directory, interval
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = Thread(target=self.run, name='metrics-flusher', daemon=True)
+                self.flusher.start()
+
+
+    def run(self) -> None:
+        while True:
+            sleep(self.interval)
+            self.flush()
+
+
+    def flush(self) -> None:
+        '''Write the snapshot of this worker, called on exit of the worker as well'''
+        if self.directory is None: return
+        try:
+            _write(join(self.directory, f'{getpid()}.json'), snapshot())
+        except (OSError, TypeError) as err:
+            log.error(msg=f'Failed to write metrics: {err}')
+
+
+    def render(self) -> str:
+        '''Metrics of all the workers in Prometheus text exposition format'''
+        parts = [snapshot()]
+        if self.directory is not None:
+            own = f'{getpid()}.json'
+            with _Locked(self.directory, LOCK_SH):
+                for name in listdir(self.directory):
+                    if not name.endswith('.json') or name == own: continue
+                    part = _read(join(self.directory, name))
+                    if part is not None: parts.append(part)
+
+        merged = merge(parts)
+        return render_metrics(merged) + render_cache_stats(merged['cache'])
+
+
+def clear(directory: str) -> None:
+    '''Called by the master on start, counters start from zero with the server'''
+    makedirs(directory, exist_ok=True)
+    for name in listdir(directory):
+        if name.endswith('.json'): remove(join(directory, name))
+
+
+def retire(directory: str, pid: int) -> None:
+    '''Called by the master once the worker has exited, its counters are kept in `retired.json`'''
+    path = join(directory, f'{pid}.json')
+    try:
+        with _Locked(directory, LOCK_EX):
+            part = _read(path)
+            if part is None: return
+            # entries of its caches are gone with the worker
+            for counters in part.get('cache', {}).values(): counters.pop('size', None)
+            retired = _read(join(directory, RETIRED))
+            _write(join(directory, RETIRED), merge(( retired or {}, part )))
+            remove(path)
+    except OSError as err:
+        log.error(msg=f'Failed to keep metrics of worker {pid}: {err}')
+
+
+EXPORTER = MetricsExporter()
@@ -0,0 +1,67 @@
+'''
+Concurrent execution of independent queries.
+
+Calls are run on a bounded thread pool shared by the process, so the time
+of a page built from several queries is close to the slowest of them
+rather than to their sum. The pool is created on first use and dropped in forked children
+'''
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from os import getenv, register_at_fork
+from threading import Lock, local
+
+from app import make_logger
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+
+# keep it not above `MAX` of the connection pool, extra workers would only wait for connections
+WORKERS = int(getenv('DB_FANOUT_WORKERS', 8))
+
+_executor = None
+_executor_lock = Lock()
+_worker = local()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is not None: return _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='fan-out')
+            log.info(msg=f'Started fan-out pool with {WORKERS} workers')
+        return _executor
+
+
+def _run(context, func, args: tuple):
+    _worker.active = True
+    try:
+        return context.run(func, *args)
+    finally:
+        _worker.active = False
+
+
+def fan_out(*calls) -> list:
+    '''
+    Run each of `(func, *args)` calls concurrently and return their results in the same order.
+    Context variables of the caller are visible to the calls, exceptions are re-raised to the caller.
+
+    Single calls and calls made from inside of another fan-out are run on the calling thread,
+    the latter so that the workers never wait for the pool they occupy
+    '''
+    if len(calls) < 2 or WORKERS < 2 or getattr(_worker, 'active', False):
+        return [ func(*args) for func, *args in calls ]
+
+    pool = executor()
+    futures = [ pool.submit(_run, copy_context(), func, tuple(args)) for func, *args in calls ]
+    return [ future.result() for future in futures ]
+
+
+def _after_fork() -> None:
+    # worker threads are not inherited by the child
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = Lock()
+
+
+register_at_fork(after_in_child=_after_fork)
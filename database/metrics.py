@@ -0,0 +1,198 @@
+'''
+Latency histograms of named queries.
+
+For each query name the time to borrow a connection, to execute the statement and to fetch
+the rows is observed, as well as the number of rows and the errors by MySQL error code.
+Metrics are kept in memory of the process (each worker of `app.server` has its own ones),
+`snapshot()` of every worker is summed up by `database.exposition` and rendered
+in Prometheus text format by `render()`
+'''
+from bisect import bisect_left
+from contextvars import ContextVar
+from os import register_at_fork
+from threading import Lock
+from time import perf_counter
+
+from pymysql.err import Error
+
+# upper bounds of buckets, seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    'db_query_acquire_seconds': ('Time to borrow a connection from the pool', LATENCY_BUCKETS),
+    'db_query_execute_seconds': ('Time to execute the statement', LATENCY_BUCKETS),
+    'db_query_fetch_seconds': ('Time to fetch the rows', LATENCY_BUCKETS),
+    'db_query_rows': ('Number of rows fetched or affected', ROW_BUCKETS),
+}
+ERRORS = 'db_query_errors_total'
+
+# `[count]` of the failed runs of the current request, set by `view.conditional`.
+# Calls of `fan_out()` see the same list, so their failures are counted as well
+FAILURES = ContextVar('failures', default=None)
+
+
+def error_code(err: BaseException) -> str:
+    '''MySQL error code of the exception, class name for the other ones'''
+    if isinstance(err, Error) and err.args and isinstance(err.args[0], int):
+        return str(err.args[0])
+    return type(err).__name__
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: tuple) -> None:
+        self.bounds = bounds
+        # the last one is `+Inf`
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def render_histogram(name: str, labels: str, bounds: tuple, counts: list, total: float, count: int) -> list:
+    lines, cumulative = [], 0
+    for bound, observed in zip((*bounds, '+Inf'), counts):
+        cumulative += observed
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {total}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+    return lines
+
+
+class Observation:
+    '''
+    Timer of a single query run, phases are observed in order:
+
+    ```
+    with QUERY_METRICS.observe(name) as observed, connect.Connection(config) as conn:
+        observed.acquired()
+        conn.CURSOR.execute(sql, args)
+        observed.executed()
+        rows = conn.CURSOR.fetchall()
+        observed.fetched(len(rows))
+    ```
+
+    Exceptions leaving the block are counted by their error code and propagated.
+    `spent` and `rows` are left for the slow query log, see `database.slowlog`
+    '''
+    __slots__ = ('metrics', 'query', 'mark', 'spent', 'rows')
+
+    def __init__(self, metrics, query: str) -> None:
+        self.metrics = metrics
+        self.query = query
+        self.mark = None
+        # execute and fetch time, without waiting for connection
+        self.spent = 0
+        self.rows = None
+
+
+    def __enter__(self):
+        self.mark = perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_val is not None: self.metrics.error(self.query, error_code(exc_val))
+
+
+    def _phase(self, name: str) -> float:
+        now = perf_counter()
+        elapsed, self.mark = now - self.mark, now
+        self.metrics.add(name, self.query, elapsed)
+        return elapsed
+
+
+    def acquired(self, failure: BaseException = None) -> None:
+        self._phase('db_query_acquire_seconds')
+        if failure is not None: self.metrics.error(self.query, error_code(failure))
+
+
+    def executed(self) -> None:
+        self.spent += self._phase('db_query_execute_seconds')
+
+
+    def fetched(self, rows: int) -> None:
+        self.spent += self._phase('db_query_fetch_seconds')
+        self.rows = rows
+        self.metrics.add('db_query_rows', self.query, rows)
+
+
+class QueryMetrics:
+    '''
+    Thread-safe registry of the histograms and error counters by query name
+    '''
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        # (histogram name, query) -> Histogram
+        self._histograms = {}
+        # (query, code) -> count
+        self._errors = {}
+
+
+    def observe(self, query: str) -> Observation:
+        return Observation(self, query or 'unnamed')
+
+
+    def add(self, histogram: str, query: str, value: float) -> None:
+        key = (histogram, query)
+        with self._lock:
+            observed = self._histograms.get(key)
+            if observed is None:
+                observed = self._histograms[key] = Histogram(HISTOGRAMS[histogram][1])
+            observed.observe(value)
+
+
+    def error(self, query: str, code: str) -> None:
+        key = (query, code)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+        failures = FAILURES.get()
+        if failures is not None: failures[0] += 1
+
+
+    def snapshot(self) -> dict:
+        '''Plain copy of the metrics, summed up with the ones of the other workers by `database.exposition`'''
+        with self._lock:
+            return {
+                'histograms': [ [histogram, query, list(observed.counts), observed.sum, observed.count]
+                    for (histogram, query), observed in self._histograms.items() ],
+                'errors': [ [query, code, count] for (query, code), count in self._errors.items() ],
+            }
+
+
+    def reset(self) -> None:
+        self._lock = Lock()
+        self._histograms = {}
+        self._errors = {}
+
+
+def render(snapshot: dict) -> str:
+    '''Metrics of the snapshot in Prometheus text exposition format'''
+    lines = []
+    for name, (description, bounds) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for histogram, query, counts, total, count in sorted(snapshot['histograms']):
+            if histogram == name: lines.extend(render_histogram(name, f'query="{query}"', bounds, counts, total, count))
+
+    lines.append(f'# HELP {ERRORS} Failed runs by MySQL error code')
+    lines.append(f'# TYPE {ERRORS} counter')
+    for query, code, count in sorted(snapshot['errors']):
+        lines.append(f'{ERRORS}{{query="{query}",code="{code}"}} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+QUERY_METRICS = QueryMetrics()
+
+# metrics of the parent are not the worker's ones
+register_at_fork(after_in_child=QUERY_METRICS.reset)
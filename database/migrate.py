@@ -0,0 +1,133 @@
+'''
+Versioned schema migrations.
+
+Migrations of a db config entry are the `.sql` files in `migrations/<entry>/` named
+`<version>_<description>.sql`, they are applied in the order of versions. Applied versions
+are recorded in `schema_migrations` table of the schema, so that each migration runs once:
+
+    python -m database.migrate hospital auth
+    python -m database.migrate hospital --list
+
+DDL statements of MySQL are committed implicitly, a migration failed in the middle
+is not recorded and has to be fixed by hand before the next run
+'''
+import sys
+from argparse import ArgumentParser
+from os import getenv, listdir
+from os.path import isdir, join
+from re import compile
+
+from pymysql.err import Error
+
+from app import load_json_config, make_logger
+
+from . import connect
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+
+MIGRATIONS_DIR = getenv('MIGRATIONS_DIR', 'migrations')
+MIGRATION_FILE = compile(r'^(\d+)_[\w-]+\.sql$')
+
+CREATE_LOG = '''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT NOT NULL PRIMARY KEY COMMENT 'Version of the migration',
+    name VARCHAR(128) NOT NULL COMMENT 'File name',
+    applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT 'When it was applied'
+) default charset utf8 COMMENT 'Applied migrations, see database.migrate'
+'''
+
+
+def statements(path: str):
+    '''Statements of the `.sql` file separated by `;`, comments are dropped'''
+    with open(path, mode='r', encoding='utf-8') as file:
+        text = file.read()
+    for statement in text.split(';'):
+        lines = [ line for line in statement.splitlines() if not line.strip().startswith('--') ]
+        statement = '\n'.join(lines).strip()
+        if statement: yield statement
+
+
+def available(directory: str) -> list:
+    '''`(version, file name)` of the migrations in the directory, in order'''
+    if not isdir(directory): return []
+    found = []
+    for name in listdir(directory):
+        match = MIGRATION_FILE.match(name)
+        if match is not None: found.append((int(match.group(1)), name))
+    found.sort()
+
+    versions = [ version for version, _ in found ]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'Duplicate migration versions in {directory}')
+    return found
+
+
+def applied(config: dict) -> set or None:
+    '''Versions of the applied migrations, `None` if they could not be read'''
+    try:
+        with connect.Connection(config) as conn:
+            if not conn.CONNECTED: return
+            conn.CURSOR.execute(CREATE_LOG)
+            conn.CURSOR.execute('SELECT version FROM schema_migrations')
+            return { row[0] for row in conn.CURSOR.fetchall() }
+    except Error as err:
+        log.error(msg=f'Failed to read applied migrations: {err}')
+        return
+
+
+def migrate(config: dict, directory: str) -> list or None:
+    '''
+    Apply pending migrations from the directory, return names of the applied ones
+    or `None` if any of them failed (the ones before it stay applied)
+    '''
+    done = applied(config)
+    if done is None: return
+
+    names = []
+    for version, name in available(directory):
+        if version in done: continue
+        try:
+            with connect.Connection(config) as conn:
+                if not conn.CONNECTED: return
+                for statement in statements(join(directory, name)):
+                    conn.CURSOR.execute(statement)
+                conn.CURSOR.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (version, name))
+        except Error as err:
+            log.error(msg=f'Migration {name} failed: {err}')
+            return
+
+        log.info(msg=f'Applied migration {name}')
+        names.append(name)
+    return names
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('entries', nargs='+', help='entries of the db config, e.g. hospital')
+    parser.add_argument('--db-config', default=getenv('DB_CONFIG', 'config/db.json'))
+    parser.add_argument('--dir', default=MIGRATIONS_DIR, help='directory with migrations of the entries')
+    parser.add_argument('--list', action='store_true', help='only show applied and pending migrations')
+    args = parser.parse_args()
+
+    config = load_json_config(args.db_config)
+    failed = False
+    for entry in args.entries:
+        directory = join(args.dir, entry)
+        if args.list:
+            done = applied(config[entry]) or set()
+            for version, name in available(directory):
+                print(entry, name, 'applied' if version in done else 'pending')
+            continue
+
+        names = migrate(config[entry], directory)
+        if names is None:
+            print(f'{entry}: failed, see the db log')
+            failed = True
+            continue
+        print(f'{entry}: applied {names or "nothing"}')
+
+    if failed: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+from os import getenv, register_at_fork
+from threading import Condition, Lock
+from time import monotonic
+
+from pymysql import connect
+from pymysql.err import Error
+
+from app import make_logger
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+
+# defaults used when config entry has no `POOL` section
+POOL_DEFAULTS = {
+    'MIN': 1,
+    'MAX': 8,
+    'IDLE': 300,
+    'TIMEOUT': 10,
+}
+
+class ConnectionPool:
+    '''
+    Thread-safe pool of `pymysql` connections for a single config entry
+
+    Connections are borrowed with `acquire()` and given back with `release()`.
+    Idle connections older than `IDLE` seconds are closed (but the pool keeps at least `MIN` of them),
+    borrowed connections are pinged first so that dead ones are never handed out
+    '''
+
+    def __init__(self, config: dict) -> None:
+        settings = dict(POOL_DEFAULTS)
+        settings.update(config.get('POOL', {}))
+
+        self.DB_CONFIG = config
+        self.MIN_SIZE = int(settings['MIN'])
+        self.MAX_SIZE = int(settings['MAX'])
+        self.IDLE = float(settings['IDLE'])
+        self.TIMEOUT = float(settings['TIMEOUT'])
+
+        if self.MIN_SIZE < 0 or self.MAX_SIZE < 1 or self.MIN_SIZE > self.MAX_SIZE:
+            raise ValueError(f'Invalid pool size settings: {settings}')
+
+        # idle connections are stored as (connection, returned_at) pairs, most recent last
+        self._idle = []
+        self._size = 0
+        self._lock = Lock()
+        self._available = Condition(self._lock)
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'borrowed': 0,
+            'reused': 0,
+            'evicted': 0,
+            'failed_checks': 0,
+            'timeouts': 0,
+        }
+        log.debug('Created pool for %s with size %s..%s', config.get("SCHEMA"), self.MIN_SIZE, self.MAX_SIZE)
+
+
+    def _connect(self):
+        return connect(
+            host=self.DB_CONFIG['HOST'],
+            port=self.DB_CONFIG['PORT'],
+            user=self.DB_CONFIG['USER'],
+            password=self.DB_CONFIG['PASSWORD'],
+            database=self.DB_CONFIG['SCHEMA']
+        )
+
+
+    def _close(self, connection) -> None:
+        try:
+            connection.close()
+        except Error:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._available.notify()
+
+
+    def _evict_idle(self) -> list:
+        # must be called with lock held, returns connections to be closed outside of the lock
+        now = monotonic()
+        expired = []
+        while len(self._idle) > self.MIN_SIZE:
+            _, returned_at = self._idle[0]
+            if now - returned_at < self.IDLE: break
+            expired.append(self._idle.pop(0)[0])
+        self._stats['evicted'] += len(expired)
+        return expired
+
+
+    def acquire(self):
+        '''
+        Borrow a connection from the pool. Opens a new one if the pool is not full,
+        waits up to `TIMEOUT` seconds otherwise
+
+        Raises `pymysql.err.OperationalError` if the connection could not be opened
+        and `TimeoutError` if the pool stays exhausted
+        '''
+        deadline = monotonic() + self.TIMEOUT
+
+        while True:
+            with self._lock:
+                expired = self._evict_idle()
+                connection = None
+
+                while not self._idle and self._size >= self.MAX_SIZE:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise TimeoutError(f'Pool for {self.DB_CONFIG.get("SCHEMA")} exhausted')
+                    self._available.wait(remaining)
+
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                else:
+                    # reserve the slot before connecting so other threads respect MAX
+                    self._size += 1
+
+            for stale in expired:
+                self._close(stale)
+
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Error:
+                    with self._lock:
+                        self._size -= 1
+                        self._available.notify()
+                    raise
+                with self._lock:
+                    self._stats['created'] += 1
+                    self._stats['borrowed'] += 1
+                log.debug(msg=f'Opened new pooled connection')
+                return connection
+
+            # health check for connections which were sitting in the pool
+            try:
+                connection.ping(reconnect=False)
+            except Error:
+                log.warning(msg=f'Pooled connection failed health check, discarding it')
+                with self._lock:
+                    self._stats['failed_checks'] += 1
+                self._close(connection)
+                continue
+
+            with self._lock:
+                self._stats['borrowed'] += 1
+                self._stats['reused'] += 1
+            return connection
+
+
+    def release(self, connection, discard: bool = False) -> None:
+        '''
+        Give the connection back to the pool. Broken connections
+        should be released with `discard=True` so that they are closed instead
+        '''
+        if discard or not connection.open:
+            self._close(connection)
+            return
+
+        with self._lock:
+            self._idle.append((connection, monotonic()))
+            self._available.notify()
+
+
+    def warm_up(self) -> int:
+        '''
+        Open connections up to `MIN` and leave them idle, so that the first requests
+        do not wait for handshakes. Returns the number of connections ready
+        '''
+        borrowed = []
+        try:
+            for _ in range(self.MIN_SIZE): borrowed.append(self.acquire())
+        except (Error, TimeoutError) as err:
+            log.warning(msg=f'Failed to warm up pool for {self.DB_CONFIG.get("SCHEMA")}: {err}')
+        finally:
+            for connection in borrowed: self.release(connection)
+        return len(borrowed)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min': self.MIN_SIZE,
+                'max': self.MAX_SIZE,
+            })
+        return stats
+
+
+    def close(self) -> None:
+        with self._lock:
+            idle = [connection for connection, _ in self._idle]
+            self._idle = []
+        for connection in idle:
+            self._close(connection)
+
+
+POOLS = {}
+POOLS_LOCK = Lock()
+
+def config_key(config: dict) -> tuple:
+    # config entries are plain dicts, so pools are keyed by the connection target
+    return tuple(config.get(key) for key in ('HOST', 'PORT', 'USER', 'SCHEMA'))
+
+
+def get_pool(config: dict) -> ConnectionPool:
+    '''
+    Return the pool for the given config entry, create one on first use
+    '''
+    key = config_key(config)
+    pool = POOLS.get(key)
+    if pool is not None: return pool
+
+    with POOLS_LOCK:
+        if key not in POOLS:
+            POOLS[key] = ConnectionPool(config)
+        return POOLS[key]
+
+
+def pool_stats() -> dict:
+    return { '/'.join(str(part) for part in key): pool.stats() for key, pool in list(POOLS.items()) }
+
+
+def _after_fork() -> None:
+    # connections of the parent share sockets with it, the child opens its own
+    global POOLS_LOCK
+    POOLS.clear()
+    POOLS_LOCK = Lock()
+
+
+register_at_fork(after_in_child=_after_fork)
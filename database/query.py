@@ -1,27 +1,15 @@
-import logging
-from logging.handlers import TimedRotatingFileHandler
 from os import getenv
 
-from pymysql.err import ProgrammingError, OperationalError
+from pymysql.cursors import SSCursor
+from pymysql.err import ProgrammingError, OperationalError, Error
 
-from . import connect
-
-log = logging.getLogger(__name__)
-# enable logging routines
-# write log to a file with specified filename (provided via environmental variable)
-# set needed level and optionally disable logging completely
-
-DEBUGLEVEL = getenv('DEBUG_LEVEL','DEBUG')
-LOGFILE = getenv('DB_LOGFILE_NAME', 'logs/db.log')
+from app import make_logger
 
-log.disabled = getenv('LOG_ON', "True") == "False"
+from . import connect
+from .metrics import QUERY_METRICS
+from .slowlog import SLOW_QUERIES
 
-log.setLevel(getattr(logging, DEBUGLEVEL))
-# handler = logging.FileHandler(filename=f'{LOGFILE}', encoding='utf-8')
-handler = TimedRotatingFileHandler(filename=f'{LOGFILE}', encoding='utf-8', when='h', interval=5, backupCount=0)
-formatter = logging.Formatter('[%(asctime)s]::[%(levelname)s]::[%(name)s]::%(message)s', '%D # %H:%M:%S')
-handler.setFormatter(formatter)
-log.addHandler(handler)
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
 
 class Query():
     '''
@@ -29,12 +17,14 @@ class Query():
 
     If a given query fails at some point, rule of thumb is to catch such error and return `None`
 
-    Accepts settings from specified `connection_settings` dict
+    Accepts settings from specified `connection_settings` dict,
+    runs are observed in `QUERY_METRICS` under the given `name`
     '''
     DB_CONFIG = None
 
-    def __init__(self, connection_settings:dict):
+    def __init__(self, connection_settings:dict, name: str = None):
         self.DB_CONFIG = connection_settings
+        self.name = name
         return
 
 
@@ -45,13 +35,13 @@ class Query():
         log.debug(msg=f'Executes given raw query')
         if not isinstance(raw, str): raise TypeError
         
-        log.debug(msg=f'Query is: {raw}')
+        log.debug('Query is: %s', raw)
         try:
             with connect.Connection(self.DB_CONFIG) as conn:
                 if not conn.CONNECTED: return
                 conn.CURSOR.execute(query=raw)
                 fetched = ( row for row in conn.CURSOR.fetchall() )
-                log.debug(msg=f'Affected {conn.CURSOR.rowcount} rows')
+                log.debug('Affected %s rows', conn.CURSOR.rowcount)
                 return fetched
         except (OperationalError, ProgrammingError):
             log.error(msg=f'Encountered error during execution')
@@ -60,18 +50,97 @@ class Query():
 
     def execute_with_args(self, query: str, *args) -> tuple or None:
 
-        log.debug(msg=f'Executes query with params: {args}')
-        log.debug(msg=f'Request is: {query}')
+        log.debug('Executes query with params: %s', args)
+        log.debug('Request is: %s', query)
 
         try:
-            with connect.Connection(self.DB_CONFIG) as conn:
+            with QUERY_METRICS.observe(self.name) as observed, connect.Connection(self.DB_CONFIG) as conn:
+                observed.acquired(conn.ERROR)
                 if not conn.CONNECTED: return
                 conn.CURSOR.execute(query, args)
-                fetched = ( row for row in conn.CURSOR.fetchall() )
-                log.debug(msg=f'Affected {conn.CURSOR.rowcount} rows')
-                return fetched
+                observed.executed()
+                rows = conn.CURSOR.fetchall()
+                observed.fetched(len(rows) or max(conn.CURSOR.rowcount, 0))
+                log.debug('Affected %s rows', conn.CURSOR.rowcount)
         except (OperationalError, ProgrammingError):
             log.error(msg=f'Encountered error during execution')
             return
-            
-        
\ No newline at end of file
+
+        # after the connection is given back, explaining takes another one
+        SLOW_QUERIES.check(self.DB_CONFIG, query, args, observed)
+        return ( row for row in rows )
+
+
+    def execute_streamed(self, query: str, *args):
+        '''
+        Execute query with unbuffered (server-side) cursor. Rows are not materialized,
+        they are read from the socket while the returned `StreamedRows` is iterated.
+        The connection stays borrowed until the rows are exhausted or the iterator is closed
+        '''
+        log.debug('Executes streamed query with params: %s', args)
+        log.debug('Request is: %s', query)
+
+        # rows are fetched while the response is rendered, so only acquire and execute are observed
+        observed = QUERY_METRICS.observe(self.name).__enter__()
+        conn = connect.Connection(self.DB_CONFIG, cursor=SSCursor).__enter__()
+        observed.acquired(conn.ERROR)
+        if not conn.CONNECTED: return
+
+        try:
+            conn.CURSOR.execute(query, args)
+            observed.executed()
+        except (OperationalError, ProgrammingError) as err:
+            conn.__exit__(type(err), err, err.__traceback__)
+            observed.__exit__(type(err), err, err.__traceback__)
+            log.error(msg=f'Encountered error during execution')
+            return
+
+        return StreamedRows(conn)
+
+
+class StreamedRows:
+    '''
+    Iterator over rows of unbuffered cursor
+
+    Gives the connection back to the pool as soon as the rows are exhausted,
+    the iterator is closed or garbage collected. If the connection fails in the middle,
+    the error is logged and iteration stops
+    '''
+
+    def __init__(self, conn: connect.Connection) -> None:
+        self.conn = conn
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        if self.conn is None: raise StopIteration
+
+        try:
+            row = self.conn.CURSOR.fetchone()
+        except Error as err:
+            log.error(msg=f'Encountered error while streaming rows')
+            self._finish(err)
+            raise StopIteration
+
+        if row is None:
+            self._finish()
+            raise StopIteration
+        return row
+
+
+    def _finish(self, err: Exception = None) -> None:
+        conn, self.conn = self.conn, None
+        if conn is None: return
+        if err is None: conn.__exit__(None, None, None)
+        else: conn.__exit__(type(err), err, err.__traceback__)
+
+
+    def close(self) -> None:
+        self._finish()
+
+
+    def __del__(self):
+        self._finish()
@@ -0,0 +1,199 @@
+from os import getenv, walk
+from os.path import isdir, join, getmtime, splitext
+from re import compile, IGNORECASE
+from threading import Lock
+from time import monotonic
+
+from app import make_logger
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+
+# with hot reload on, the files are checked for changes at most once per interval
+HOT_RELOAD = getenv('SQL_HOT_RELOAD', "False") == "True"
+RELOAD_INTERVAL = float(getenv('SQL_RELOAD_INTERVAL', 2))
+
+# `%s` placeholders, `%%` is an escaped percent sign
+PLACEHOLDER = compile(r'%%|%s')
+
+def count_placeholders(sql: str) -> int:
+    return sum(1 for match in PLACEHOLDER.findall(sql) if match == '%s')
+
+
+TABLE_PATTERN = compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+`?(\w+)`?', IGNORECASE)
+
+def query_tables(sql: str) -> frozenset:
+    '''
+    Names of the tables the given statement reads from or writes to
+    '''
+    return frozenset(table.lower() for table in TABLE_PATTERN.findall(sql))
+
+
+READ_PATTERN = compile(r'^\s*(?:SELECT|WITH)\b', IGNORECASE)
+LOCKING_PATTERN = compile(r'\bFOR\s+(?:UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b', IGNORECASE)
+
+def is_plain_read(sql: str) -> bool:
+    '''
+    Whether the statement only reads, locking reads are part of writes and do not count
+    '''
+    return bool(READ_PATTERN.match(sql)) and not LOCKING_PATTERN.search(sql)
+
+
+class QueryCollision(ValueError):
+    pass
+
+
+class SQLQuery:
+    '''
+    Text of a single named query along with its metadata:
+    the number of placeholders, the tables it touches and whether it only reads
+    '''
+    __slots__ = ('name', 'path', 'text', 'mtime', 'arity', 'tables', 'read')
+
+    def __init__(self, name: str, path: str) -> None:
+        self.name = name
+        self.path = path
+        self.load()
+
+
+    def load(self) -> None:
+        self.mtime = getmtime(self.path)
+        with open(self.path, mode='r', encoding='utf-8') as file:
+            self.text = file.read()
+        self.arity = count_placeholders(self.text)
+        self.tables = query_tables(self.text)
+        self.read = is_plain_read(self.text)
+
+
+class QueryRegistry:
+    '''
+    Named SQL queries from the query directory
+
+    Query name is the basename of `.sql` file, the same name in
+    two subdirectories is reported as `QueryCollision`. The files are read lazily, on first use,
+    and parsed for the number of placeholders so that the arguments
+    can be checked before anything goes to the server (see `check_arity()`).
+
+    Supports `in` and `[]` like the plain dict of queries did. With `hot_reload`
+    the files are re-read once their mtime changes and new files are picked up
+    '''
+
+    def __init__(self, querydir: str, hot_reload: bool = HOT_RELOAD) -> None:
+        if not isdir(querydir): raise NotADirectoryError(querydir)
+
+        self.querydir = querydir
+        self.hot_reload = hot_reload
+        self._queries = {}
+        self._lock = Lock()
+        self._checked_at = monotonic()
+        self._paths = self._scan()
+
+
+    def _scan(self) -> dict:
+        paths = {}
+        collisions = []
+        for directory, _, files in walk(self.querydir):
+            for file in sorted(files):
+                name, extension = splitext(file)
+                if extension != '.sql': continue
+                path = join(directory, file)
+                if name in paths: collisions.append(f'{paths[name]} and {path}')
+                paths[name] = path
+
+        if collisions:
+            raise QueryCollision(f'Duplicate query names: {"; ".join(collisions)}')
+
+        log.info(msg=f'Found {len(paths)} queries in {self.querydir}')
+        return paths
+
+
+    def _refresh(self) -> None:
+        if not self.hot_reload: return
+
+        now = monotonic()
+        if now - self._checked_at < RELOAD_INTERVAL: return
+
+        with self._lock:
+            if now - self._checked_at < RELOAD_INTERVAL: return
+            self._checked_at = now
+
+            try:
+                paths = self._scan()
+            except (QueryCollision, OSError) as err:
+                # keep serving the queries loaded before
+                log.error(msg=f'Failed to reload queries: {err}')
+                return
+
+            queries = {}
+            for name, query in self._queries.items():
+                if paths.get(name) != query.path: continue
+                try:
+                    if getmtime(query.path) != query.mtime:
+                        # replaced rather than updated so that readers never see half-loaded query
+                        query = SQLQuery(name, query.path)
+                        log.info(msg=f'Reloaded query {name}')
+                except OSError as err:
+                    log.error(msg=f'Failed to reload query {name}: {err}')
+                queries[name] = query
+
+            self._paths, self._queries = paths, queries
+
+
+    def get(self, name: str) -> SQLQuery or None:
+        self._refresh()
+        query = self._queries.get(name)
+        if query is not None: return query
+
+        path = self._paths.get(name)
+        if path is None: return
+
+        with self._lock:
+            if name not in self._queries:
+                self._queries[name] = SQLQuery(name, path)
+            return self._queries[name]
+
+
+    def __contains__(self, name: str) -> bool:
+        self._refresh()
+        return name in self._paths
+
+
+    def __getitem__(self, name: str) -> str:
+        query = self.get(name)
+        if query is None: raise KeyError(name)
+        return query.text
+
+
+    def __iter__(self):
+        return iter(list(self._paths))
+
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+    def check_arity(self, name: str, args: tuple) -> bool:
+        '''
+        Whether the number of `args` matches the placeholders of the query
+        '''
+        query = self.get(name)
+        if query is None: return False
+        if query.arity == len(args): return True
+
+        log.error(msg=f'Query {name} expects {query.arity} args, given {len(args)}')
+        return False
+
+
+REGISTRIES = {}
+REGISTRIES_LOCK = Lock()
+
+def get_registry(querydir: str) -> QueryRegistry:
+    '''
+    Return the registry for the given query directory, create one on first use
+    '''
+    registry = REGISTRIES.get(querydir)
+    if registry is not None: return registry
+
+    with REGISTRIES_LOCK:
+        if querydir not in REGISTRIES:
+            REGISTRIES[querydir] = QueryRegistry(querydir)
+        return REGISTRIES[querydir]
@@ -0,0 +1,141 @@
+'''
+Routing of reads to replicas.
+
+An entry of the db config may list read replicas, each of them overrides
+the connection settings of the primary:
+
+```
+"hospital": {
+    "HOST": "10.0.0.1",
+    ...
+    "REPLICAS": [ {"HOST": "10.0.0.2"}, {"HOST": "10.0.0.3", "PORT": 3307} ],
+    "PIN": 5
+}
+```
+
+Reads of `DataSource` go to the healthy replicas in turn, writes of `DataModifier` (and its reads)
+always go to the primary. After a write the context is pinned to the primary for `PIN` seconds,
+so that the writer reads its own writes while the replicas catch up. The pin is kept in
+the Flask session between requests (see `view.pinning`) and is seen by `fan_out()` calls.
+A replica which failed to connect, lost the connection or kept the whole pool busy is skipped
+for `DB_REPLICA_RETRY` seconds (see `configure()`), reads failed on a replica are retried on the primary.
+
+Replicas may lag for everyone else as well, so what is kept for other requests must not
+come from a replica read of tables written less than `PIN` seconds before (see `settled()`):
+such results are not cached by `DataSource` and such pages get no ETag (see `view.conditional`)
+'''
+from contextvars import ContextVar
+from itertools import count
+from os import getenv, register_at_fork
+from threading import Lock
+from time import monotonic, time
+
+from app import make_logger
+
+from .pool import config_key
+from .versions import VERSIONS
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+
+# used until `configure()` is called
+RETRY_AFTER = 30
+PIN_DEFAULT = 5
+
+# wall clock time, the pin travels between processes in the session cookie
+PINNED_UNTIL = ContextVar('pinned_until', default=0.0)
+
+
+class ReplicaSet:
+    '''
+    Primary of a config entry and its replicas
+    '''
+
+    def __init__(self, config: dict) -> None:
+        self.primary = config
+        base = { key: value for key, value in config.items() if key not in ('REPLICAS', 'CACHE') }
+        self.replicas = [ { **base, **replica } for replica in config.get('REPLICAS', []) ]
+        self.pin = float(config.get('PIN', PIN_DEFAULT))
+        self._turn = count()
+        # replica index -> monotonic time until which it is skipped
+        self._down = {}
+
+
+    def pinned(self) -> bool:
+        '''Whether the reads of this context go to the primary after its own write'''
+        return bool(self.replicas) and PINNED_UNTIL.get() > time()
+
+
+    def settled(self, tables, since: float) -> bool:
+        '''Whether the replicas had `PIN` seconds to catch up with the writes to `tables` before `since`'''
+        return not self.replicas or VERSIONS.changed_at(tables) + self.pin <= since
+
+
+    def choose(self) -> dict:
+        '''Config to read from'''
+        if not self.replicas or PINNED_UNTIL.get() > time(): return self.primary
+
+        now = monotonic()
+        for _ in range(len(self.replicas)):
+            index = next(self._turn) % len(self.replicas)
+            if self._down.get(index, 0) <= now: return self.replicas[index]
+        return self.primary
+
+
+    def failed(self, index: int) -> None:
+        self._down[index] = monotonic() + RETRY_AFTER
+        log.warning(msg=f'Replica {self.replicas[index].get("HOST")}:{self.replicas[index].get("PORT")} '
+            f'is skipped for {RETRY_AFTER}s')
+
+
+    def pin_primary(self) -> None:
+        '''Called after a write committed to the primary'''
+        if self.replicas: PINNED_UNTIL.set(time() + self.pin)
+
+
+def configure(retry_after: float) -> None:
+    global RETRY_AFTER
+    RETRY_AFTER = retry_after
+
+
+def lag_window(db_config: dict) -> float:
+    '''The longest `PIN` of the entries with replicas, 0 without replicas'''
+    return max(( float(entry.get('PIN', PIN_DEFAULT)) for entry in db_config.values() if entry.get('REPLICAS') ), default=0.0)
+
+
+REPLICA_SETS = {}
+# connection target of a replica -> (its set, index)
+REPLICA_OF = {}
+REPLICA_SETS_LOCK = Lock()
+
+def get_replicas(config: dict) -> ReplicaSet:
+    '''
+    Return the replica set of the given config entry, create one on first use
+    '''
+    key = config_key(config)
+    replicas = REPLICA_SETS.get(key)
+    if replicas is not None: return replicas
+
+    with REPLICA_SETS_LOCK:
+        if key not in REPLICA_SETS:
+            replicas = ReplicaSet(config)
+            for index, replica in enumerate(replicas.replicas):
+                # a replica pointing at the primary itself is not taken out of rotation
+                if config_key(replica) != key: REPLICA_OF[config_key(replica)] = (replicas, index)
+            REPLICA_SETS[key] = replicas
+        return REPLICA_SETS[key]
+
+
+def connection_failed(config: dict) -> None:
+    '''Reported by `Connection` when it could not connect or lost the connection, replicas are taken out of rotation'''
+    owner = REPLICA_OF.get(config_key(config))
+    if owner is not None: owner[0].failed(owner[1])
+
+
+def _after_fork() -> None:
+    global REPLICA_SETS_LOCK
+    REPLICA_SETS.clear()
+    REPLICA_OF.clear()
+    REPLICA_SETS_LOCK = Lock()
+
+
+register_at_fork(after_in_child=_after_fork)
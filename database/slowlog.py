@@ -0,0 +1,116 @@
+'''
+Log of slow named queries.
+
+Runs of named queries taking longer than `SLOW_QUERY_THRESHOLD` seconds (execute and fetch,
+waiting for connection is not counted) are written to `SLOW_QUERY_LOGFILE` as JSON lines
+with the query name, redacted parameters, duration and rows. A sample of them
+(`SLOW_QUERY_EXPLAIN_SAMPLE`, at most once per `SLOW_QUERY_EXPLAIN_INTERVAL` seconds for each query)
+also gets the plan, `EXPLAIN` is run on a separate connection with the actual parameters,
+once the connection of the query (or of the whole transaction) is released.
+The thresholds are set from the app config by `create_app()`, see `configure()`
+'''
+import datetime
+import json
+from decimal import Decimal
+from os import getenv, register_at_fork
+from random import random
+from threading import Lock
+from time import monotonic
+
+from pymysql.err import Error
+
+from app import make_logger
+
+from . import connect
+from .metrics import Observation
+
+log = make_logger(__name__, getenv('DB_LOGFILE_NAME', 'logs/db.log'))
+slow_log = make_logger('slow-queries', getenv('SLOW_QUERY_LOGFILE', 'logs/slow.log'))
+
+# used until `configure()` is called
+THRESHOLD = 0.5
+EXPLAIN_SAMPLE = 0.1
+EXPLAIN_INTERVAL = 60
+# values of these types are ids and flags rather than personal data
+PLAIN_TYPES = (int, float, Decimal, bool, type(None))
+
+
+def redact(args: tuple) -> list:
+    return [ arg if isinstance(arg, PLAIN_TYPES) else f'<{type(arg).__name__}:{len(str(arg))}>' for arg in args ]
+
+
+def plain(value):
+    # plan rows may contain bytes and decimals
+    if isinstance(value, bytes): return value.decode('utf-8', 'replace')
+    if isinstance(value, (Decimal, datetime.date)): return str(value)
+    return value
+
+
+class SlowQueryLog:
+    '''
+    Checks finished runs against the threshold, see `check()`
+    '''
+
+    def __init__(self, threshold: float, explain_sample: float, explain_interval: float) -> None:
+        self.configure(threshold, explain_sample, explain_interval)
+        self._lock = Lock()
+        # query name -> when it was explained last time
+        self._explained = {}
+
+
+    def configure(self, threshold: float, explain_sample: float, explain_interval: float) -> None:
+        self.threshold = threshold
+        self.explain_sample = explain_sample
+        self.explain_interval = explain_interval
+
+
+    def slow(self, observed: Observation) -> bool:
+        return self.threshold > 0 and observed.spent >= self.threshold
+
+
+    def check(self, config: dict, sql: str, args: tuple, observed: Observation) -> None:
+        '''Log the run if it is slow, call it once the connection is released'''
+        if not self.slow(observed): return
+
+        entry = {
+            'query': observed.query,
+            'duration_ms': round(observed.spent * 1e3, 2),
+            'rows': observed.rows,
+            'params': redact(args),
+        }
+        if self._explain_due(observed.query):
+            entry['plan'] = self.explain(config, sql, args)
+
+        slow_log.warning('%s', json.dumps(entry, ensure_ascii=False, default=str))
+
+
+    def _explain_due(self, query: str) -> bool:
+        if random() >= self.explain_sample: return False
+        now = monotonic()
+        with self._lock:
+            explained = self._explained.get(query)
+            if explained is not None and now - explained < self.explain_interval: return False
+            self._explained[query] = now
+            return True
+
+
+    def explain(self, config: dict, sql: str, args: tuple) -> list or None:
+        '''Plan of the statement as a list of `EXPLAIN` rows (dicts)'''
+        try:
+            with connect.Connection(config) as conn:
+                if not conn.CONNECTED: return
+                conn.CURSOR.execute(f'EXPLAIN {sql}', args)
+                columns = [ column[0] for column in conn.CURSOR.description ]
+                return [ { column: plain(value) for column, value in zip(columns, row) } for row in conn.CURSOR.fetchall() ]
+        except Error as err:
+            log.warning(msg=f'Failed to explain slow query: {err}')
+            return
+
+
+    def after_fork(self) -> None:
+        self._lock = Lock()
+        self._explained = {}
+
+
+SLOW_QUERIES = SlowQueryLog(THRESHOLD, EXPLAIN_SAMPLE, EXPLAIN_INTERVAL)
+register_at_fork(after_in_child=SLOW_QUERIES.after_fork)
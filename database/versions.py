@@ -0,0 +1,73 @@
+'''
+Data version counters of the tables.
+
+Every committed write bumps the counters of the tables it touched (see `DataModifier`),
+so a page built from some tables is unchanged as long as their counters are the same.
+The counters live in anonymous shared memory mapped before the workers of `app.server` fork,
+so a write served by one worker is seen by all of them.
+
+Tables are hashed into a fixed number of slots: a collision only makes the counter
+of another table change more often than needed. Writes made outside of the app are not seen.
+
+Along with the counters the time of the last bump is kept, so that reads served by replicas
+can tell whether they may lag behind a recent write (see `database.routing`)
+'''
+from mmap import mmap
+from multiprocessing import Lock
+from os import urandom
+from time import time
+from zlib import crc32
+
+SLOTS = 256
+# the last slot counts reloads of the workers, pages rendered by older code are stale as well
+RELOADS = SLOTS
+# a worker killed while holding the lock must not block the others forever
+LOCK_TIMEOUT = 1
+
+
+class DataVersions:
+    def __init__(self) -> None:
+        # shared with the processes forked later on: counters, then wall clock times of the last bumps
+        self._map = mmap(-1, 2 * 8 * (SLOTS + 1))
+        self._counters = memoryview(self._map)[:8 * (SLOTS + 1)].cast('Q')
+        self._changed = memoryview(self._map)[8 * (SLOTS + 1):].cast('d')
+        self._lock = Lock()
+        # counters start from zero on each start of the server
+        self.epoch = urandom(4).hex()
+
+
+    def slot(self, table: str) -> int:
+        return crc32(table.encode()) % SLOTS
+
+
+    def _bump(self, slots) -> None:
+        locked = self._lock.acquire(timeout=LOCK_TIMEOUT)
+        now = time()
+        try:
+            for slot in slots:
+                self._counters[slot] += 1
+                self._changed[slot] = now
+        finally:
+            if locked: self._lock.release()
+
+
+    def bump(self, tables: frozenset) -> None:
+        '''Called after the commit of the write to `tables`'''
+        if tables: self._bump({ self.slot(table) for table in tables })
+
+
+    def bump_reloads(self) -> None:
+        self._bump((RELOADS,))
+
+
+    def changed_at(self, tables) -> float:
+        '''Wall clock time of the last write to any of the tables, 0 if none was seen'''
+        return max(( self._changed[self.slot(table)] for table in tables ), default=0.0)
+
+
+    def stamp(self, tables) -> tuple:
+        '''Versions of the tables, read them before the data'''
+        return (self.epoch, self._counters[RELOADS], *( self._counters[self.slot(table)] for table in tables ))
+
+
+VERSIONS = DataVersions()
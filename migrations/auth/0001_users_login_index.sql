@@ -0,0 +1,15 @@
+-- Login: `user_login LIKE %s`, the pattern has no leading wildcard so it is a range on the index.
+-- Schemas which already have an index starting with `user_login` (e.g. its unique key) are left as they are,
+-- otherwise the index is created
+SET @users_login_index = IF(
+    EXISTS (
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users'
+            AND COLUMN_NAME = 'user_login' AND SEQ_IN_INDEX = 1
+    ),
+    'DO 0',
+    'CREATE INDEX idx_users_login ON users (user_login)'
+);
+PREPARE users_login_index FROM @users_login_index;
+EXECUTE users_login_index;
+DEALLOCATE PREPARE users_login_index;
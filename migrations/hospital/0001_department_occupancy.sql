@@ -0,0 +1,10 @@
+-- created by hand before the migrations were introduced on some servers
+CREATE TABLE IF NOT EXISTS department_occupancy (
+    department INT NOT NULL COMMENT 'Department id',
+    class VARCHAR(64) NOT NULL COMMENT 'Chamber class',
+    totalspace INT NOT NULL DEFAULT 0 COMMENT 'Places in the chambers of the class',
+    occupied INT NOT NULL DEFAULT 0 COMMENT 'Occupied places',
+    PRIMARY KEY (department, class),
+    FOREIGN KEY (department)
+        REFERENCES department(id_department)
+) default charset utf8 COMMENT 'Rollup of chamber, maintained by the app';
\ No newline at end of file
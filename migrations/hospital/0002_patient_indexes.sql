@@ -0,0 +1,8 @@
+-- Dischargable patients: `date_outcome IS NULL AND outcome_diagnosis IS NOT NULL`, paginated by id.
+-- Secondary indexes of InnoDB end with the primary key, so the rows with `date_outcome IS NULL`
+-- are read in the order of `id_patient` and `LIMIT` stops the scan early.
+-- `outcome_diagnosis` is TEXT and a range on its prefix would break that order,
+-- so it is checked on the rows found.
+-- Newcome patients (`attending_doctor IS NULL`) are served the same way by the index
+-- InnoDB creates for the foreign key on `attending_doctor`
+CREATE INDEX idx_patient_outcome ON patient (date_outcome);
@@ -0,0 +1,8 @@
+-- Active doctors of a department ordered by load:
+-- `workplace = %s AND date_discharge IS NULL ORDER BY assigned_patients`
+CREATE INDEX idx_doctor_workplace_load ON doctor (workplace, date_discharge, assigned_patients);
+
+-- Chambers of a department with free places: `department = %s AND totalspace > occupied`.
+-- The comparison of two columns is not sargable, but it is checked on the index entries
+-- and `ORDER BY totalspace` is served by the index
+CREATE INDEX idx_chamber_department_space ON chamber (department, totalspace, occupied);
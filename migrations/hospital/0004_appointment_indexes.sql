@@ -0,0 +1,3 @@
+-- Appointments by status: `progress = %s`,
+-- filters by doctor and by patient use the indexes of the foreign keys
+CREATE INDEX idx_appointment_progress ON appointment (progress);
@@ -0,0 +1,14 @@
+SELECT
+    appointment.id,
+    appointment.assignee_id,
+    appointment.patient_id,
+    appointment.scheduled,
+    appointment.about,
+    appointment.progress,
+    patient.firstname,
+    patient.secondname
+FROM
+    appointment LEFT JOIN patient
+    ON appointment.patient_id = patient.id_patient
+WHERE 1
+    AND appointment.progress = %s;
\ No newline at end of file
@@ -0,0 +1,9 @@
+SELECT
+    chamber.id_chamber,
+    chamber.totalspace,
+    chamber.occupied
+FROM chamber
+WHERE 1
+    AND chamber.department = %s
+    AND chamber.totalspace > chamber.occupied
+FOR UPDATE
\ No newline at end of file
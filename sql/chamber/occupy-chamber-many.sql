@@ -0,0 +1,4 @@
+UPDATE chamber
+SET chamber.occupied = chamber.occupied + %s
+WHERE 1
+    AND chamber.id_chamber = %s
\ No newline at end of file
@@ -0,0 +1,11 @@
+SELECT
+    doctor.id_doctor,
+    doctor.first_name,
+    doctor.second_name,
+    doctor.assigned_patients
+FROM
+    doctor
+WHERE 1
+    AND date_discharge is NULL
+    AND workplace = %s
+FOR UPDATE
\ No newline at end of file
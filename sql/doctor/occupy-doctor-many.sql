@@ -0,0 +1,5 @@
+UPDATE doctor
+SET
+    doctor.assigned_patients = doctor.assigned_patients + %s
+WHERE 1
+    AND doctor.id_doctor = %s
\ No newline at end of file
@@ -0,0 +1,7 @@
+SELECT
+    chamber.id_chamber,
+    chamber.department,
+    chamber.class
+FROM chamber
+WHERE 1
+    AND chamber.id_chamber = %s
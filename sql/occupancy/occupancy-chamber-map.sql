@@ -0,0 +1,5 @@
+SELECT
+    chamber.id_chamber,
+    chamber.department,
+    chamber.class
+FROM chamber
\ No newline at end of file
@@ -0,0 +1,10 @@
+SELECT
+    doctor.id_doctor,
+    doctor.workplace,
+    doctor.first_name,
+    doctor.second_name,
+    doctor.assigned_patients
+FROM
+    doctor
+WHERE 1
+    AND date_discharge is NULL
\ No newline at end of file
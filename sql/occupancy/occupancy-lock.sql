@@ -0,0 +1 @@
+SELECT GET_LOCK(CONCAT(DATABASE(), '.department_occupancy'), 0)
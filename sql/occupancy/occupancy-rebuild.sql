@@ -0,0 +1,11 @@
+INSERT INTO department_occupancy (department, class, totalspace, occupied)
+SELECT
+    chamber.department,
+    chamber.class,
+    SUM(chamber.totalspace),
+    SUM(chamber.occupied)
+FROM chamber
+GROUP BY chamber.department, chamber.class
+ON DUPLICATE KEY UPDATE
+    totalspace = VALUES(totalspace),
+    occupied = VALUES(occupied)
@@ -0,0 +1,6 @@
+SELECT
+    department_occupancy.department,
+    department_occupancy.class,
+    department_occupancy.totalspace,
+    department_occupancy.occupied
+FROM department_occupancy
\ No newline at end of file
@@ -0,0 +1,5 @@
+SELECT COUNT(*)
+FROM information_schema.TABLES
+WHERE 1
+    AND TABLES.TABLE_SCHEMA = DATABASE()
+    AND TABLES.TABLE_NAME = 'department_occupancy'
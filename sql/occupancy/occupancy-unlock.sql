@@ -0,0 +1 @@
+SELECT RELEASE_LOCK(CONCAT(DATABASE(), '.department_occupancy'))
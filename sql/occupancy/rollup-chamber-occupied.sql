@@ -0,0 +1,6 @@
+UPDATE department_occupancy JOIN chamber
+    ON department_occupancy.department = chamber.department
+    AND department_occupancy.class = chamber.class
+SET department_occupancy.occupied = department_occupancy.occupied + %s
+WHERE 1
+    AND chamber.id_chamber = %s
\ No newline at end of file
@@ -0,0 +1,16 @@
+SELECT 
+    patient.id_patient,
+    patient.passport,
+    patient.date_income,
+    patient.date_birth,
+    patient.firstname,
+    patient.secondname,
+    patient.city,
+    patient.initial_diagnosis
+FROM
+    patient
+WHERE 1
+    AND patient.attending_doctor IS NULL
+    AND patient.id_patient > %s
+ORDER BY patient.id_patient ASC
+LIMIT %s
\ No newline at end of file
@@ -0,0 +1,7 @@
+SELECT
+    patient.id_patient,
+    patient.firstname,
+    patient.secondname
+FROM patient
+WHERE 1
+    AND patient.id_patient IN %s
\ No newline at end of file
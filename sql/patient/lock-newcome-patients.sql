@@ -0,0 +1,6 @@
+SELECT patient.id_patient FROM patient
+WHERE 1
+    AND patient.attending_doctor IS NULL
+ORDER BY patient.id_patient ASC
+LIMIT %s
+FOR UPDATE
\ No newline at end of file
@@ -1,7 +1,11 @@
+from os import makedirs
+
+
 def create_app(settings):
     '''Create new app instance'''
     if settings is None: raise ValueError('Application factory abort: bad config provided')
 
+    from app.policies import PolicyStore, authorize
     from .routes import app
     with app.app_context():
 
@@ -9,13 +13,76 @@ def create_app(settings):
         app.config['POLICIES'] = settings.POLICIES
         app.config['DB'] = settings.DB
         app.config['QUERIES'] = settings.QUERIES
+        app.config['PAGE_SIZE'] = settings.PAGE_SIZE
+        app.config['MAX_PAGE_SIZE'] = settings.MAX_PAGE_SIZE
+        app.config['IMPORT_BATCH_SIZE'] = settings.IMPORT_BATCH_SIZE
+        app.config['IMPORT_MAX_ERRORS'] = settings.IMPORT_MAX_ERRORS
+        app.config['MAX_BATCH_ASSIGNMENT'] = settings.MAX_BATCH_ASSIGNMENT
+        app.config['OCCUPANCY_REFRESH_INTERVAL'] = settings.OCCUPANCY_REFRESH_INTERVAL
+        app.config['OCCUPANCY_RECONCILE_INTERVAL'] = settings.OCCUPANCY_RECONCILE_INTERVAL
+        app.config['ETAG_MAX_AGE'] = settings.ETAG_MAX_AGE
+
+        # settings of the data layer, see `database.slowlog` and `database.routing`
+        from database.slowlog import SLOW_QUERIES
+        SLOW_QUERIES.configure(
+            settings.SLOW_QUERY_THRESHOLD, settings.SLOW_QUERY_EXPLAIN_SAMPLE, settings.SLOW_QUERY_EXPLAIN_INTERVAL)
+        from database.routing import configure, lag_window
+        configure(settings.DB_REPLICA_RETRY)
+
+        # policies are compiled once and checked for every request in a single pass
+        if 'policies' not in app.extensions:
+            app.extensions['policies'] = PolicyStore(
+                settings.POLICIES_FILE, settings.POLICIES, settings.POLICY_RELOAD_INTERVAL)
+            app.before_request(authorize)
+
+        # only databases with read replicas need the pin, see `view.pinning`
+        if lag_window(settings.DB) > 0 and 'pinning' not in app.extensions:
+            from .pinning import restore_pin, save_pin
+            # the longest time replicas are given to catch up, see `view.conditional`
+            app.extensions['pinning'] = lag_window(settings.DB)
+            app.before_request(restore_pin)
+            app.after_request(save_pin)
+
+        # `/metrics` is opt-in, without it the workers do not write their snapshots
+        if settings.METRICS_ENABLED and 'metrics' not in app.extensions:
+            from database.exposition import EXPORTER
+            EXPORTER.configure(settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL)
+            app.extensions['metrics'] = EXPORTER
+
+        # profiling is opt-in, with both settings off no hooks are registered
+        if (settings.PROFILE_SAMPLE > 0 or settings.PROFILE_HEADER) and 'profiler' not in app.extensions:
+            from app.profiling import RequestProfiler
+            app.extensions['profiler'] = RequestProfiler(
+                settings.PROFILE_SAMPLE, settings.PROFILE_HEADER, settings.PROFILE_DIR, settings.PROFILE_TOP,
+                settings.PROFILE_FLUSH_INTERVAL)
+            app.extensions['profiler'].init_app(app)
 
         from .hospital.routes import hospital_bp
         from .patients.routes import patients_bp
         from .auth.routes import auth_bp
-        
-        app.register_blueprint(hospital_bp, url_prefix='/hospital')
-        app.register_blueprint(patients_bp, url_prefix='/patients')
-        app.register_blueprint(auth_bp, url_prefix='/auth')
+
+        # the app is module-global, it may be set up more than once (e.g. by the workers)
+        for blueprint, prefix in ((hospital_bp, '/hospital'), (patients_bp, '/patients'), (auth_bp, '/auth')):
+            if blueprint.name not in app.blueprints: app.register_blueprint(blueprint, url_prefix=prefix)
+
+        if settings.ASSETS_FINGERPRINT and 'assets' not in app.extensions:
+            from .assets import AssetManifest
+            app.extensions['assets'] = AssetManifest()
+            app.extensions['assets'].init_app(app)
+
+        if settings.COMPRESS_MIN_SIZE > 0 and 'compress' not in app.extensions:
+            from .assets import compress_pages
+            app.extensions['compress'] = compress_pages(settings.COMPRESS_MIN_SIZE)
+            app.after_request(app.extensions['compress'])
+
+        if settings.TEMPLATE_CACHE_DIR:
+            from jinja2 import FileSystemBytecodeCache
+            makedirs(settings.TEMPLATE_CACHE_DIR, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(settings.TEMPLATE_CACHE_DIR)
+
+        # before the first request rather than on it
+        if settings.WARM_UP:
+            from .warmup import warm_up
+            warm_up(app)
 
         return app
@@ -0,0 +1,168 @@
+'''
+Fingerprinted static assets and compression of pages.
+
+When the app is created, every file of the static folders (of the app and of the blueprints)
+is read once and given a name with the hash of its content, e.g. `img/icon.3f2a9c1b7d4e.png`.
+`url_for('static', ...)` and `url_for('<blueprint>.static', ...)` produce the hashed names,
+which are served from memory with immutable cache headers and precompressed
+(gzip, and brotli if the module is installed) variants. Plain names are still served as before.
+
+HTML responses larger than `COMPRESS_MIN_SIZE` bytes are gzipped, streamed ones always are
+'''
+import gzip
+import mimetypes
+import zlib
+from hashlib import sha256
+from os import walk
+from os.path import isdir, join, relpath, splitext
+
+from flask import Flask, Response, request
+
+from app import make_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+assets_log = make_logger(__name__, 'logs/app.log')
+
+HASH_LENGTH = 12
+# a year, the name changes together with the content
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# variants which are not noticeably smaller are not kept
+MIN_SAVING = 0.9
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class Asset:
+    __slots__ = ('body', 'mimetype', 'etag', 'variants')
+
+    def __init__(self, body: bytes, mimetype: str, digest: str) -> None:
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = digest
+        # encoding -> compressed body
+        self.variants = {}
+        if not mimetype.startswith(COMPRESSIBLE): return
+
+        compressed = { 'gzip': gzip.compress(body, compresslevel=9, mtime=0) }
+        if brotli is not None: compressed['br'] = brotli.compress(body)
+        for encoding, variant in compressed.items():
+            if len(variant) < len(body) * MIN_SAVING: self.variants[encoding] = variant
+
+
+    def response(self) -> Response:
+        encoding = next(( encoding for encoding in ('br', 'gzip')
+            if encoding in self.variants and encoding in request.accept_encodings ), None)
+
+        if request.if_none_match.contains_weak(self.etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding] if encoding else self.body, mimetype=self.mimetype)
+            if encoding: response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(self.etag, weak=encoding is not None)
+        response.headers['Cache-Control'] = IMMUTABLE
+        if self.variants: response.vary.add('Accept-Encoding')
+        return response
+
+
+def fingerprint(filename: str, digest: str) -> str:
+    name, extension = splitext(filename)
+    return f'{name}.{digest[:HASH_LENGTH]}{extension}'
+
+
+class AssetManifest:
+    '''
+    Hashed names of the files of the static folders, by static endpoint
+    '''
+
+    def __init__(self) -> None:
+        # endpoint -> { filename: hashed filename }
+        self.names = {}
+        # (endpoint, hashed filename) -> Asset
+        self.assets = {}
+
+
+    def add_folder(self, endpoint: str, folder: str) -> None:
+        if folder is None or not isdir(folder): return
+        names = self.names.setdefault(endpoint, {})
+
+        for directory, _, files in walk(folder):
+            for file in files:
+                path = join(directory, file)
+                # url paths, not os ones
+                filename = relpath(path, folder).replace('\\', '/')
+                with open(path, 'rb') as source:
+                    body = source.read()
+
+                digest = sha256(body).hexdigest()
+                hashed = fingerprint(filename, digest)
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                names[filename] = hashed
+                self.assets[(endpoint, hashed)] = Asset(body, mimetype, digest[:HASH_LENGTH * 2])
+
+
+    def url_defaults(self, endpoint: str, values: dict) -> None:
+        names = self.names.get(endpoint)
+        if names is None: return
+        filename = values.get('filename')
+        if filename in names: values['filename'] = names[filename]
+
+
+    def view(self, endpoint: str, fallback):
+        def serve_static(filename: str):
+            asset = self.assets.get((endpoint, filename))
+            if asset is None: return fallback(filename=filename)
+            return asset.response()
+        return serve_static
+
+
+    def init_app(self, app: Flask) -> None:
+        '''Call once the blueprints are registered'''
+        folders = { 'static': app.static_folder }
+        folders.update({ f'{name}.static': blueprint.static_folder
+            for name, blueprint in app.blueprints.items() if blueprint.has_static_folder })
+
+        for endpoint, folder in folders.items():
+            if endpoint not in app.view_functions: continue
+            self.add_folder(endpoint, folder)
+            app.view_functions[endpoint] = self.view(endpoint, app.view_functions[endpoint])
+
+        app.url_defaults(self.url_defaults)
+        assets_log.info(msg=f'Fingerprinted {len(self.assets)} static files, brotli available: {brotli is not None}')
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str): chunk = chunk.encode()
+        # flushed with every chunk, so that the page is still rendered progressively
+        compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed: yield compressed
+    yield compressor.flush()
+
+
+def compress_pages(min_size: int):
+    '''`after_request` hook compressing HTML responses'''
+    def compress(response: Response) -> Response:
+        if response.mimetype != 'text/html' or response.status_code != 200: return response
+        if 'Content-Encoding' in response.headers or response.direct_passthrough: return response
+        if 'gzip' not in request.accept_encodings: return response
+
+        if response.is_streamed:
+            response.response = gzip_stream(response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < min_size: return response
+            response.set_data(gzip.compress(body, compresslevel=6))
+
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        # the same page in another encoding, see `view.conditional`
+        etag, weak = response.get_etag()
+        if etag and not weak: response.set_etag(etag, weak=True)
+        return response
+    return compress
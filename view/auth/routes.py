@@ -1,6 +1,4 @@
 from os import getenv
-import logging
-from logging.handlers import TimedRotatingFileHandler
 
 from flask import (
     Blueprint,
@@ -10,22 +8,10 @@ from flask import (
     redirect,
     render_template)
 
+from app import make_logger
 from controller.auth import PolicyController
 
-auth_view = logging.getLogger(__name__)
-# enable logging routines
-# write log to a file with specified filename (provided via environmental variable)
-# set needed level and optionally disable logging completely
-
-DEBUGLEVEL = getenv('DEBUG_LEVEL','DEBUG')
-LOGFILE = getenv('APP_LOGFILE_NAME', 'logs/auth.log')
-auth_view.disabled = getenv('LOG_ON', "True") == "False"
-
-auth_view.setLevel(getattr(logging, DEBUGLEVEL))
-handler = TimedRotatingFileHandler(filename=f'{LOGFILE}', encoding='utf-8', when='h', interval=5, backupCount=0)
-formatter = logging.Formatter('[%(asctime)s]::[%(levelname)s]::[%(name)s]::%(message)s', '%D # %H:%M:%S')
-handler.setFormatter(formatter)
-auth_view.addHandler(handler)
+auth_view = make_logger(__name__, getenv('APP_LOGFILE_NAME', 'logs/auth.log'))
 
 auth_bp = Blueprint(
     'auth_bp',
@@ -0,0 +1,80 @@
+'''
+Conditional GET for pages built from the database.
+
+ETag of a page is derived from the data versions of the tables it is built from
+(see `database.versions`), the session user and the URL. While none of the tables changed,
+the browser gets `304 Not Modified` before any query runs or any template is rendered.
+
+Pages get no ETag when any of their own queries failed, when they are streamed
+(their rows are read after the view returns) and, with read replicas, when they are rendered
+within the lag window after a write to their tables, as they may show the rows
+from before the write (see `database.routing`)
+'''
+from functools import wraps
+from hashlib import blake2b
+from time import time
+
+from flask import (
+    Response,
+    current_app,
+    make_response,
+    request,
+    session)
+
+from database.metrics import FAILURES
+from database.routing import PINNED_UNTIL
+from database.versions import VERSIONS
+
+
+def page_etag(tables: tuple) -> str:
+    max_age = current_app.config.get('ETAG_MAX_AGE', 300)
+    parts = (
+        VERSIONS.stamp(tables),
+        session.get('id'),
+        session.get('group'),
+        request.full_path,
+        int(time() // max_age) if max_age > 0 else 0,
+    )
+    return blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def may_lag(tables: tuple, started: float) -> bool:
+    '''Whether the page may have been read from replicas which did not catch up with the writes to `tables`'''
+    window = current_app.extensions.get('pinning', 0)
+    if not window or PINNED_UNTIL.get() > started: return False
+    return VERSIONS.changed_at(tables) + window > started
+
+
+def versioned(*tables: str):
+    '''
+    Answer GET requests of the view with 304 while none of the `tables` changed.
+    Goes right above the view function, below `requires_login` and `requires_permission`
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET': return view(*args, **kwargs)
+
+            # versions are read before the data, a write in between only makes the next ETag differ
+            etag = page_etag(tables)
+            # weak comparison, compressed pages carry weak ETags (see `view.assets`)
+            if request.if_none_match.contains_weak(etag):
+                not_modified = Response(status=304)
+                not_modified.set_etag(etag)
+                return not_modified
+
+            # failures of the queries run by this request only
+            failures = [0]
+            token = FAILURES.set(failures)
+            started = time()
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                FAILURES.reset(token)
+            # pages rendered after failed queries or from lagging replicas are not worth keeping
+            if response.status_code == 200 and not response.is_streamed and not failures[0] and not may_lag(tables, started):
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -12,6 +12,7 @@ from app import make_logger
 from app.policies import requires_login, requires_permission
 from controller.hospital import HospitalController
 from controller import Validator
+from ..conditional import versioned
 
 view_logger = make_logger(__name__, 'logs/hospital.log')
 
@@ -32,8 +33,10 @@ def menu():
 @hospital_bp.route('/assigned-patients', methods=['GET'])
 @requires_login
 @requires_permission
+@versioned('patient')
 def assignment_list():
     view_logger.info(msg=f'Renders assignation list for {session["name"]}')
+    # a doctor has few patients: rendered at once, so that the list is cached and the page gets an ETag
     assigned = HospitalController().get_assigned_to_doctor(session['id'])
     return render_template('hospital_doctor.j2', assigned=assigned)
 
@@ -41,6 +44,7 @@ def assignment_list():
 @hospital_bp.route('/appointments', methods=['GET', 'POST'])
 @requires_login
 @requires_permission
+@versioned('appointment', 'patient')
 def list_appointments():
     view_logger.info(msg=f'Renders appointment list')
 
@@ -1,8 +1,10 @@
+from functools import partial
 from json import loads, dumps
 from json.decoder import JSONDecodeError
 
 from flask import (
     Blueprint,
+    current_app,
     request,
     render_template,
     redirect,
@@ -13,6 +15,9 @@ from app import make_logger
 from app.policies import requires_login, requires_permission
 from controller.patients import PatientController
 from controller.hospital import HospitalController
+from database.fanout import fan_out
+from ..conditional import versioned
+from ..streaming import render_streamed
 
 patients_view = make_logger(__name__, 'logs/patients.log')
 
@@ -22,6 +27,14 @@ patients_bp = Blueprint(
     template_folder='templates/',
     static_folder='static/')
 
+def page_params() -> dict:
+    '''Keyset pagination params of the listing page: `after`/`before` patient id and `limit`'''
+    params = { key: request.args.get(key, '') for key in ('after', 'before', 'limit') }
+    params = { key: int(value) for key, value in params.items() if value.isdigit() }
+    params.setdefault('limit', current_app.config['PAGE_SIZE'])
+    return params
+
+
 @patients_bp.route('menu', methods=['GET'])
 @requires_login
 @requires_permission
@@ -46,6 +59,26 @@ def add_new_patient():
     return render_template('patient_create.j2', status=True, success=status)
 
 
+@patients_bp.route('/import', methods=['POST', 'GET'])
+@requires_login
+@requires_permission
+def import_patients():
+    patients_view.info(msg=f'Renders page for bulk patient import')
+
+    if request.method == 'GET':
+        return render_template('patient_import.j2')
+
+    uploaded = request.files.get('patients_file')
+    if uploaded is None or not uploaded.filename:
+        return render_template('patient_import.j2', report=None, failed=True)
+
+    file_format = uploaded.filename.rsplit('.', 1)[-1].lower()
+    file_format = 'jsonl' if file_format in ('jsonl', 'json', 'ndjson') else file_format
+
+    report = PatientController().import_patients(uploaded.stream, file_format)
+    return render_template('patient_import.j2', report=report, failed=report is None)
+
+
 @patients_bp.route('/discharge', methods=['POST', 'GET'])
 @requires_login
 @requires_permission
@@ -53,55 +86,64 @@ def list_dischargable():
     patients_view.info(msg=f'Renders page for patient discharging')
 
     if request.method == 'GET':
-        with_diag = PatientController().fetch_dischargable_patients()
-        return render_template('patient_discharge.j2', with_diag=with_diag)
+        with_diag = PatientController().fetch_dischargable_patients(**page_params())
+        return render_streamed('patient_discharge.j2', with_diag=with_diag)
 
     to_remove_id = request.values.get('to_remove_id')
     attending_doc_id = request.values.get('attending_doctor')
     chamber_id = request.values.get('occupied_chamber')
 
     PatientController().discharge_patient(to_remove_id, attending_doc_id, chamber_id)
-    with_diag = PatientController().fetch_dischargable_patients()
+    with_diag = PatientController().fetch_dischargable_patients(**page_params())
 
-    return render_template('patient_discharge.j2', show_alert=True, with_diag=with_diag)
+    return render_streamed('patient_discharge.j2', show_alert=True, with_diag=with_diag)
 
 
 @patients_bp.route('/list', methods=['POST', 'GET'])
 @requires_login
 @requires_permission
+@versioned('patient', 'department')
 def list_patients():
     patients_view.info(msg=f'Renders patient list')
 
-    patients = PatientController().fetch_unassigned()
+    patient_controller = PatientController()
+    # the listing, departments and selected patient do not depend on each other, fetched concurrently
+    calls = [
+        (partial(patient_controller.fetch_unassigned, **page_params()),),
+        (HospitalController().get_department_list,),
+    ]
+    if request.method == 'POST':
+        calls.append((patient_controller.find_patient, request.values.get('patient_id')))
+
+    patients, departments, *patient = fan_out(*calls)
 
     if patients is None:
         patients_view.warning(msg=f'Renders empty page bc fetched data is empty')
         return render_template('hospital_empty.j2')
 
+    # listed twice on the page: in batch assignment form and in the form for single patient
+    departments = list(departments) if departments is not None else None
+
     if request.method == 'GET':
-        
-        if 'assign_response' not in request.values:
-                return render_template(
-                'patient_list.j2',
-                patients=patients)
+        responses = {}
+
+        if 'assign_response' in request.values:
+            responses.update(has_response=True, assign_response=loads(request.values['assign_response']))
 
-        assign_response = loads(request.values['assign_response'])
+        if 'batch_response' in request.values:
+            responses.update(has_batch_response=True, batch_response=loads(request.values['batch_response']))
 
-        return render_template(
+        return render_streamed(
             'patient_list.j2',
             patients=patients,
-            has_response=True,
-            assign_response=assign_response)
-
-    departments = HospitalController().get_department_list()
-    patient = request.values.get('patient_id')
-    patient = PatientController().find_patient(patient)
+            departments=departments,
+            **responses)
 
-    return render_template(
+    return render_streamed(
         'patient_list.j2',
         has_departments=True,
         departments=departments,
-        detailed_patient_data=patient,
+        detailed_patient_data=patient[0],
         patients=patients)
 
 
@@ -119,9 +161,25 @@ def assign_to_department():
     return redirect(url_for('.list_patients', assign_response=dumps(assign_response)))
 
 
+@patients_bp.route('/assign-all', methods=['POST'])
+@requires_login
+@requires_permission
+def assign_all_to_department():
+    patients_view.info(msg=f'Recieved request to assign all the newcome patients into department')
+
+    where_to_assign = request.values.get('department_id', '')
+    if not where_to_assign.isdigit():
+        return redirect(url_for('page_not_found_redirect'))
+
+    batch_response = PatientController().assign_all(int(where_to_assign))
+    patients_view.debug(msg=f'Redirects back to patient list')
+    return redirect(url_for('.list_patients', batch_response=dumps(batch_response)))
+
+
 @patients_bp.route('/department', methods=['GET', 'POST'])
 @requires_login
 @requires_permission
+@versioned('department')
 def department_report():
     patients_view.info(msg=f'Renders department report')
     departments = HospitalController().get_department_list()
@@ -0,0 +1,24 @@
+'''
+Read-your-writes for the sessions.
+
+Reads go to the replicas of the database (see `database.routing`), which may lag behind
+the primary. After a user writes, their reads are pinned to the primary for a few seconds;
+the pin is kept in the session, so it holds for the next requests served by any worker
+'''
+from flask import Response, session
+
+from database.routing import PINNED_UNTIL
+
+SESSION_KEY = 'pinned_until'
+
+
+def restore_pin() -> None:
+    '''`before_request` hook, set for every request since threads of the server are reused'''
+    PINNED_UNTIL.set(session.get(SESSION_KEY, 0.0))
+
+
+def save_pin(response: Response) -> Response:
+    '''`after_request` hook, the session is only changed by the requests which wrote'''
+    pinned_until = PINNED_UNTIL.get()
+    if pinned_until > session.get(SESSION_KEY, 0.0): session[SESSION_KEY] = pinned_until
+    return response
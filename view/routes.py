@@ -7,6 +7,8 @@ This module contains routes for main menu and something else, maybe
 '''
 from flask import (
     Flask,
+    Response,
+    current_app,
     render_template,
     session)
 
@@ -32,3 +34,11 @@ def exit_page() -> str:
 @app.route('/menu', methods=['GET'])
 def main_menu():
     return render_template('entrypoint.j2')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # latencies of named queries and cache counters of all the workers, scraped by Prometheus
+    exporter = current_app.extensions.get('metrics')
+    if exporter is None: return Response(status=404)
+    return Response(exporter.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,24 @@
+'''
+Helpers for streamed rendering.
+
+Templates are rendered chunk by chunk while the response is sent, so that
+lazily fetched rows (see `DataSource.fetch_results(..., stream=True)`) are never
+held in memory all at once
+'''
+from flask import (
+    Response,
+    current_app,
+    stream_with_context)
+
+# number of template chunks joined before being sent to the client
+BUFFER_SIZE = 16
+
+def render_streamed(template_name: str, **context) -> Response:
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(BUFFER_SIZE)
+
+    return Response(stream_with_context(stream))
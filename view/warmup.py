@@ -0,0 +1,74 @@
+'''
+Warm-up of a freshly created app.
+
+Run by `create_app()` before the app serves requests, so that the first requests after
+deploy or worker restart do not pay for compiling templates, opening connections
+and filling the caches of reference data
+'''
+from time import perf_counter
+
+from flask import Flask
+from jinja2 import TemplateError
+
+from app import make_logger
+from database.ORM import DataSource
+from database.pool import get_pool
+from database.routing import get_replicas
+
+warmup_log = make_logger(__name__, 'logs/app.log')
+
+TEMPLATE_EXTENSIONS = ('j2', 'html')
+
+
+def compile_templates(app: Flask) -> int:
+    # templates of the app and all the blueprints, compiled code lands in the bytecode cache
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=TEMPLATE_EXTENSIONS):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except TemplateError as err:
+            warmup_log.error(msg=f'Failed to compile template {name}: {err}')
+    return compiled
+
+
+def open_pools(db_config: dict) -> dict:
+    opened = {}
+    for entry, config in db_config.items():
+        opened[entry] = get_pool(config).warm_up()
+        # replicas serve the reads, their pools are opened as well
+        for index, replica in enumerate(get_replicas(config).replicas):
+            opened[f'{entry}.replica{index}'] = get_pool(replica).warm_up()
+    return opened
+
+
+def prime_caches(db_config: dict, sql_dir: str) -> list:
+    # cached queries without args are the reference data (departments, doctors)
+    primed = []
+    for config in db_config.values():
+        cached = config.get('CACHE', {}).get('QUERIES', [])
+        if not cached: continue
+
+        source = DataSource(config, sql_dir)
+        for name in (source.queries if cached == '*' else cached):
+            query = source.queries.get(name)
+            if query is None or query.arity or not source.cache.cacheable(query): continue
+            if source.fetch_results(name) is not None: primed.append(name)
+    return primed
+
+
+def warm_up(app: Flask) -> None:
+    '''Compile templates, open connection pools and fill the caches, needs app context'''
+    started = perf_counter()
+
+    templates = compile_templates(app)
+    pools = open_pools(app.config['DB'])
+    primed = prime_caches(app.config['DB'], app.config['QUERIES'])
+
+    # the occupancy rollup is loaded on first use otherwise
+    from controller.occupancy import OCCUPANCY
+    rollup = OCCUPANCY.current()
+
+    warmup_log.info(msg=(
+        f'Warmed up in {perf_counter() - started:.3f}s: {templates} templates, '
+        f'connections {pools}, cached {primed}, occupancy rollup available: {rollup}'))